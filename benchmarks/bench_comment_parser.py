@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Compares main_app._update_from_comment with the card-by-card implementation
+it replaced, on PHANGS headers with hundreds of MJD interval cards.
+
+Usage:
+    python benchmarks/bench_comment_parser.py [--intervals N] [--planes N]
+"""
+
+import argparse
+import random
+import timeit
+
+from astropy.io import fits
+
+from caom2 import Algorithm, Artifact, Chunk, DerivedObservation, Part
+from caom2 import Plane, ProductType, ReleaseType
+from caom2 import CalibrationLevel, CoordBounds1D, RefCoord, CoordAxis1D
+from caom2 import CoordRange1D, Axis, TemporalWCS, Proposal, Provenance
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import main_app
+
+
+COMMENTS = [
+    'Produced with PHANGS-ALMA pipeline version 4.0 Build 935',
+    'Galaxy properties from PHANGS sample table version 1.6',
+    'Calibration Level 4 (ANALYSIS_PRODUCT)',
+    'PHANGS-ALMA Public Release 1',
+    'Generated by the Physics at High Angular resolution',
+    'in nearby GalaxieS (PHANGS) collaboration',
+    'Canonical Reference: Leroy et al. (2021), ApJ, Submitted',
+    'Release generated at 2021-03-04T07:28:10.245340',
+    'Data from ALMA Proposal ID: 2017.1.00886.L',
+    'ALMA Proposal PI: Schinnerer, Eva',
+]
+
+
+def legacy_update_from_comment(observation, phangs_name, headers):
+    """The implementation before the single-pass parser."""
+    chunk = None
+    for plane in observation.planes.values():
+        if plane.product_id != phangs_name.product_id:
+            continue
+        if plane.provenance is None:
+            plane.provenance = Provenance(name='PHANGS-ALMA pipeline')
+
+        for artifact in plane.artifacts.values():
+            if artifact.uri != phangs_name.file_uri:
+                continue
+            for part in artifact.parts.values():
+                chunk = part.chunks[0]
+                break
+
+        for entry in headers[0].get('COMMENT'):
+            if 'pipeline version ' in entry:
+                plane.provenance.version = entry.split(' version ')[1]
+            elif 'Calibration Level' in entry:
+                level = entry.split()[2]
+                if level == '4':
+                    plane.calibration_level = \
+                        CalibrationLevel.ANALYSIS_PRODUCT
+            elif 'PHANGS-ALMA Public Release' in entry:
+                plane.provenance.project = 'PHANGS-ALMA'
+            elif 'in nearby GalaxieS (PHANGS) collaboration' in entry:
+                plane.provenance.organization = 'PHANGS'
+            elif 'Release generated at ' in entry:
+                plane.provenance.last_executed = mc.make_time_tz(
+                    entry.split(' at ')[1])
+            elif 'Data from ALMA Proposal ID:' in entry:
+                observation.proposal = Proposal(entry.split(':')[1].strip())
+            elif 'Canonical Reference: ' in entry:
+                plane.provenance.producer = entry.split(': ')[1]
+            elif 'ALMA Proposal PI:' in entry:
+                observation.proposal.pi_name = entry.split(': ')[1]
+            elif 'Observed in MJD interval ' in entry:
+                if chunk is not None:
+                    bits = entry.split()[4].split(',')
+                    start_ref_coord = RefCoord(
+                        0.5, mc.to_float(bits[0].replace('[', '')))
+                    end_ref_coord = RefCoord(
+                        1.5, mc.to_float(bits[1].replace(']', '')))
+                    sample = CoordRange1D(start_ref_coord, end_ref_coord)
+                    if chunk.time is None:
+                        coord_bounds = CoordBounds1D()
+                        axis = CoordAxis1D(axis=Axis('TIME', 'd'))
+                        chunk.time = TemporalWCS(axis, timesys='UTC')
+                        chunk.time.axis.bounds = coord_bounds
+                    chunk.time.axis.bounds.samples.append(sample)
+
+
+def make_header(intervals):
+    header = fits.Header()
+    for comment in COMMENTS:
+        header.add_comment(comment)
+    start = 58000.0
+    for ignore in range(intervals):
+        start += random.uniform(0.1, 10.0)
+        end = start + random.uniform(0.01, 5.0)
+        header.add_comment(
+            f'Observed in MJD interval [{start:.6f},{end:.6f}]')
+    return header
+
+
+def make_observation(phangs_names):
+    result = DerivedObservation(
+        main_app.COLLECTION, phangs_names[0].obs_id,
+        Algorithm('phangs_imaging'))
+    for phangs_name in phangs_names:
+        plane = Plane(phangs_name.product_id)
+        artifact = Artifact(phangs_name.file_uri, ProductType.SCIENCE,
+                            ReleaseType.DATA)
+        part = Part('0')
+        part.chunks.append(Chunk())
+        artifact.parts.add(part)
+        plane.artifacts.add(artifact)
+        result.planes.add(plane)
+    return result
+
+
+def _samples(observation):
+    result = []
+    for plane in observation.planes.values():
+        for artifact in plane.artifacts.values():
+            for part in artifact.parts.values():
+                for chunk in part.chunks:
+                    if chunk.time is not None:
+                        result.append(
+                            [(ii.start.val, ii.end.val)
+                             for ii in chunk.time.axis.bounds.samples])
+    return result
+
+
+def run(intervals, planes, repeat):
+    headers = [make_header(intervals)]
+    suffixes = ['', '_noise', '_strict_mom0', '_strict_mom1', '_broad_mom0',
+                '_strictmask', '_broadmask', '_strict_emom0']
+    phangs_names = [
+        main_app.PHANGSName(file_name=f'ngc2903_7m+tp_co21{ii}.fits')
+        for ii in (suffixes * (planes // len(suffixes) + 1))[:planes]]
+    results = {}
+    for name, f in [('legacy', legacy_update_from_comment),
+                    ('current', main_app._update_from_comment)]:
+        observation = make_observation(phangs_names)
+
+        def _one_observation():
+            for phangs_name in phangs_names:
+                f(observation, phangs_name, headers)
+
+        elapsed = min(timeit.repeat(_one_observation, number=1,
+                                    repeat=repeat))
+        results[name] = (elapsed, observation)
+        print(f'{name:8} {intervals:6d} intervals {planes:3d} planes '
+              f'{elapsed * 1000:10.3f} ms')
+    # the legacy samples are in card order, and not merged
+    legacy_samples = [
+        main_app._merge_intervals(ii)[0]
+        for ii in _samples(make_and_apply(legacy_update_from_comment,
+                                          phangs_names, headers))]
+    assert legacy_samples == _samples(make_and_apply(
+        main_app._update_from_comment, phangs_names, headers)), \
+        'results differ'
+    print(f'speedup {results["legacy"][0] / results["current"][0]:.1f}x')
+
+
+def make_and_apply(f, phangs_names, headers):
+    observation = make_observation(phangs_names)
+    for phangs_name in phangs_names:
+        f(observation, phangs_name, headers)
+    return observation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--intervals', type=int, action='append',
+                        help='MJD interval cards per header. '
+                             'Default is 10, 100, 500.')
+    parser.add_argument('--planes', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    random.seed(42)
+    for intervals in args.intervals or [10, 100, 500]:
+        run(intervals, args.planes, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Compares the bytes read and the peak RSS of the header-only reader in
+phangs2caom2.headers with reading the same files through astropy.
+
+Each measurement runs in a fresh process, so the peak RSS is for that one
+file and that one method.
+
+Usage:
+    python benchmarks/bench_header_read.py [file.fits ...]
+
+With no files, synthesized PHANGS-shaped files are used: a 2-D moment map,
+and cubes of increasing size.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from astropy.io import fits
+
+from phangs2caom2 import headers
+
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+TEMPLATE = os.path.join(
+    os.path.dirname(THIS_DIR),
+    'phangs2caom2/tests/data/ngc2903_7m+tp_co21.fits.header')
+
+# (file name, shape) - the largest is about 1 GB
+SYNTHESIZED = [
+    ('ngc2903_7m+tp_co21_strict_mom0.fits', (1024, 1024)),
+    ('ngc2903_7m+tp_co21.fits', (64, 1024, 1024)),
+    ('ngc2903_12m+7m+tp_co21.fits', (256, 1024, 1024)),
+]
+
+
+def _bytes_read():
+    # Linux-only, the number of bytes this process has asked to read
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _stream(fqn):
+    return headers.read_primary_header(fqn)
+
+
+def _astropy(fqn):
+    with fits.open(fqn, memmap=False) as hdul:
+        return hdul[0].header, hdul[0].data
+
+
+METHODS = {'stream': _stream, 'astropy': _astropy}
+
+
+def _measure(method, fqn, queue):
+    start_read = _bytes_read()
+    start = time.perf_counter()
+    METHODS[method](fqn)
+    elapsed = time.perf_counter() - start
+    end_read = _bytes_read()
+    read = None
+    if start_read is not None and end_read is not None:
+        read = end_read - start_read
+    # ru_maxrss is in KB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, read, peak))
+
+
+def measure(method, fqn):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(method, fqn, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def synthesize(working_directory):
+    """Write the header, and leave the data unit as a sparse run of zeros,
+    so that making the files does not inflate the RSS of this process."""
+    template = headers.get_local_headers(TEMPLATE)[0]
+    result = []
+    for file_name, shape in SYNTHESIZED:
+        fqn = os.path.join(working_directory, file_name)
+        header = fits.PrimaryHDU(
+            data=np.zeros((1,) * len(shape), dtype=np.float32),
+            header=template).header
+        for index, length in enumerate(reversed(shape)):
+            header[f'NAXIS{index + 1}'] = length
+        raw = header.tostring().encode('ascii')
+        data_size = int(np.prod(shape)) * 4
+        padding = -data_size % headers.BLOCK_SIZE
+        with open(fqn, 'wb') as f:
+            f.write(raw)
+            f.truncate(len(raw) + data_size + padding)
+        result.append(fqn)
+    return result
+
+
+def report(fqns, methods):
+    print(f'{"file":45} {"size MB":>9} {"method":>8} {"seconds":>9} '
+          f'{"read MB":>9} {"peak RSS MB":>12}')
+    for fqn in fqns:
+        size = os.path.getsize(fqn) / 1024 / 1024
+        for method in methods:
+            elapsed, read, peak = measure(method, fqn)
+            read = 'n/a' if read is None else f'{read / 1024 / 1024:.3f}'
+            print(f'{os.path.basename(fqn):45} {size:9.1f} {method:>8} '
+                  f'{elapsed:9.4f} {read:>9} {peak / 1024:12.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--method', choices=list(METHODS.keys()),
+                        action='append',
+                        help='Default is all methods.')
+    args = parser.parse_args()
+    methods = args.method or list(METHODS.keys())
+    if args.files:
+        report(args.files, methods)
+    else:
+        with tempfile.TemporaryDirectory() as working_directory:
+            report(synthesize(working_directory), methods)
+
+
+if __name__ == '__main__':
+    main()
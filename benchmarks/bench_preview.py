@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+
+"""
+Compares the time and the peak RSS of the preview images of
+phangs2caom2.preview_augmentation, which stream over the spectral planes,
+with loading the whole data unit through astropy and reducing it in one go.
+
+Each measurement runs in a fresh process, so the peak RSS is for that one
+file and that one method.
+
+Usage:
+    python benchmarks/bench_preview.py [file.fits ...]
+
+With no files, synthesized PHANGS-shaped files are used: a 2-D moment map,
+and cubes of increasing size, filled with noise and a blank border.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from astropy.io import fits
+
+from phangs2caom2 import headers, preview_augmentation
+
+
+# (file name, shape) - the largest is about 1 GB
+SYNTHESIZED = [
+    ('ngc2903_7m+tp_co21_strict_mom0.fits', (1024, 1024)),
+    ('ngc2903_7m+tp_co21.fits', (64, 1024, 1024)),
+    ('ngc2903_12m+7m+tp_co21.fits', (256, 1024, 1024)),
+]
+BORDER = 100
+
+
+def _stream(fqn):
+    return preview_augmentation.get_images(fqn)
+
+
+def _astropy(fqn):
+    with fits.open(fqn, memmap=False) as hdul:
+        data = hdul[0].data
+        if data.ndim == 2:
+            return {'peak': data}
+        data = data.reshape((-1,) + data.shape[-2:])
+        return {'peak': np.nanmax(data, axis=0)}
+
+
+METHODS = {'stream': _stream, 'astropy': _astropy}
+
+
+def _measure(method, fqn, queue):
+    start = time.perf_counter()
+    METHODS[method](fqn)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, peak))
+
+
+def measure(method, fqn):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(method, fqn, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def synthesize(working_directory):
+    """Write the data unit one plane at a time, so that making the files
+    does not inflate the RSS of this process."""
+    rng = np.random.default_rng(18)
+    result = []
+    for file_name, shape in SYNTHESIZED:
+        fqn = os.path.join(working_directory, file_name)
+        header = fits.PrimaryHDU(
+            data=np.zeros((1,) * len(shape), dtype=np.float32)).header
+        for index, length in enumerate(reversed(shape)):
+            header[f'NAXIS{index + 1}'] = length
+        planes = int(np.prod(shape[:-2]))
+        data_size = planes * int(np.prod(shape[-2:])) * 4
+        with open(fqn, 'wb') as f:
+            f.write(header.tostring().encode('ascii'))
+            for ignore in range(planes):
+                plane = rng.random(shape[-2:], dtype=np.float32)
+                plane[:BORDER] = np.nan
+                plane[:, :BORDER] = np.nan
+                f.write(plane.astype('>f4').tobytes())
+            f.write(b'\0' * (-data_size % headers.BLOCK_SIZE))
+        result.append(fqn)
+    return result
+
+
+def report(fqns, methods):
+    print(f'{"file":45} {"size MB":>9} {"method":>8} {"seconds":>9} '
+          f'{"peak RSS MB":>12}')
+    for fqn in fqns:
+        size = os.path.getsize(fqn) / 1024 / 1024
+        for method in methods:
+            elapsed, peak = measure(method, fqn)
+            print(f'{os.path.basename(fqn):45} {size:9.1f} {method:>8} '
+                  f'{elapsed:9.4f} {peak / 1024:12.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--method', choices=list(METHODS.keys()),
+                        action='append',
+                        help='Default is all methods.')
+    args = parser.parse_args()
+    methods = args.method or list(METHODS.keys())
+    if len(args.files) > 0:
+        report(args.files, methods)
+    else:
+        with tempfile.TemporaryDirectory() as working_directory:
+            report(synthesize(working_directory), methods)
+
+
+if __name__ == '__main__':
+    main()
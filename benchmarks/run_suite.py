@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Benchmarks for the PHANGS ingest hot paths, on synthesized file names and
+headers at the scale of a full release.
+
+Each benchmark reports throughput, in items per second, and the peak
+memory traced while it runs. Throughput is measured without tracing, and
+memory is measured in a second, traced, run. The results are compared with
+a stored baseline, and the exit status is 1 when any benchmark is slower,
+or uses more memory, than the baseline by more than the tolerance.
+
+Usage:
+    python benchmarks/run_suite.py [--galaxies N] [--only NAME ...]
+    python benchmarks/run_suite.py --save-baseline
+"""
+
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from collections import OrderedDict
+
+from mock import patch
+
+from caom2 import Algorithm, Artifact, Chunk, DerivedObservation, Part
+from caom2 import Plane, ProductType, ReleaseType
+from caom2utils import ObsBlueprint
+from phangs2caom2 import main_app, work
+
+import synthesize
+
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+BASELINE_FQN = os.path.join(THIS_DIR, 'baseline.json')
+PLUGIN = main_app.__file__
+
+
+class Context(object):
+    """The synthesized inputs, shared by all the benchmarks."""
+
+    def __init__(self, galaxy_count, e2e_observations, seed=42):
+        rng = random.Random(seed)
+        self.file_names = synthesize.file_names(galaxy_count)
+        self.uris = [f'ad:{main_app.ARCHIVE}/{ii}' for ii in self.file_names]
+        self.groups = work.group_by_obs_id(self.file_names)
+        self.headers = {
+            ii: synthesize.make_header(ii, rng=rng) for ii in self.file_names}
+        self.e2e_groups = list(self.groups.items())[:e2e_observations]
+        self.rng = rng
+
+
+def _clear_caches():
+    main_app._parse_file_id.cache_clear()
+    main_app._get_phangs_name.cache_clear()
+    main_app._blueprint_templates.clear()
+    main_app._comment_values.clear()
+
+
+def _make_observation(obs_id, file_names):
+    result = DerivedObservation(
+        main_app.COLLECTION, obs_id, Algorithm('phangs_imaging'))
+    for file_name in file_names:
+        phangs_name = main_app.get_phangs_name(file_name)
+        plane = Plane(phangs_name.product_id)
+        artifact = Artifact(phangs_name.file_uri, ProductType.SCIENCE,
+                            ReleaseType.DATA)
+        part = Part('0')
+        part.chunks.append(Chunk())
+        artifact.parts.add(part)
+        plane.artifacts.add(artifact)
+        result.planes.add(plane)
+    return result
+
+
+def setup_none(context):
+    return context
+
+
+def bench_phangs_name(context):
+    for file_name in context.file_names:
+        main_app.PHANGSName(file_name=file_name)
+    return len(context.file_names)
+
+
+def bench_accumulate_bp(context):
+    module = importlib.import_module(main_app.__name__)
+    for uri in context.uris:
+        main_app.accumulate_bp(ObsBlueprint(module=module), uri)
+    return len(context.uris)
+
+
+def bench_build_blueprints(context):
+    for file_names in context.groups.values():
+        main_app._build_blueprints(
+            [f'ad:{main_app.ARCHIVE}/{ii}' for ii in file_names])
+    return len(context.file_names)
+
+
+def setup_update_from_comment(context):
+    observations = [_make_observation(obs_id, file_names)
+                    for obs_id, file_names in context.groups.items()]
+    return context, observations
+
+
+def bench_update_from_comment(state):
+    context, observations = state
+    for observation, file_names in zip(observations, context.groups.values()):
+        for file_name in file_names:
+            main_app._update_from_comment(
+                observation, main_app.get_phangs_name(file_name),
+                [context.headers[file_name]])
+    return len(context.file_names)
+
+
+def setup_to_caom2(context):
+    working_directory = tempfile.mkdtemp()
+    state = []
+    for obs_id, file_names in context.e2e_groups:
+        local = synthesize.write_header_files(
+            file_names, working_directory, rng=context.rng)
+        lineage = [
+            f'{main_app.get_phangs_name(ii).product_id}/'
+            f'ad:{main_app.ARCHIVE}/{ii}' for ii in file_names]
+        output = os.path.join(working_directory, f'{obs_id}.xml')
+        state.append((obs_id, local, lineage, output))
+    return state
+
+
+def _get_file_info(archive, file_id):
+    return {'type': 'application/fits'}
+
+
+@patch('caom2utils.fits2caom2.CadcDataClient')
+def bench_to_caom2(state, data_client_mock):
+    data_client_mock.return_value.get_file_info.side_effect = _get_file_info
+    count = 0
+    argv = sys.argv
+    try:
+        for obs_id, local, lineage, output in state:
+            sys.argv = (
+                f'{main_app.APPLICATION} --no_validate --local '
+                f'{" ".join(local)} --observation {main_app.COLLECTION} '
+                f'{obs_id} -o {output} --plugin {PLUGIN} --module {PLUGIN} '
+                f'--lineage {" ".join(lineage)}').split()
+            main_app.to_caom2()
+            count += len(local)
+    finally:
+        sys.argv = argv
+    return count
+
+
+# name => (setup, benchmark). setup is not timed.
+BENCHMARKS = OrderedDict([
+    ('phangs_name', (setup_none, bench_phangs_name)),
+    ('accumulate_bp', (setup_none, bench_accumulate_bp)),
+    ('build_blueprints', (setup_none, bench_build_blueprints)),
+    ('update_from_comment',
+     (setup_update_from_comment, bench_update_from_comment)),
+    ('to_caom2', (setup_to_caom2, bench_to_caom2)),
+])
+
+
+def measure(name, context):
+    setup, benchmark = BENCHMARKS[name]
+
+    _clear_caches()
+    state = setup(context)
+    start = time.perf_counter()
+    count = benchmark(state)
+    elapsed = time.perf_counter() - start
+
+    _clear_caches()
+    state = setup(context)
+    tracemalloc.start()
+    try:
+        benchmark(state)
+        ignore, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'items': count,
+            'seconds': elapsed,
+            'throughput': count / elapsed,
+            'peak_mb': peak / 1024 / 1024}
+
+
+def compare(result, baseline, tolerance):
+    """
+    :return: list of str descriptions of the regressions, empty when there
+        are none
+    """
+    regressions = []
+    if baseline is None:
+        return regressions
+    if result['throughput'] < baseline['throughput'] * (1.0 - tolerance):
+        regressions.append(
+            f'throughput {result["throughput"]:.1f}/s, baseline '
+            f'{baseline["throughput"]:.1f}/s')
+    if result['peak_mb'] > baseline['peak_mb'] * (1.0 + tolerance):
+        regressions.append(
+            f'peak {result["peak_mb"]:.2f} MB, baseline '
+            f'{baseline["peak_mb"]:.2f} MB')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--galaxies', type=int, default=20)
+    parser.add_argument('--e2e-observations', type=int, default=4,
+                        help='Number of observations for to_caom2.')
+    parser.add_argument('--only', action='append',
+                        choices=list(BENCHMARKS.keys()))
+    parser.add_argument('--baseline', default=BASELINE_FQN)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='Allowed fractional regression. Default 0.3.')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    context = Context(args.galaxies, args.e2e_observations)
+    print(f'{len(context.file_names)} files in {len(context.groups)} '
+          f'observations')
+    print(f'{"benchmark":20} {"items":>7} {"seconds":>9} {"items/s":>10} '
+          f'{"peak MB":>8}  status')
+    results = {}
+    failed = False
+    for name in args.only or BENCHMARKS.keys():
+        result = measure(name, context)
+        results[name] = result
+        regressions = compare(result, baseline.get(name), args.tolerance)
+        if name not in baseline:
+            status = 'no baseline'
+        elif len(regressions) > 0:
+            status = 'REGRESSION ' + '; '.join(regressions)
+            failed = True
+        else:
+            status = 'ok'
+        print(f'{name:20} {result["items"]:7d} {result["seconds"]:9.3f} '
+              f'{result["throughput"]:10.1f} {result["peak_mb"]:8.2f}  '
+              f'{status}')
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
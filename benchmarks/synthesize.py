@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Synthesizes PHANGS-shaped file names and headers at the scale of a full
+release, for the benchmarks in this directory.
+
+The headers are copies of the headers in phangs2caom2/tests/data, with the
+OBJECT value and the block of 'Observed in MJD interval' COMMENT cards
+replaced, so that the number of interval cards varies the way it does for
+lightly and heavily observed galaxies.
+"""
+
+import os
+import random
+
+from phangs2caom2 import headers
+
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+TEST_DATA_DIR = os.path.join(
+    os.path.dirname(THIS_DIR), 'phangs2caom2', 'tests', 'data')
+CUBE_TEMPLATE = os.path.join(
+    TEST_DATA_DIR, 'ngc2903_7m+tp_co21.fits.header')
+IMAGE_TEMPLATE = os.path.join(
+    TEST_DATA_DIR, 'ngc2903_7m+tp_co21_strict_mom0.fits.header')
+
+TELESCOPES = ['12m+7m+tp', '7m+tp']
+LINES = ['co21']
+RESOLUTIONS = ['', '_150pc', '_500pc', '_1000pc']
+PRODUCTS = ['', '_noise', '_coverage', '_strictmask', '_broadmask',
+            '_strict_mom0', '_strict_emom0', '_strict_mom1', '_strict_emom1',
+            '_strict_mom2', '_strict_emom2', '_strict_ew', '_strict_eew',
+            '_strict_tpeak', '_broad_mom0', '_broad_emom0', '_broad_tpeak']
+MJD_INTERVAL_RANGE = (1, 300)
+
+_templates = {}
+
+
+def galaxies(count):
+    return [f'ngc{1000 + ii:04d}' for ii in range(count)]
+
+
+def file_names(galaxy_count):
+    """
+    :param galaxy_count: int number of galaxies
+    :return: list of str PHANGS file names, galaxies x telescopes x lines x
+        resolutions x products
+    """
+    result = []
+    for galaxy in galaxies(galaxy_count):
+        for telescope in TELESCOPES:
+            for line in LINES:
+                for resolution in RESOLUTIONS:
+                    for product in PRODUCTS:
+                        result.append(f'{galaxy}_{telescope}_{line}'
+                                      f'{resolution}{product}.fits')
+    return result
+
+
+def _template(file_name):
+    fqn = CUBE_TEMPLATE
+    if '_strict_' in file_name or '_broad_' in file_name:
+        fqn = IMAGE_TEMPLATE
+    if fqn not in _templates:
+        header = headers.get_local_headers(fqn)[0]
+        comments = [ii for ii in header['COMMENT']
+                    if 'Observed in MJD interval' not in ii]
+        del header['COMMENT']
+        _templates[fqn] = (header, comments)
+    return _templates[fqn]
+
+
+def make_header(file_name, intervals=None, rng=random):
+    """
+    :param file_name: str PHANGS file name
+    :param intervals: int number of MJD interval COMMENT cards. Random
+        within MJD_INTERVAL_RANGE when None.
+    :return: astropy.io.fits.Header
+    """
+    template, comments = _template(file_name)
+    result = template.copy()
+    result['OBJECT'] = file_name.split('_')[0].upper()
+    for comment in comments:
+        result.add_comment(comment)
+    if intervals is None:
+        intervals = rng.randint(*MJD_INTERVAL_RANGE)
+    start = 58000.0
+    for ignore in range(intervals):
+        start += rng.uniform(0.1, 10.0)
+        end = start + rng.uniform(0.01, 5.0)
+        result.add_comment(
+            f'Observed in MJD interval [{start:.6f},{end:.6f}]')
+    return result
+
+
+def write_header_files(file_names, working_directory, rng=random):
+    """
+    Write '.header' files, the form the tests use with the --local
+    parameter.
+
+    :return: list of str fully-qualified names
+    """
+    result = []
+    for file_name in file_names:
+        fqn = os.path.join(
+            working_directory, f'{file_name}{headers.HEADER_EXTENSION}')
+        with open(fqn, 'w') as f:
+            f.write(f'# HDU 0 in {file_name}:\n')
+            f.write(make_header(file_name, rng=rng).tostring(sep='\n'))
+            f.write('\n')
+        result.append(fqn)
+    return result
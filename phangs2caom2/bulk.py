@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Bulk output of scraped Observations.
+
+Scraping writes one XML file per Observation, which, for a whole release,
+is thousands of small files. With 'bulk_output' set, and 'scrape' as the
+only task type, each Observation is appended to a single file instead.
+
+The file is a sequence of gzip members, one per Observation, each
+containing one line of JSON - {"collection": ..., "obs_id": ..., "xml":
+...}. So the whole file is newline-delimited JSON to zcat and friends,
+while a sidecar '.index' file, with the offset and length of each member,
+allows any one Observation to be read with a single seek. Appends are
+serialized with a file lock, so the worker processes of a run may share
+the file. When an obs_id appears more than once, the last one wins.
+
+BulkReader reads Observations without unpacking the file, and
+compare_observations checks one against an expected XML file, in the same
+way as mc.compare_observations.
+"""
+
+import fcntl
+import gzip
+import json
+import logging
+import os
+import zlib
+
+from io import BytesIO
+
+from caom2 import obs_reader_writer
+from caom2.diff import get_differences
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import settings
+
+
+__all__ = ['BulkReader', 'append', 'compare_observations', 'get_fqn']
+
+
+INDEX_EXTENSION = '.index'
+READ_SIZE = 1024 * 1024
+
+
+def get_fqn():
+    """
+    :return: str fully-qualified name of the bulk output file, or None, when
+        Observations are written one per file
+    """
+    file_name = settings.get_value('bulk_output', None)
+    if file_name is None or settings.get_value('task_types', []) != [
+            mc.TaskType.SCRAPE.value]:
+        return None
+    return os.path.join(
+        settings.get_value('working_directory', os.getcwd()), file_name)
+
+
+def append(fqn, collection, obs_id, xml):
+    """
+    :param fqn: str fully-qualified name of the bulk output file
+    :param collection: str
+    :param obs_id: str
+    :param xml: str CAOM2 XML of the Observation
+    """
+    member = gzip.compress(json.dumps(
+        {'collection': collection, 'obs_id': obs_id, 'xml': xml}).encode() +
+        b'\n')
+    with open(fqn, 'ab') as f, open(f'{fqn}{INDEX_EXTENSION}', 'a') as index:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(member)
+            f.flush()
+            index.write(json.dumps([collection, obs_id, offset, len(member)]))
+            index.write('\n')
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _scan(fqn, read_size=READ_SIZE):
+    """Rebuild the index by decompressing the file one member at a time,
+    reading it in blocks, so memory use is bounded by the block size and
+    the largest Observation, not the size of the file.
+
+    :return: list of [collection, obs_id, offset, length]
+    """
+    result = []
+    # the start of the current member
+    offset = 0
+    decompressor = None
+    with open(fqn, 'rb') as f:
+        pending = b''
+        while True:
+            if len(pending) == 0:
+                pending = f.read(read_size)
+                if len(pending) == 0:
+                    break
+            if decompressor is None:
+                decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+                parts = []
+                consumed = 0
+            parts.append(decompressor.decompress(pending))
+            consumed += len(pending)
+            if decompressor.eof:
+                # the rest of the block is the start of the next member
+                pending = decompressor.unused_data
+                length = consumed - len(pending)
+                record = json.loads(b''.join(parts))
+                result.append([record['collection'], record['obs_id'],
+                               offset, length])
+                offset += length
+                decompressor = None
+            else:
+                pending = b''
+    if decompressor is not None:
+        raise mc.CadcException(f'Truncated member at {offset} in {fqn}.')
+    return result
+
+
+class BulkReader(object):
+    """Random and sequential access to the Observations in a bulk output
+    file, without unpacking it."""
+
+    def __init__(self, fqn):
+        self._fqn = fqn
+        index_fqn = f'{fqn}{INDEX_EXTENSION}'
+        if os.path.exists(index_fqn):
+            with open(index_fqn) as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        else:
+            logging.info(f'No index for {fqn}. Scanning.')
+            records = _scan(fqn)
+        # obs_id => (collection, offset, length), last one wins
+        self._index = {}
+        for collection, obs_id, offset, length in records:
+            self._index.pop(obs_id, None)
+            self._index[obs_id] = (collection, offset, length)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, obs_id):
+        return obs_id in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def get_xml(self, obs_id):
+        """
+        :return: str CAOM2 XML of the Observation
+        """
+        if obs_id not in self._index:
+            raise mc.CadcException(f'No {obs_id} in {self._fqn}.')
+        ignore, offset, length = self._index[obs_id]
+        with open(self._fqn, 'rb') as f:
+            f.seek(offset)
+            member = f.read(length)
+        return json.loads(gzip.decompress(member))['xml']
+
+    def read(self, obs_id):
+        """
+        :return: caom2.Observation
+        """
+        return obs_reader_writer.ObservationReader().read(
+            BytesIO(self.get_xml(obs_id).encode()))
+
+
+def compare_observations(reader, obs_id, expected_fqn):
+    """
+    :param reader: BulkReader
+    :param obs_id: str
+    :param expected_fqn: str fully-qualified name of the expected XML
+    :return: None if the Observations are the same, otherwise a str
+        describing the differences
+    """
+    actual = reader.read(obs_id)
+    expected = mc.read_obs_from_file(expected_fqn)
+    result = get_differences(expected, actual, 'Observation')
+    if result:
+        return (f'Differences found in {obs_id}\n' +
+                '\n'.join([r for r in result]))
+    return None
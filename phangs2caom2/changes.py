@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Skip repository writes of Observations that have not changed.
+
+After a code change, most re-ingested Observations come out the same as the
+stored ones. SkipUnchangedClient wraps a CAOM2RepoClient, and remembers a
+canonical hash of every Observation it reads. An update of an Observation
+with the same hash as when it was read does not reach the service.
+
+The canonical hash is the CAOM2 accumulated metadata checksum, which covers
+every attribute of the Observation, and of all its Planes, Artifacts, Parts
+and Chunks, except the checksums and timestamps, like last_modified, that the
+repository service assigns. The ids are covered, so the visitors update the
+entities of a read Observation in place, rather than replacing them.
+
+The written and skipped counts are registered with the timing module, so
+they are part of the run summary.
+"""
+
+import logging
+import threading
+
+from caom2.checksum import get_acc_meta_checksum
+
+from phangs2caom2 import settings, timing
+
+
+__all__ = ['SkipUnchangedClient', 'get_counts', 'get_hash', 'in_use',
+           'log_counts', 'skip_unchanged_writes']
+
+
+COUNTERS_NAME = 'repo'
+
+_lock = threading.Lock()
+_counts = {'written': 0, 'skipped': 0}
+
+
+def get_hash(observation):
+    """
+    :param observation: caom2.Observation
+    :return: the canonical hash of the Observation
+    """
+    return get_acc_meta_checksum(observation, no_logging=True).uri
+
+
+def get_counts():
+    """
+    :return: dict of str => int, the process totals of Observations written
+        to, and not written to, the repository
+    """
+    with _lock:
+        return dict(_counts)
+
+
+def log_counts():
+    counts = get_counts()
+    logging.info(f'Wrote {counts["written"]} observations, and skipped '
+                 f'{counts["skipped"]} unchanged observations.')
+
+
+def _count(key):
+    with _lock:
+        _counts[key] += 1
+
+
+class SkipUnchangedClient(object):
+    """Stands in for a CAOM2RepoClient. Every other attribute is the wrapped
+    client's."""
+
+    def __init__(self, client):
+        self._client = client
+        # (collection, observation_id) => hash, as read
+        self._read_hashes = {}
+        self._hashes_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def read(self, collection, observation_id):
+        result = self._client.read(collection, observation_id)
+        if result is not None:
+            value = get_hash(result)
+            with self._hashes_lock:
+                self._read_hashes[(collection, observation_id)] = value
+        return result
+
+    def create(self, observation):
+        self._client.create(observation)
+        _count('written')
+
+    def update(self, observation):
+        key = (observation.collection, observation.observation_id)
+        with self._hashes_lock:
+            read_hash = self._read_hashes.pop(key, None)
+        if read_hash is not None and read_hash == get_hash(observation):
+            logging.info(f'Skipping the write of unchanged {key[1]}.')
+            _count('skipped')
+            return
+        self._client.update(observation)
+        _count('written')
+
+
+class _SkipUnchangedFactory(object):
+    """Stands in for the CAOM2RepoClient class."""
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self, *args, **kwargs):
+        return SkipUnchangedClient(self.factory(*args, **kwargs))
+
+
+def in_use():
+    return bool(settings.get_value('skip_unchanged_writes', True))
+
+
+def skip_unchanged_writes(module):
+    """Replace the module's CAOM2RepoClient with a factory for
+    SkipUnchangedClient instances, when skip_unchanged_writes is True.
+
+    :param module: a module with a CAOM2RepoClient attribute
+    """
+    current = module.CAOM2RepoClient
+    if in_use() and not isinstance(current, _SkipUnchangedFactory):
+        module.CAOM2RepoClient = _SkipUnchangedFactory(current)
+
+
+timing.register_counters(COUNTERS_NAME, get_counts)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+
+"""
+Per-entry checkpoints within the time-boxes of phangs_run_by_state.
+
+The bookmark in the state file moves forward only when all the work in a
+time-box has been attempted, so a run that stops partway through a busy
+time-box used to process every entry of that time-box again when it was
+restarted. Within a time-box, each entry is now recorded as soon as it has
+been attempted, and a restarted run leaves out the recorded entries of the
+time-box that starts at the bookmark.
+
+An entry is recorded when the runner moves on to the next entry, or
+finishes, so an entry is recorded whether it succeeded or failed - as with
+the bookmark, failures are retried from the retry log. An entry that was
+in progress when the run stopped is not recorded, and is processed again.
+
+The records are in a SQLite file in the working directory, shared by all
+the worker processes of a run. The time-box being worked on is passed to
+worker processes through the environment. Checkpoints are used with
+use_local_files: True, and state_checkpoints: True. They are off by
+default, since they need the time-box loop of composed._run_time_boxes,
+rather than rc.run_by_state.
+"""
+
+import logging
+import os
+import sqlite3
+
+from contextlib import contextmanager
+
+from caom2pipe import name_builder_composable as nbc
+from phangs2caom2 import settings
+
+
+__all__ = ['Checkpoint', 'CheckpointNameBuilder', 'get_checkpoint',
+           'in_use', 'time_box']
+
+
+DEFAULT_FILE_NAME = 'state_checkpoint.db'
+FQN_ENV = 'PHANGS_CHECKPOINT_FQN'
+TIME_BOX_ENV = 'PHANGS_CHECKPOINT_TIME_BOX'
+
+
+class Checkpoint(object):
+    """The entries attempted in a time-box, keyed by the start of the
+    time-box. The end of a time-box is not part of the key, because the
+    last time-box of a run ends when the run starts."""
+
+    def __init__(self, fqn):
+        self._fqn = fqn
+        # the timeout is for the concurrent writes of the worker processes
+        self._conn = sqlite3.connect(fqn, timeout=60)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries (time_box TEXT, entry TEXT, '
+            'PRIMARY KEY (time_box, entry))')
+        self._conn.commit()
+
+    @property
+    def fqn(self):
+        return self._fqn
+
+    def close(self):
+        self._conn.close()
+
+    def begin(self, time_box):
+        """Forget the entries of every other time-box. They are from
+        time-boxes the bookmark has moved past.
+
+        :param time_box: str start of the time-box
+        """
+        self._conn.execute(
+            'DELETE FROM entries WHERE time_box != ?', (time_box,))
+        self._conn.commit()
+
+    def get_done(self, time_box):
+        """
+        :param time_box: str start of the time-box
+        :return: set of str entries attempted in the time-box
+        """
+        return {ii[0] for ii in self._conn.execute(
+            'SELECT entry FROM entries WHERE time_box = ?', (time_box,))}
+
+    def record(self, time_box, entries):
+        """
+        :param time_box: str start of the time-box
+        :param entries: list of str entries attempted in the time-box
+        """
+        self._conn.executemany(
+            'INSERT OR IGNORE INTO entries VALUES (?, ?)',
+            [(time_box, ii) for ii in entries])
+        self._conn.commit()
+
+
+def in_use():
+    return bool(settings.get_value('state_checkpoints', False) and
+                settings.get_value('use_local_files', False))
+
+
+def get_checkpoint(config):
+    """
+    :param config: mc.Config
+    :return: Checkpoint as configured in config.yml
+    """
+    return Checkpoint(os.path.join(
+        config.working_directory,
+        settings.get_value('state_checkpoint_file_name', DEFAULT_FILE_NAME)))
+
+
+@contextmanager
+def time_box(config, start, entries):
+    """
+    :param config: mc.Config
+    :param start: datetime start of the time-box
+    :param entries: list of str entries in the time-box
+    :return: the entries that have not been attempted yet. While the 'with'
+        block runs, this process, and the worker processes it starts, record
+        the entries they attempt. All the entries, when checkpoints are not
+        in use.
+    """
+    if not in_use():
+        yield entries
+        return
+    checkpoint = get_checkpoint(config)
+    key = start.isoformat()
+    try:
+        checkpoint.begin(key)
+        done = checkpoint.get_done(key)
+        result = [ii for ii in entries if ii not in done]
+        if len(result) < len(entries):
+            logging.info(f'Resuming the time-box from {start}, '
+                         f'{len(entries) - len(result)} of {len(entries)} '
+                         f'entries already attempted.')
+    finally:
+        checkpoint.close()
+    os.environ[FQN_ENV] = checkpoint.fqn
+    os.environ[TIME_BOX_ENV] = key
+    try:
+        yield result
+    finally:
+        os.environ.pop(FQN_ENV, None)
+        os.environ.pop(TIME_BOX_ENV, None)
+
+
+class CheckpointNameBuilder(nbc.StorageNameBuilder):
+    """The caom2pipe runners build the StorageName for an entry before doing
+    any of the work for that entry, so building the StorageName for an
+    entry means the previous entry has been attempted. Records nothing
+    outside of a time_box."""
+
+    def __init__(self, name_builder):
+        super(CheckpointNameBuilder, self).__init__()
+        self._name_builder = name_builder
+        self._pending = None
+        self._checkpoint = None
+        self._time_box = os.environ.get(TIME_BOX_ENV)
+        if self._time_box is not None:
+            self._checkpoint = Checkpoint(os.environ[FQN_ENV])
+
+    def build(self, entry):
+        self.finish()
+        result = self._name_builder.build(entry)
+        if self._checkpoint is not None:
+            # all the files of an obs_id, when they are grouped
+            self._pending = result.multiple_files()
+        return result
+
+    def finish(self):
+        """Record the entry being worked on, if there is one."""
+        if self._pending is not None:
+            self._checkpoint.record(self._time_box, self._pending)
+            self._pending = None
+
+    def close(self):
+        self.finish()
+        if self._checkpoint is not None:
+            self._checkpoint.close()
+            self._checkpoint = None
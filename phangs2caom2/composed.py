@@ -76,37 +76,203 @@ application.
 intervals.
 """
 
+import argparse
 import logging
 import sys
+import time
 import traceback
 
+from datetime import datetime
+
+from caom2pipe import execute_composable as ec
+from caom2pipe import manage_composable as mc
 from caom2pipe import name_builder_composable as nbc
 from caom2pipe import run_composable as rc
+from caom2repo import CAOM2RepoClient
 from phangs2caom2 import APPLICATION, PHANGSName
+from phangs2caom2 import changes, checkpoint, file_info
+from phangs2caom2 import footprint_augmentation, manifest, memory, parallel
+from phangs2caom2 import pipeline, preview_augmentation, retries, settings
+from phangs2caom2 import time_boxes, timing, work
 
 
 META_VISITORS = []
-DATA_VISITORS = []
+DATA_VISITORS = [preview_augmentation, footprint_augmentation]
+
+PHANGS_BOOKMARK = 'phangs_timestamp'
+
+
+def _get_workers(workers=None):
+    """The command line value, if there is one, overrides the config.yml
+    'workers' value. The default is serial execution."""
+    if workers is None:
+        workers = settings.get_value('workers', 1)
+    return max(1, int(workers))
+
+
+def _group_by_observation(config=None):
+    """Grouping means all the files for an obs_id are ingested with one
+    gen_proc call, and one Observation write. Files are still transferred
+    one at a time, so there is no grouping when storing."""
+    result = settings.get_value('group_by_observation', False)
+    if result and config is not None:
+        if mc.TaskType.STORE in config.task_types:
+            logging.info('Not grouping by obs_id when storing files.')
+            result = False
+    return result
+
+
+def _async_ingest(value=None):
+    """The command line value, if there is one, overrides the config.yml
+    'async_ingest' value."""
+    if value is None:
+        value = settings.get_value('async_ingest', False)
+    return value
+
+
+def _get_name_builder(config, entries):
+    """
+    :return: the name builder for the entries, and the entries to hand to
+        it, which are the obs_id group leaders when grouping
+    """
+    if _group_by_observation(config):
+        groups = work.group_by_obs_id(entries)
+        logging.info(f'Grouped {len(entries)} entries into {len(groups)} '
+                     f'observations.')
+        return work.ObservationNameBuilder(groups), work.group_leaders(groups)
+    return nbc.FileNameBuilder(PHANGSName), entries
+
+
+def _stream_work(config):
+    """
+    :return: the name builder for the entries to process, and a generator
+        of those entries, that finds them as they are needed
+    """
+    if _group_by_observation(config):
+        name_builder = work.ObservationNameBuilder({})
+        return name_builder, work.stream_leaders(
+            work.iter_groups(config), name_builder)
+    return nbc.FileNameBuilder(PHANGSName), work.iter_entries(config)
 
 
-def _run():
+def _set_up_clients():
+    """Repository writes of unchanged Observations are skipped, and stored
+    files are read once for both the upload and the ingest. Repository
+    reads and writes are timed as stages of their own."""
+    timing.time_calls(CAOM2RepoClient, 'read', 'repo_read')
+    timing.time_calls(CAOM2RepoClient, 'create', 'repo_write')
+    timing.time_calls(CAOM2RepoClient, 'update', 'repo_write')
+    changes.skip_unchanged_writes(ec)
+    file_info.single_pass_puts(ec)
+
+
+def _run_by_todo(config, entries):
+    """
+    Executes a known list of entries.
+
+    :param config: mc.Config
+    :param entries: list of str entries to process
+    :return 0 if successful, -1 if there's any sort of failure.
+    """
+    name_builder, entries = _get_name_builder(config, entries)
+    source = parallel.EntryListDataSource(config, entries)
+    if memory.in_use():
+        name_builder = memory.MemoryNameBuilder(name_builder, source)
+    name_builder = checkpoint.CheckpointNameBuilder(
+        timing.TimedNameBuilder(name_builder))
+    _set_up_clients()
+    result = rc.run_by_todo(config=config, name_builder=name_builder,
+                            command_name=APPLICATION, source=source,
+                            meta_visitors=META_VISITORS,
+                            data_visitors=DATA_VISITORS, chooser=None)
+    timing.finish_entry()
+    name_builder.close()
+    return result
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog=APPLICATION)
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='Number of worker processes. Overrides the config.yml value.')
+    parser.add_argument(
+        '--async', dest='async_ingest', action='store_true', default=None,
+        help='Overlap header retrieval, CAOM2 generation and repository '
+             'writes. Overrides the config.yml value.')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Process files the ingest manifest records as unchanged.')
+    args, ignore = parser.parse_known_args()
+    return args
+
+
+def _run_async(config, entries):
+    name_builder, entries = _get_name_builder(config, entries)
+    return pipeline.run(config, entries, name_builder)
+
+
+def _run_entries(config, entries, workers, async_ingest=False):
+    """Executes a known list of entries, with a pool of worker processes
+    when there is more than one worker, or when the memory guard is in use.
+    Transient failures are retried, and permanent failures rejected, by the
+    retries module, when it is in use."""
+    if async_ingest:
+        run_pass = _run_async
+    elif workers > 1 or memory.in_use():
+        def run_pass(pass_config, pass_entries):
+            return parallel.run_parallel(pass_entries, workers, pass_config)
+    else:
+        run_pass = _run_by_todo
+    if retries.in_use():
+        return retries.run(config, entries, run_pass)
+    return run_pass(config, entries)
+
+
+def _run(workers=None, async_ingest=None, force=False):
     """
     Uses a todo file to identify the work to be done.
 
+    :param workers: int number of worker processes. When there is more than
+        one, the work is partitioned by obs_id across a process pool.
+    :param async_ingest: bool when True, entries are processed with the
+        asyncio stages of the pipeline module.
+    :param force: bool when True, files the ingest manifest records as
+        unchanged are processed anyway.
     :return 0 if successful, -1 if there's any sort of failure. Return status
         is used by airflow for task instance management and reporting.
     """
-    name_builder = nbc.FileNameBuilder(PHANGSName)
-    return rc.run_by_todo(config=None, name_builder=name_builder,
-                          command_name=APPLICATION,
-                          meta_visitors=META_VISITORS, 
-                          data_visitors=DATA_VISITORS, chooser=None)
+    workers = _get_workers(workers)
+    async_ingest = _async_ingest(async_ingest)
+    if (async_ingest or workers > 1 or _group_by_observation() or
+            manifest.in_use() or retries.in_use() or memory.in_use()):
+        config = mc.Config()
+        config.get_executors()
+        if async_ingest and not (manifest.in_use() or retries.in_use()):
+            # ungrouped work starts with the first entry found, grouped
+            # work once the names in the directory are listed
+            name_builder, entries = _stream_work(config)
+            return pipeline.run(config, entries, name_builder)
+        with manifest.track(config, work.get_entries(config), force,
+                            _group_by_observation(config)) as entries:
+            return _run_entries(config, entries, workers, async_ingest)
+    _set_up_clients()
+    name_builder = timing.TimedNameBuilder(nbc.FileNameBuilder(PHANGSName))
+    result = rc.run_by_todo(config=None, name_builder=name_builder,
+                            command_name=APPLICATION,
+                            meta_visitors=META_VISITORS, 
+                            data_visitors=DATA_VISITORS, chooser=None)
+    timing.finish_entry()
+    return result
 
 
 def run():
     """Wraps _run in exception handling, with sys.exit calls."""
     try:
-        result = _run()
+        args = _parse_args()
+        timing.begin_run()
+        result = _run(args.workers, args.async_ingest, args.force)
+        changes.log_counts()
+        timing.summarize()
         sys.exit(result)
     except Exception as e:
         logging.error(e)
@@ -115,22 +281,85 @@ def run():
         sys.exit(-1)
 
 
-def _run_state():
+def _run_state(workers=None, force=False):
     """Uses a state file with a timestamp to control which entries will be
     processed.
+
+    :param workers: int number of worker processes. When there is more than
+        one, each time-box is partitioned by obs_id across a process pool.
+    :param force: bool when True, files the ingest manifest records as
+        unchanged are processed anyway.
     """
-    name_builder = nbc.FileNameBuilder(PHANGSName)
-    return rc.run_by_state(config=None, name_builder=name_builder,
-                           command_name=APPLICATION, 
-                           bookmark_name=None, meta_visitors=META_VISITORS,
-                           data_visitors=DATA_VISITORS, end_time=None,
-                           source=None, chooser=None)
+    workers = _get_workers(workers)
+    # time-boxes from files on disk need use_local_files
+    if (workers > 1 or manifest.in_use() or checkpoint.in_use() or
+            time_boxes.in_use() or
+            ((retries.in_use() or memory.in_use()) and
+             settings.get_value('use_local_files', False))):
+        return _run_time_boxes(workers, force=force)
+    _set_up_clients()
+    name_builder = timing.TimedNameBuilder(nbc.FileNameBuilder(PHANGSName))
+    result = rc.run_by_state(config=None, name_builder=name_builder,
+                             command_name=APPLICATION, 
+                             bookmark_name=None, meta_visitors=META_VISITORS,
+                             data_visitors=DATA_VISITORS, end_time=None,
+                             source=None, chooser=None)
+    timing.finish_entry()
+    return result
+
+
+def _run_time_boxes(workers, end_time=None, force=False):
+    """Time-boxed execution, where the work in each time-box is shared
+    across a pool of worker processes, when there is more than one worker.
+    The bookmark moves forward only after all the work in a time-box has
+    been attempted. Within a time-box, each attempted entry is checkpointed,
+    so a restart does not attempt it again. Transient failures are retried
+    before the time-box ends. Time-boxes are sized by
+    time_boxes.TimeBoxSizer, or are 'interval' minutes long."""
+    config = mc.Config()
+    config.get_executors()
+    state = mc.State(config.state_fqn)
+    prev_exec_time = state.get_bookmark(PHANGS_BOOKMARK)
+    if end_time is None:
+        end_time = datetime.now()
+    sizer = None
+    if prev_exec_time < end_time:
+        sizer = time_boxes.get_sizer(
+            work.get_pending(config, prev_exec_time, end_time))
+    result = 0
+    while prev_exec_time < end_time:
+        if sizer is None:
+            exec_time = min(
+                mc.increment_time(prev_exec_time, config.interval), end_time)
+            box_entries = work.get_time_box_entries(
+                config, prev_exec_time, exec_time)
+        else:
+            exec_time, box_entries = sizer.next_box(prev_exec_time, end_time)
+        with manifest.track(config, box_entries, force,
+                            _group_by_observation(config)) as entries:
+            with checkpoint.time_box(
+                    config, prev_exec_time, entries) as entries:
+                logging.info(f'Processing {len(entries)} entries from '
+                             f'{prev_exec_time} to {exec_time}.')
+                if len(entries) > 0:
+                    start = time.perf_counter()
+                    result |= _run_entries(config, entries, workers)
+                    if sizer is not None:
+                        sizer.measure(
+                            len(entries), time.perf_counter() - start)
+        state.save_state(PHANGS_BOOKMARK, exec_time)
+        prev_exec_time = exec_time
+    return result
 
 
 def run_state():
     """Wraps _run_state in exception handling."""
     try:
-        _run_state()
+        args = _parse_args()
+        timing.begin_run()
+        _run_state(args.workers, args.force)
+        changes.log_counts()
+        timing.summarize()
         sys.exit(0)
     except Exception as e:
         logging.error(e)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+
+"""
+Estimated processing costs for PHANGS entries, for scheduling them across
+worker processes.
+
+PHANGS inputs range from small 2-D '_strict_' and '_broad_' moment maps to
+multi-GB 12m+7m+tp cubes. The estimated cost of an entry, in seconds, is a
+fixed cost per entry, plus a cost per MB of the file, by data product type,
+because storing a file, and making its preview and footprint, read all of
+it. The size is that of the local file. For remote files, it is a typical
+size for the data product type.
+
+The estimates are only used to order and balance the work, so the defaults
+need only be in the right proportions. The 'schedule_costs' dict in
+config.yml overrides them, and the run reports the predicted and the actual
+makespan, so they can be calibrated.
+"""
+
+import os
+
+from caom2 import DataProductType
+
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import settings
+from phangs2caom2.main_app import _get_data_product_type
+
+
+__all__ = ['DEFAULT_COSTS', 'get_cost', 'get_costs']
+
+
+DEFAULT_COSTS = {
+    # seconds for every entry, whatever its size
+    'entry_seconds': 1.0,
+    # seconds per MB, by data product type
+    'cube_mb_seconds': 0.02,
+    'image_mb_seconds': 0.01,
+    # MB, when there is no local file
+    'cube_mb': 1000.0,
+    'image_mb': 10.0,
+}
+
+
+def _get_weights():
+    result = dict(DEFAULT_COSTS)
+    configured = settings.get_value('schedule_costs', {}) or {}
+    for key, value in configured.items():
+        if key not in result:
+            raise mc.CadcException(
+                f'Unexpected schedule_costs key {key}. Expected one of '
+                f'{list(result.keys())}.')
+        result[key] = float(value)
+    return result
+
+
+def get_cost(file_name, size, weights=None):
+    """
+    :param file_name: str PHANGS file name
+    :param size: int bytes, or None, when there is no local file
+    :param weights: dict like DEFAULT_COSTS
+    :return: float estimated seconds to process the file
+    """
+    if weights is None:
+        weights = DEFAULT_COSTS
+    kind = ('image' if _get_data_product_type(file_name) ==
+            DataProductType.IMAGE else 'cube')
+    if size is None:
+        mb = weights[f'{kind}_mb']
+    else:
+        mb = size / 1024 / 1024
+    return weights['entry_seconds'] + mb * weights[f'{kind}_mb_seconds']
+
+
+def get_costs(config, entries):
+    """
+    :param config: mc.Config
+    :param entries: list of str file names
+    :return: dict of entry => float estimated seconds
+    """
+    weights = _get_weights()
+    result = {}
+    for entry in entries:
+        size = None
+        if config.use_local_files:
+            try:
+                size = os.stat(
+                    os.path.join(config.working_directory, entry)).st_size
+            except OSError:
+                # it is reported when the entry is processed
+                pass
+        result[entry] = get_cost(entry, size, weights)
+    return result
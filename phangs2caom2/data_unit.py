@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+
+"""
+Bounded-memory access to the data unit of local PHANGS files.
+
+Cubes are never read whole - the largest 12m+7m+tp cubes do not fit
+comfortably in memory - so the data unit is read in blocks of whole
+spectral planes, of about 'data_block_mb' MB each. An uncompressed file is
+memory-mapped one block at a time, and a gzip'd file is decompressed one
+block at a time. Callers reduce each block with vectorized NumPy
+operations before asking for the next one, so the peak memory is one
+block, whatever the size of the cube.
+"""
+
+import gzip
+
+import numpy as np
+
+from astropy.io import fits
+
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import headers, settings
+
+
+__all__ = ['get_block_bytes', 'iter_blocks']
+
+
+BLOCK_MB_DEFAULT = 64
+
+# FITS BITPIX => big-endian NumPy dtype
+DTYPES = {8: np.dtype('u1'),
+          16: np.dtype('>i2'),
+          32: np.dtype('>i4'),
+          64: np.dtype('>i8'),
+          -32: np.dtype('>f4'),
+          -64: np.dtype('>f8')}
+
+
+def get_block_bytes():
+    """
+    :return: int the most data unit bytes to hold at once
+    """
+    return int(float(settings.get_value(
+        'data_block_mb', BLOCK_MB_DEFAULT)) * 1024 * 1024)
+
+
+def _get_layout(header):
+    """
+    :return: the data unit dtype, the number of spectral (and any other
+        non-spatial) planes, and the shape of a plane
+    """
+    bitpix = header.get('BITPIX')
+    if bitpix not in DTYPES:
+        raise mc.CadcException(f'Unsupported BITPIX {bitpix}.')
+    naxis = header.get('NAXIS', 0)
+    if naxis < 2:
+        raise mc.CadcException(f'No image in a data unit with NAXIS {naxis}.')
+    # FITS axes are in Fortran order
+    shape = [header[f'NAXIS{ii}'] for ii in range(naxis, 0, -1)]
+    return DTYPES[bitpix], int(np.prod(shape[:-2])), tuple(shape[-2:])
+
+
+def _iter_mapped_blocks(fqn, offset, dtype, planes, plane_shape, per_block):
+    plane_bytes = int(np.prod(plane_shape)) * dtype.itemsize
+    for start in range(0, planes, per_block):
+        count = min(per_block, planes - start)
+        block = np.memmap(fqn, dtype=dtype, mode='r',
+                          offset=offset + start * plane_bytes,
+                          shape=(count,) + plane_shape)
+        yield block
+        # drop the mapping before the next block is mapped
+        del block
+
+
+def _iter_compressed_blocks(fqn, offset, dtype, planes, plane_shape,
+                            per_block):
+    plane_bytes = int(np.prod(plane_shape)) * dtype.itemsize
+    with gzip.open(fqn, 'rb') as f:
+        f.seek(offset)
+        for start in range(0, planes, per_block):
+            count = min(per_block, planes - start)
+            raw = f.read(count * plane_bytes)
+            if len(raw) < count * plane_bytes:
+                raise mc.CadcException(f'Truncated data unit in {fqn}.')
+            yield np.frombuffer(raw, dtype=dtype).reshape(
+                (count,) + plane_shape)
+
+
+def iter_blocks(fqn, block_bytes=None):
+    """
+    :param fqn: str fully-qualified name of a single-HDU FITS file,
+        optionally gzip'd
+    :param block_bytes: int the most data unit bytes to hold at once. The
+        'data_block_mb' value by default. A block is never less than one
+        spectral plane.
+    :return: the primary astropy.io.fits.Header, and a generator of 3-D
+        arrays of (planes, rows, columns), with the raw values of the data
+        unit. Any BSCALE and BZERO are not applied.
+    """
+    if block_bytes is None:
+        block_bytes = get_block_bytes()
+    raw_header = headers.read_header_blocks(fqn)
+    header = fits.Header.fromstring(raw_header.decode('ascii'))
+    dtype, planes, plane_shape = _get_layout(header)
+    plane_bytes = int(np.prod(plane_shape)) * dtype.itemsize
+    per_block = max(1, block_bytes // plane_bytes)
+    if fqn.endswith('.gz'):
+        blocks = _iter_compressed_blocks(
+            fqn, len(raw_header), dtype, planes, plane_shape, per_block)
+    else:
+        blocks = _iter_mapped_blocks(
+            fqn, len(raw_header), dtype, planes, plane_shape, per_block)
+    return header, blocks
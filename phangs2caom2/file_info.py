@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+
+"""
+One streaming pass over a local file, for everything the pipeline needs to
+know about it.
+
+With the 'store' and 'ingest' task types, a local file used to be read in
+full to compute the md5 checksum for the upload, in full again for the
+upload itself, in part for the primary header, and in full again for the
+md5 checksum of the ingest manifest. scan reads the file once, in
+READ_SIZE blocks, and computes the md5 checksum and size, and captures the
+primary header - decompressing a gzip'd file only as far as the END card -
+from the same blocks.
+
+The result is kept for the life of the process, and in the header cache,
+when there is one, so the other worker processes of a run, and later runs,
+do not read the file again either. Ingest writes the '.header' file from
+the captured header, and SinglePassDataClient gives the data client the
+md5 checksum of the result, for the Content-MD5 header of an upload, so the
+service still rejects a corrupted upload. A stored file is then read in
+full twice - once here, and once by the upload itself - rather than three
+or four times.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import zlib
+
+from collections import OrderedDict
+
+from astropy.io import fits
+
+from phangs2caom2 import timing
+from phangs2caom2.header_cache import get_cache
+from phangs2caom2.headers import BLOCK_SIZE, has_end_card
+
+
+__all__ = ['FileInfo', 'SinglePassDataClient', 'get_counters', 'get_cached',
+           'get_file_info', 'scan', 'single_pass_puts']
+
+
+READ_SIZE = 1024 * 1024
+# file information kept per process
+MAX_ENTRIES = 4096
+COUNTERS_NAME = 'file_info'
+FITS_START = b'SIMPLE  ='
+
+_lock = threading.Lock()
+# fqn => ((size, mtime_ns), FileInfo), least recently used first
+_infos = OrderedDict()
+_counts = {'scans': 0, 'bytes_read': 0, 'hits': 0}
+
+
+class FileInfo(object):
+    """The size, md5 checksum, and primary header of a local file."""
+
+    __slots__ = ('size', 'md5', 'header')
+
+    def __init__(self, size, md5, header):
+        self.size = size
+        self.md5 = md5
+        # astropy.io.fits.Header, or None, for a file that is not FITS
+        self.header = header
+
+
+class _HeaderCollector(object):
+    """Keeps the header blocks from the start of a stream of file content,
+    and nothing after the END card."""
+
+    def __init__(self, compressed):
+        self._raw = bytearray()
+        self._decompressor = None
+        if compressed:
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.done = False
+        self.header = None
+
+    def feed(self, data):
+        if self._decompressor is None:
+            self._add(data)
+            return
+        # decompress no more than a header's worth at a time, so a highly
+        # compressed data unit never inflates in memory
+        pending = data
+        while not self.done and len(pending) > 0:
+            self._add(self._decompressor.decompress(pending, BLOCK_SIZE))
+            pending = self._decompressor.unconsumed_tail
+
+    def _add(self, data):
+        start = len(self._raw) - len(self._raw) % BLOCK_SIZE
+        self._raw.extend(data)
+        if not self._raw.startswith(FITS_START[:len(self._raw)]):
+            # not a FITS file
+            self.done = True
+            return
+        for offset in range(start, len(self._raw) - BLOCK_SIZE + 1,
+                            BLOCK_SIZE):
+            if has_end_card(self._raw[offset:offset + BLOCK_SIZE]):
+                self.header = fits.Header.fromstring(
+                    bytes(self._raw[:offset + BLOCK_SIZE]).decode('ascii'))
+                self.done = True
+                break
+        if self.done:
+            self._raw = None
+
+
+def scan(fqn):
+    """
+    :param fqn: str fully-qualified name of a file on disk
+    :return: FileInfo for the file, from one pass over its content
+    """
+    checksum = hashlib.md5()
+    size = 0
+    collector = _HeaderCollector(fqn.endswith('.gz'))
+    with open(fqn, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            checksum.update(block)
+            size += len(block)
+            if not collector.done:
+                collector.feed(block)
+    _count('scans')
+    _count('bytes_read', size)
+    logging.debug(f'Scanned {size} bytes of {fqn}.')
+    return FileInfo(size, checksum.hexdigest(), collector.header)
+
+
+def _count(name, value=1):
+    with _lock:
+        _counts[name] += value
+
+
+def _version(fqn):
+    stat = os.stat(fqn)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _keep(fqn, version, info):
+    with _lock:
+        _infos[fqn] = (version, info)
+        _infos.move_to_end(fqn)
+        while len(_infos) > MAX_ENTRIES:
+            _infos.popitem(last=False)
+
+
+def get_cached(fqn):
+    """
+    :param fqn: str fully-qualified name of a file on disk
+    :return: FileInfo for the current version of the file, if this process
+        has it, otherwise None. The file content is never read.
+    """
+    fqn = os.path.abspath(fqn)
+    version = _version(fqn)
+    with _lock:
+        found = _infos.get(fqn)
+        if found is not None and found[0] == version:
+            _infos.move_to_end(fqn)
+            _counts['hits'] += 1
+            return found[1]
+    return None
+
+
+def get_file_info(fqn, cache=None):
+    """
+    :param fqn: str fully-qualified name of a file on disk
+    :param cache: header_cache.HeaderCache, checked before the file is
+        read, and updated after. By default, the configured header cache,
+        if there is one.
+    :return: FileInfo for the current version of the file
+    """
+    fqn = os.path.abspath(fqn)
+    result = get_cached(fqn)
+    if result is not None:
+        return result
+    version = _version(fqn)
+    close = cache is None
+    if cache is None:
+        cache = get_cache()
+    try:
+        if cache is not None:
+            md5 = cache.get_md5(fqn)
+            if md5 is not None:
+                result = FileInfo(version[0], md5, cache.get(fqn))
+                _count('hits')
+        if result is None:
+            result = scan(fqn)
+            if cache is not None and result.header is not None:
+                cache.put(fqn, result.header, result.md5)
+    finally:
+        if close and cache is not None:
+            cache.close()
+    _keep(fqn, version, result)
+    return result
+
+
+def get_counters():
+    """
+    :return: dict of str => int, the process totals for full reads, bytes
+        read by them, and reads avoided
+    """
+    with _lock:
+        return dict(_counts)
+
+
+class SinglePassDataClient(object):
+    """Stands in for a CadcDataClient. The client computes the Content-MD5
+    checksum of an upload with its _get_md5sum method, so that is replaced
+    with one that returns the checksum of the single pass, rather than
+    reading the file again. Every other attribute is the wrapped
+    client's."""
+
+    def __init__(self, client):
+        self._client = client
+        if hasattr(client, '_get_md5sum'):
+            client._get_md5sum = self._get_md5sum
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @staticmethod
+    def _get_md5sum(src_file):
+        return get_file_info(src_file).md5
+
+
+class _SinglePassFactory(object):
+    """Stands in for the CadcDataClient class."""
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self, *args, **kwargs):
+        return SinglePassDataClient(self.factory(*args, **kwargs))
+
+
+def single_pass_puts(module):
+    """Replace the module's CadcDataClient with a factory for
+    SinglePassDataClient instances.
+
+    :param module: a module with a CadcDataClient attribute
+    """
+    current = module.CadcDataClient
+    if not isinstance(current, _SinglePassFactory):
+        module.CadcDataClient = _SinglePassFactory(current)
+
+
+timing.register_counters(COUNTERS_NAME, get_counters)
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+
+"""
+Data-driven spatial footprints for PHANGS observations.
+
+The WCS describes the whole map rectangle, including the blanked regions
+outside the mosaic. This visitor sets the position bounds of every chunk of
+an observation to a polygon around the pixels with data: the pixels that
+are set in any plane of the observation's '_mask' product, when there is
+one in the working directory, otherwise the pixels that are not NaN in any
+plane of the science product.
+
+The data unit is read in blocks of spectral planes with the data_unit
+module, and each block is OR-reduced to one plane. The polygon is a
+y-monotone staircase around the valid pixels: the rows with data are
+grouped into at most 'footprint_max_bands' bands, and each band spans the
+left-most to the right-most valid pixel of its rows, so the polygon covers
+every valid pixel, with a bounded number of vertices.
+
+All the planes of an observation share one footprint, so it is cached by
+obs_id, in a SQLite file in the working directory, and used for as long as
+the size and modification time of the file it came from are unchanged.
+"""
+
+import glob
+import json
+import logging
+import os
+import sqlite3
+
+import numpy as np
+
+from astropy.wcs import WCS
+
+from caom2 import CoordPolygon2D, Observation, ValueCoord2D
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import data_unit, settings
+from phangs2caom2.main_app import get_name_bits
+
+
+__all__ = ['FootprintCache', 'get_footprint', 'get_outline',
+           'get_valid_pixels', 'visit']
+
+
+DEFAULT_FILE_NAME = 'footprint_cache.db'
+MAX_BANDS_DEFAULT = 32
+
+# file name => FootprintCache, for the life of the process
+_caches = {}
+
+
+class FootprintCache(object):
+    """Footprint vertices, keyed by obs_id, validated by the name, size and
+    mtime of the file they were computed from."""
+
+    def __init__(self, fqn):
+        self._fqn = fqn
+        # the timeout is for the concurrent writes of the worker processes
+        self._conn = sqlite3.connect(fqn, timeout=60)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS footprints ('
+            'obs_id TEXT PRIMARY KEY, file_name TEXT, size INTEGER, '
+            'mtime_ns INTEGER, vertices TEXT)')
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self._conn.close()
+
+    def get(self, obs_id, fqn):
+        """
+        :param obs_id: str
+        :param fqn: str fully-qualified name of the file the footprint is
+            computed from
+        :return: list of [ra, dec] vertices, or None if there is no entry,
+            or the entry is for a different file, or version of the file
+        """
+        stat = os.stat(fqn)
+        row = self._conn.execute(
+            'SELECT file_name, size, mtime_ns, vertices FROM footprints '
+            'WHERE obs_id = ?', (obs_id,)).fetchone()
+        if (row is None or row[0] != os.path.basename(fqn) or
+                row[1] != stat.st_size or row[2] != stat.st_mtime_ns):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[3])
+
+    def put(self, obs_id, fqn, vertices):
+        stat = os.stat(fqn)
+        self._conn.execute(
+            'INSERT OR REPLACE INTO footprints VALUES (?, ?, ?, ?, ?)',
+            (obs_id, os.path.basename(fqn), stat.st_size, stat.st_mtime_ns,
+             json.dumps(vertices)))
+        self._conn.commit()
+
+
+def _get_cache(working_directory):
+    fqn = os.path.join(
+        working_directory,
+        settings.get_value('footprint_cache_file_name', DEFAULT_FILE_NAME))
+    result = _caches.get(fqn)
+    if result is None:
+        result = FootprintCache(fqn)
+        _caches[fqn] = result
+    return result
+
+
+def get_valid_pixels(fqn, is_mask, block_bytes=None):
+    """
+    :param fqn: str fully-qualified name of a single-HDU FITS file
+    :param is_mask: bool when True, a pixel is valid if it is set in any
+        plane, otherwise a pixel is valid if it is not NaN in any plane
+    :param block_bytes: int see data_unit.iter_blocks
+    :return: the primary astropy.io.fits.Header, and a 2-D bool array of
+        the valid pixels
+    """
+    header, blocks = data_unit.iter_blocks(fqn, block_bytes)
+    result = np.zeros((header['NAXIS2'], header['NAXIS1']), dtype=bool)
+    floating = header['BITPIX'] < 0
+    # the raw value that scales to 0
+    bscale = header.get('BSCALE', 1.0)
+    threshold = -header.get('BZERO', 0.0) / bscale
+    for block in blocks:
+        if is_mask:
+            # NaN > threshold is False
+            if bscale > 0:
+                result |= np.logical_or.reduce(block > threshold, axis=0)
+            else:
+                result |= np.logical_or.reduce(block < threshold, axis=0)
+        elif floating:
+            result |= ~np.logical_and.reduce(np.isnan(block), axis=0)
+        else:
+            # integer data has no blanks
+            result[:] = True
+            break
+    return header, result
+
+
+def get_outline(valid, max_bands=MAX_BANDS_DEFAULT):
+    """
+    :param valid: 2-D bool array, rows by columns
+    :param max_bands: int the most bands of rows in the outline
+    :return: counter-clockwise pixel vertices of a polygon that covers
+        every valid pixel, as a (n, 2) array of 0-based (x, y) values, or
+        None, when there are no valid pixels
+    """
+    rows = np.flatnonzero(valid.any(axis=1))
+    if rows.size == 0:
+        return None
+    with_data = valid[rows]
+    left = np.argmax(with_data, axis=1)
+    right = with_data.shape[1] - 1 - np.argmax(with_data[:, ::-1], axis=1)
+    step = int(np.ceil(rows.size / max_bands))
+    starts = np.arange(0, rows.size, step)
+    ends = np.minimum(starts + step, rows.size) - 1
+    band_left = np.minimum.reduceat(left, starts) - 0.5
+    band_right = np.maximum.reduceat(right, starts) + 0.5
+    bottom = rows[starts] - 0.5
+    top = rows[ends] + 0.5
+    # up the right-hand side, then down the left-hand side
+    right_side = np.column_stack([
+        np.repeat(band_right, 2), np.column_stack([bottom, top]).ravel()])
+    left_side = np.column_stack([
+        np.repeat(band_left[::-1], 2),
+        np.column_stack([top, bottom])[::-1].ravel()])
+    return _simplify(np.concatenate([right_side, left_side]))
+
+
+def _simplify(vertices):
+    """Remove repeated and collinear vertices."""
+    following = np.roll(vertices, -1, axis=0)
+    vertices = vertices[np.any(vertices != following, axis=1)]
+    previous = np.roll(vertices, 1, axis=0)
+    following = np.roll(vertices, -1, axis=0)
+    cross = ((vertices[:, 0] - previous[:, 0]) *
+             (following[:, 1] - vertices[:, 1]) -
+             (vertices[:, 1] - previous[:, 1]) *
+             (following[:, 0] - vertices[:, 0]))
+    return vertices[cross != 0]
+
+
+def _to_world(header, vertices):
+    """
+    :return: list of [ra, dec] vertices, counter-clockwise on the sky
+    """
+    wcs = WCS(header).celestial
+    ra, dec = wcs.all_pix2world(vertices[:, 0], vertices[:, 1], 0)
+    # the winding direction, with RA unwrapped around the first vertex
+    x = (ra - ra[0] + 180.0) % 360.0 - 180.0
+    area = np.sum(x * np.roll(dec, -1) - np.roll(x, -1) * dec)
+    if area < 0:
+        ra = ra[::-1]
+        dec = dec[::-1]
+    return np.column_stack([ra % 360.0, dec]).tolist()
+
+
+def _find_mask(working_directory, obs_id):
+    """The broad mask, when there is more than one, covers the most."""
+    found = glob.glob(
+        os.path.join(working_directory, f'{obs_id}_*mask*.fits*'))
+    found.sort(key=lambda ii: ('broad' not in os.path.basename(ii), ii))
+    return found[0] if len(found) > 0 else None
+
+
+def get_footprint(working_directory, science_fqn):
+    """
+    :param working_directory: str where the files of the observation are
+    :param science_fqn: str fully-qualified name of a science file
+    :return: list of [ra, dec] vertices, or None, if there is no data
+    """
+    obs_id = get_name_bits(science_fqn).obs_id
+    fqn = _find_mask(working_directory, obs_id)
+    is_mask = fqn is not None
+    if not is_mask:
+        fqn = science_fqn
+    cache = _get_cache(working_directory)
+    result = cache.get(obs_id, fqn)
+    if result is None:
+        header, valid = get_valid_pixels(fqn, is_mask)
+        vertices = get_outline(
+            valid, int(settings.get_value(
+                'footprint_max_bands', MAX_BANDS_DEFAULT)))
+        if vertices is None:
+            logging.warning(f'No valid pixels in {fqn}.')
+            return None
+        result = _to_world(header, vertices)
+        cache.put(obs_id, fqn, result)
+        logging.debug(f'Footprint of {len(result)} vertices for {obs_id} '
+                      f'from {fqn}.')
+    return result
+
+
+def visit(observation, **kwargs):
+    """Set the position bounds of every chunk with a position axis.
+
+    :param observation: Observation
+    :param kwargs: 'science_file', the local file name, is required.
+        'working_directory' is where the files of the observation are.
+    :return: dict with the number of chunks updated
+    """
+    mc.check_param(observation, Observation)
+    working_directory = kwargs.get('working_directory', './')
+    science_file = kwargs.get('science_file')
+    if science_file is None:
+        raise mc.CadcException('Visitor needs a science_file parameter.')
+    vertices = get_footprint(
+        working_directory,
+        os.path.join(working_directory, os.path.basename(science_file)))
+
+    count = 0
+    if vertices is not None:
+        for plane in observation.planes.values():
+            for artifact in plane.artifacts.values():
+                for part in artifact.parts.values():
+                    for chunk in part.chunks:
+                        if (chunk.position is not None and
+                                chunk.position.axis is not None):
+                            bounds = CoordPolygon2D()
+                            for ra, dec in vertices:
+                                bounds.vertices.append(ValueCoord2D(ra, dec))
+                            chunk.position.axis.bounds = bounds
+                            count += 1
+    logging.info(f'Completed footprint augmentation for '
+                 f'{observation.observation_id}. Updated {count} chunks.')
+    return {'chunks': count}
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+A persistent, on-disk cache of the primary headers of local PHANGS files.
+
+Re-running the pipeline after a configuration or blueprint change should
+not re-read headers from files that have not changed. Entries are keyed by
+file name, and are only used while the size and the modification time of
+the file are unchanged. When a file has been read in full, its md5
+checksum is kept with its header. The cache is a SQLite file, by default
+in the working directory, so it is shared by all the worker processes of a
+run, and by all the runs in that directory.
+
+The cache holds at most a configured number of entries, evicting the least
+recently used first. The 'phangs_header_cache' command reports on, or
+invalidates, some or all of the entries.
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+import traceback
+
+from astropy.io import fits
+
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import settings
+
+
+__all__ = ['HeaderCache', 'get_cache', 'invalidate']
+
+
+DEFAULT_FILE_NAME = 'header_cache.db'
+DEFAULT_MAX_ENTRIES = 100000
+
+
+class HeaderCache(object):
+    """Primary headers, keyed by file name, validated by size and mtime."""
+
+    def __init__(self, fqn, max_entries=DEFAULT_MAX_ENTRIES):
+        self._fqn = fqn
+        self._max_entries = max_entries
+        # the timeout is for the concurrent writes of the worker processes
+        self._conn = sqlite3.connect(fqn, timeout=60)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS headers ('
+            'file_name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+            'header TEXT, last_access REAL, md5 TEXT)')
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM headers').fetchone()[0]
+
+    def get(self, fqn):
+        """
+        :param fqn: str fully-qualified name of a file on disk
+        :return: astropy.io.fits.Header, or None if there is no entry, or
+            the entry is for a different version of the file
+        """
+        file_name = os.path.basename(fqn)
+        stat = os.stat(fqn)
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, header FROM headers WHERE file_name = ?',
+            (file_name,)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            self.misses += 1
+            return None
+        self._conn.execute(
+            'UPDATE headers SET last_access = ? WHERE file_name = ?',
+            (time.time(), file_name))
+        self._conn.commit()
+        self.hits += 1
+        return fits.Header.fromstring(row[2], sep='\n')
+
+    def put(self, fqn, header, md5=None):
+        """
+        :param fqn: str fully-qualified name of a file on disk
+        :param header: astropy.io.fits.Header of the file
+        :param md5: str hex md5 checksum of the file. When None, a checksum
+            already recorded for the same size and mtime is kept.
+        """
+        stat = os.stat(fqn)
+        self._conn.execute(
+            'INSERT INTO headers VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(file_name) DO UPDATE SET '
+            'md5 = CASE WHEN excluded.md5 IS NOT NULL THEN excluded.md5 '
+            'WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns '
+            'THEN md5 END, '
+            'size = excluded.size, mtime_ns = excluded.mtime_ns, '
+            'header = excluded.header, last_access = excluded.last_access',
+            (os.path.basename(fqn), stat.st_size, stat.st_mtime_ns,
+             header.tostring(sep='\n'), time.time(), md5))
+        self._evict()
+        self._conn.commit()
+
+    def get_md5(self, fqn):
+        """
+        :param fqn: str fully-qualified name of a file on disk
+        :return: str hex md5 checksum of the file, or None if there is no
+            checksum for this version of the file
+        """
+        stat = os.stat(fqn)
+        row = self._conn.execute(
+            'SELECT md5 FROM headers WHERE file_name = ? AND size = ? AND '
+            'mtime_ns = ?',
+            (os.path.basename(fqn), stat.st_size,
+             stat.st_mtime_ns)).fetchone()
+        return None if row is None else row[0]
+
+    def invalidate(self, file_names=None):
+        """
+        :param file_names: list of str file names to remove from the
+            cache. None removes all the entries.
+        :return: int number of entries removed
+        """
+        if file_names is None:
+            cursor = self._conn.execute('DELETE FROM headers')
+        else:
+            cursor = self._conn.executemany(
+                'DELETE FROM headers WHERE file_name = ?',
+                [(os.path.basename(ii),) for ii in file_names])
+        self._conn.commit()
+        return cursor.rowcount
+
+    def _evict(self):
+        excess = len(self) - self._max_entries
+        if excess > 0:
+            self._conn.execute(
+                'DELETE FROM headers WHERE file_name IN (SELECT file_name '
+                'FROM headers ORDER BY last_access LIMIT ?)', (excess,))
+            logging.debug(f'Evicted {excess} entries from {self._fqn}.')
+
+
+def get_cache():
+    """
+    :return: HeaderCache as configured in config.yml, or None, if
+        header_cache is not True
+    """
+    if not settings.get_value('header_cache', False):
+        return None
+    working_directory = settings.get_value('working_directory', os.getcwd())
+    fqn = os.path.join(
+        working_directory,
+        settings.get_value('header_cache_file_name', DEFAULT_FILE_NAME))
+    return HeaderCache(
+        fqn,
+        settings.get_value('header_cache_max_entries', DEFAULT_MAX_ENTRIES))
+
+
+def _invalidate():
+    parser = argparse.ArgumentParser(
+        description='Report on or invalidate the PHANGS header cache.')
+    parser.add_argument('--all', action='store_true',
+                        help='Remove all entries.')
+    parser.add_argument('file_names', nargs='*',
+                        help='Remove the entries for these files.')
+    args = parser.parse_args()
+    cache = get_cache()
+    if cache is None:
+        raise mc.CadcException('header_cache is not enabled in config.yml.')
+    try:
+        if args.all:
+            count = cache.invalidate()
+            logging.info(f'Removed {count} entries.')
+        elif args.file_names:
+            count = cache.invalidate(args.file_names)
+            logging.info(f'Removed {count} entries.')
+        logging.info(f'{len(cache)} entries in the header cache.')
+    finally:
+        cache.close()
+
+
+def invalidate():
+    """Wraps _invalidate in exception handling, with sys.exit calls."""
+    logging.getLogger().setLevel(logging.INFO)
+    try:
+        _invalidate()
+        sys.exit(0)
+    except Exception as e:
+        logging.error(e)
+        tb = traceback.format_exc()
+        logging.debug(tb)
+        sys.exit(-1)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Header-only access to local PHANGS files.
+
+The PHANGS mapping uses nothing but the primary header, and PHANGS files
+have a single HDU, so there is no reason to touch the data unit, whether the
+file is a small 2-D moment map or a multi-GB cube. The functions in this
+module read FITS files in 2880-byte blocks, and stop at the block that holds
+the END card.
+"""
+
+import gzip
+import logging
+import os
+
+from astropy.io import fits
+
+from caom2pipe import manage_composable as mc
+
+
+__all__ = ['get_local_headers', 'has_end_card', 'read_header_blocks',
+           'read_primary_header', 'write_header_file']
+
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+HEADER_EXTENSION = '.header'
+
+
+def _open(fqn):
+    if fqn.endswith('.gz'):
+        return gzip.open(fqn, 'rb')
+    return open(fqn, 'rb')
+
+
+def has_end_card(block):
+    """
+    :param block: bytes of one 2880-byte header block
+    :return: True if the block holds the END card
+    """
+    for offset in range(0, BLOCK_SIZE, CARD_SIZE):
+        if (block[offset:offset + 3] == b'END' and
+                block[offset + 3:offset + CARD_SIZE].strip() == b''):
+            return True
+    return False
+
+
+def read_header_blocks(fqn):
+    """
+    :param fqn: str fully-qualified name of a FITS file, optionally gzip'd
+    :return: bytes of the primary header, up to and including the 2880-byte
+        block that holds the END card
+    """
+    result = bytearray()
+    with _open(fqn) as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if len(block) < BLOCK_SIZE:
+                raise mc.CadcException(f'No END card in {fqn}.')
+            result.extend(block)
+            if has_end_card(block):
+                break
+    return bytes(result)
+
+
+def read_primary_header(fqn, cache=None):
+    """
+    :param fqn: str fully-qualified name of a FITS file, optionally gzip'd
+    :param cache: header_cache.HeaderCache, checked before the file is read
+    :return: astropy.io.fits.Header of the primary HDU
+    """
+    result = None
+    if cache is not None:
+        result = cache.get(fqn)
+    if result is None:
+        result = fits.Header.fromstring(
+            read_header_blocks(fqn).decode('ascii'))
+        if cache is not None:
+            cache.put(fqn, result)
+    return result
+
+
+def get_local_headers(fqn):
+    """
+    :param fqn: str fully-qualified name of a FITS file, or of a text
+        file of header cards (a '.header' file)
+    :return: list with the primary header, in the form that is passed to
+        update(headers=...)
+    """
+    if fqn.endswith(HEADER_EXTENSION):
+        with open(fqn) as f:
+            # skip the '# HDU 0 in ...' line
+            cards = [ii.rstrip('\r\n') for ii in f
+                     if not ii.startswith('#')]
+        return [fits.Header.fromstring('\n'.join(cards), sep='\n')]
+    return [read_primary_header(fqn)]
+
+
+def write_header_file(fqn, working_directory, cache=None, header=None):
+    """
+    Write the primary header of a FITS file as a '.header' text file, which
+    caom2utils accepts in place of the FITS file for the --local parameter.
+
+    :param fqn: str fully-qualified name of a FITS file
+    :param working_directory: str where to write the '.header' file
+    :param cache: header_cache.HeaderCache
+    :param header: astropy.io.fits.Header of the file, when it is already
+        known, so the file is not read
+    :return: str fully-qualified name of the '.header' file
+    """
+    file_name = os.path.basename(fqn)
+    result = os.path.join(working_directory, f'{file_name}{HEADER_EXTENSION}')
+    if header is None:
+        header = read_primary_header(fqn, cache)
+    with open(result, 'w') as f:
+        f.write(f'# HDU 0 in {file_name}:\n')
+        f.write(header.tostring(sep='\n'))
+        f.write('\n')
+    logging.debug(f'Wrote primary header of {fqn} to {result}.')
+    return result
@@ -86,29 +86,112 @@ default set for PHANGS and hidden for others.
 
 """
 
+import copy
 import importlib
 import logging
 import os
+import re
 import sys
+import tempfile
 import traceback
+import weakref
 
+import numpy as np
+
+from functools import lru_cache
 from math import sqrt
 
 from caom2 import Observation, DataProductType, CalibrationLevel
 from caom2 import CoordBounds1D, RefCoord, CoordAxis1D, Provenance
 from caom2 import CoordRange1D, Axis, TemporalWCS, Proposal, ProductType
+from caom2 import ObservationURI
 from caom2utils import ObsBlueprint, get_gen_proc_arg_parser, gen_proc
+from caom2utils import fits2caom2
 from caom2pipe import manage_composable as mc
+from phangs2caom2 import bulk, file_info, member_resolver, sessions, timing
+from phangs2caom2.header_cache import get_cache
+from phangs2caom2.headers import HEADER_EXTENSION, write_header_file
 
 
 __all__ = ['phangs_main_app', 'update', 'PHANGSName', 'COLLECTION',
-           'APPLICATION', 'ARCHIVE', 'to_caom2']
+           'APPLICATION', 'ARCHIVE', 'to_caom2', 'get_name_bits',
+           'get_phangs_name']
 
 
 APPLICATION = 'phangs2caom2'
 COLLECTION = 'PHANGS'
 ARCHIVE = 'PHANGS'
 
+# the right-hand side of the dictionary comes from ALMA/ALMACA
+# collections telescope names
+TELESCOPE_LOOKUP = {
+    '7m+tp': 'ALMA-7m + ALMA-TP',
+    '7m+12m': 'ALMA-7m + ALMA-12m',
+    '12m+7m': 'ALMA-7m + ALMA-12m',
+    'tp+12m': 'ALMA-12m + ALMA-TP',
+    '12m+tp': 'ALMA-12m + ALMA-TP',
+    'tp+7m': 'ALMA-7m + ALMA-TP',
+    '12m+7m+tp': 'ALMA-12m + ALMA-7m + ALMA-TP',
+}
+
+# large enough to hold every file name of a PHANGS release
+NAME_CACHE_SIZE = 65536
+
+
+class PHANGSNameBits(object):
+    """The values the PHANGS naming rules extract from a file id. Instances
+    are shared by every caller that parses the same name, so they must not
+    be modified."""
+
+    __slots__ = ('file_id', 'obs_id', 'target_name', 'telescope',
+                 'product_id')
+
+    def __init__(self, file_id):
+        bits = file_id.split('_')
+        self.file_id = file_id
+        self.obs_id = f'{bits[0]}_{bits[1]}_{bits[2]}'
+        self.target_name = bits[0]
+        self.telescope = TELESCOPE_LOOKUP.get(bits[1])
+        if self.telescope is None:
+            raise mc.CadcException(
+                f'Unexpected telescope value in {file_id}')
+        # ER - original emails
+        self.product_id = file_id
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def _parse_file_id(file_id):
+    return PHANGSNameBits(file_id)
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def _get_phangs_name(file_name):
+    return PHANGSName(file_name=file_name)
+
+
+def _get_file_name(name):
+    # the caches are keyed by file name, so the many temporary paths of a
+    # long run do not push out the names that are asked for again
+    return os.path.basename(name.split(':', 1)[-1])
+
+
+def get_name_bits(name):
+    """
+    :param name: str file name, fully-qualified file name, or artifact URI
+    :return: PHANGSNameBits for the name
+    """
+    return _parse_file_id(
+        mc.StorageName.remove_extensions(_get_file_name(name)))
+
+
+def get_phangs_name(name):
+    """
+    :param name: str file name, fully-qualified file name, or artifact URI
+    :return: PHANGSName for the name. Instances are shared by every caller
+        that asks for the same file name, so they must not be modified.
+    """
+    return _get_phangs_name(_get_file_name(name))
+
 
 class PHANGSName(mc.StorageName):
     """Naming rules:
@@ -118,7 +201,11 @@ class PHANGSName(mc.StorageName):
 
     PHANGS_NAME_PATTERN = '*'
 
-    def __init__(self, file_name=None, artifact_uri=None, entry=None):
+    def __init__(self, file_name=None, artifact_uri=None, entry=None,
+                 members=None):
+        # members are the file names of all the entries that are ingested
+        # together for this obs_id, when they are grouped
+        self._members = members
         if file_name:
             self.fname_in_ad = file_name
             self._file_name = file_name
@@ -148,6 +235,14 @@ class PHANGSName(mc.StorageName):
     def file_name(self):
         return self._file_name
 
+    @property
+    def lineage(self):
+        if self._members is None or len(self._members) < 2:
+            return super(PHANGSName, self).lineage
+        return ' '.join(
+            [mc.get_lineage(ARCHIVE, mc.StorageName.remove_extensions(ii), ii)
+             for ii in self._members])
+
     @property
     def product_id(self):
         return self._product_id
@@ -166,29 +261,17 @@ class PHANGSName(mc.StorageName):
     def is_valid(self):
         return True
 
-    def _assign_bits(self):
-        # the right-hand side of the dictionary comes from ALMA/ALMACA
-        # collections telescope names
-        telescope_lookup = {
-            '7m+tp': 'ALMA-7m + ALMA-TP',
-            '7m+12m': 'ALMA-7m + ALMA-12m',
-            '12m+7m': 'ALMA-7m + ALMA-12m',
-            'tp+12m': 'ALMA-12m + ALMA-TP',
-            '12m+tp': 'ALMA-12m + ALMA-TP',
-            'tp+7m': 'ALMA-7m + ALMA-TP',
-            '12m+7m+tp': 'ALMA-12m + ALMA-7m + ALMA-TP',
-        }
-        bits = self._file_id.split('_')
-        self._obs_id = f'{bits[0]}_{bits[1]}_{bits[2]}'
-        self._target_name = bits[0]
-
-        self._telescope = telescope_lookup.get(bits[1])
-        if self._telescope is None:
-            raise mc.CadcException(
-                f'Unexpected telescope value in {self._file_id}')
+    def multiple_files(self, config=None):
+        if self._members is None:
+            return [self._file_name]
+        return self._members
 
-        # ER - original emails
-        self._product_id = self._file_id
+    def _assign_bits(self):
+        bits = _parse_file_id(self._file_id)
+        self._obs_id = bits.obs_id
+        self._target_name = bits.target_name
+        self._telescope = bits.telescope
+        self._product_id = bits.product_id
 
 
 def accumulate_bp(bp, uri):
@@ -199,9 +282,10 @@ def accumulate_bp(bp, uri):
     bp.configure_energy_axis(3)
     bp.configure_observable_axis(4)
 
-    storage_name = PHANGSName(artifact_uri=uri)
+    storage_name = get_name_bits(uri)
 
-    # all DerivedObservations, even though members are unknown at CADC
+    # all DerivedObservations - members are found from the COMMENT cards,
+    # in update, when resolve_members is True
     bp.set('DerivedObservation.members', {})
     # TBD - there are many more values than this, so maybe there should be
     # many more observations than this?
@@ -225,28 +309,15 @@ def accumulate_bp(bp, uri):
     bp.set('Observation.telescope.geoLocationY', -5440016.41799762)
     bp.set('Observation.telescope.geoLocationZ', -2481631.27428014)
 
-    data_product_type = DataProductType.CUBE
     calibration_level = CalibrationLevel.PRODUCT
-    if '_strict_' in uri or '_broad_' in uri:
-        # ER 05-03-21
-        # everything with a "_strict_" or "_broad_" in the filename as an
-        # image (these should also have NAXIS=2 in the header). Everything
-        # else should be "cube" with NAXIS=3.
-        data_product_type = DataProductType.IMAGE
-
     bp.set('Plane.calibrationLevel', calibration_level)
-    bp.set('Plane.dataProductType', data_product_type)
+    bp.set('Plane.dataProductType', _get_data_product_type(uri))
     bp.clear('Plane.dataRelease')
     bp.add_fits_attribute('Plane.dataRelease', 'DATE')
     bp.clear('Plane.metaRelease')
     bp.add_fits_attribute('Plane.metaRelease', 'DATE')
 
-    artifact_product_type = ProductType.SCIENCE
-    if 'noise' in uri:
-        artifact_product_type = ProductType.NOISE
-    elif 'mask' in uri:
-        artifact_product_type = ProductType.CALIBRATION
-    bp.set('Artifact.productType', artifact_product_type)
+    bp.set('Artifact.productType', _get_artifact_product_type(uri))
 
     # chunk level
     # position
@@ -288,19 +359,104 @@ def update(observation, **kwargs):
     uri = kwargs.get('uri')
     phangs_name = None
     if uri is not None:
-        phangs_name = PHANGSName(artifact_uri=uri)
-    if fqn is not None:
-        phangs_name = PHANGSName(file_name=os.path.basename(fqn))
+        phangs_name = get_phangs_name(uri)
+    elif fqn is not None:
+        # a local file may be the '.header' file that stands in for the
+        # FITS file, and the artifact is named for the FITS file
+        if fqn.endswith(HEADER_EXTENSION):
+            fqn = fqn[:-len(HEADER_EXTENSION)]
+        phangs_name = get_phangs_name(fqn)
     if phangs_name is None:
         raise mc.CadcException(f'Need one of fqn or uri defined for '
                                f'{observation.observation_id}')
 
-    _update_from_comment(observation, phangs_name, headers)
+    with timing.stage('update'):
+        _update_from_comment(observation, phangs_name, headers)
+    with timing.stage('members'):
+        _update_members(observation, phangs_name, headers)
 
     logging.debug('Done update.')
     return observation
 
 
+def _update_members(observation, phangs_name, headers):
+    """Add the ALMA observations for the proposal and target, as
+    DerivedObservation members."""
+    resolver = member_resolver.get_resolver()
+    if resolver is None or not hasattr(observation, 'members'):
+        return
+    proposal_id = _get_comment_values(headers[0]).proposal_id
+    if proposal_id is None:
+        return
+    for uri in resolver.resolve(proposal_id, phangs_name.target_name):
+        observation.members.add(ObservationURI(uri))
+
+
+def _get_artifact_product_type(uri):
+    result = ProductType.SCIENCE
+    if 'noise' in uri:
+        result = ProductType.NOISE
+    elif 'mask' in uri:
+        result = ProductType.CALIBRATION
+    return result
+
+
+def _get_data_product_type(uri):
+    result = DataProductType.CUBE
+    if '_strict_' in uri or '_broad_' in uri:
+        # ER 05-03-21
+        # everything with a "_strict_" or "_broad_" in the filename as an
+        # image (these should also have NAXIS=2 in the header). Everything
+        # else should be "cube" with NAXIS=3.
+        result = DataProductType.IMAGE
+    return result
+
+
+# accumulate_bp output differs only by telescope, dataProductType and
+# artifact productType, apart from the target name, so build each variant
+# once per process, and copy it for each uri
+_blueprint_templates = {}
+
+
+def _copy_plan_value(value):
+    # FITS keyword lookups are (list of keywords, default) tuples, and
+    # add_fits_attribute appends to the list
+    if isinstance(value, tuple) and len(value) > 0 and \
+            isinstance(value[0], list):
+        return (list(value[0]),) + value[1:]
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+def _copy_blueprint(template):
+    """A deepcopy of an ObsBlueprint costs more than building one with
+    accumulate_bp, so copy only the mutable parts of the plan. The
+    copies share the module and the axis configuration."""
+    result = copy.copy(template)
+    result._plan = {key: _copy_plan_value(value)
+                    for key, value in template._plan.items()}
+    result._extensions = {
+        extension: {key: _copy_plan_value(value)
+                    for key, value in plan.items()}
+        for extension, plan in template._extensions.items()}
+    return result
+
+
+def _get_blueprint(module, uri):
+    storage_name = get_name_bits(uri)
+    key = (storage_name.telescope, _get_data_product_type(uri),
+           _get_artifact_product_type(uri))
+    template = _blueprint_templates.get(key)
+    if template is None:
+        template = ObsBlueprint(module=module)
+        accumulate_bp(template, uri)
+        _blueprint_templates[key] = template
+    result = _copy_blueprint(template)
+    result.set('Observation.target.name', storage_name.target_name)
+    return result
+
+
 def _build_blueprints(uris):
     """This application relies on the caom2utils fits2caom2 ObsBlueprint
     definition for mapping FITS file values to CAOM model element
@@ -314,9 +470,10 @@ def _build_blueprints(uris):
     module = importlib.import_module(__name__)
     blueprints = {}
     for uri in uris:
-        blueprint = ObsBlueprint(module=module)
-        if not mc.StorageName.is_preview(uri):
-            accumulate_bp(blueprint, uri)
+        if mc.StorageName.is_preview(uri):
+            blueprint = ObsBlueprint(module=module)
+        else:
+            blueprint = _get_blueprint(module, uri)
         blueprints[uri] = blueprint
     return blueprints
 
@@ -343,13 +500,52 @@ def _get_uris(args):
         for ii in args.local:
             file_id = mc.StorageName.remove_extensions(os.path.basename(ii))
             file_name = f'{file_id}.fits'
-            result.append(PHANGSName(file_name=file_name).file_uri)
+            result.append(get_phangs_name(file_name).file_uri)
     else:
         raise mc.CadcException(
             f'Could not define uri from these args {args}')
     return result
 
 
+def _get_local_files(args):
+    """When the entries for an obs_id are grouped, the lineage names every
+    file in the group, but only one local file may be named on the command
+    line. The other files are in the same directory as that one."""
+    if args.local and args.lineage and len(args.local) < len(args.lineage):
+        working_dir = os.path.dirname(args.local[0])
+        result = []
+        for ii in args.lineage:
+            ignore_product_id, uri = mc.decompose_lineage(ii)
+            ignore_scheme, ignore_path, file_name = mc.decompose_uri(uri)
+            result.append(os.path.join(working_dir, file_name))
+        args.local = result
+
+
+def _use_header_files(args, working_directory):
+    """The mapping only needs the primary header, so for local FITS files,
+    read no further than the END card, and give caom2utils the resulting
+    '.header' files instead of the FITS files. When connected, the artifact
+    metadata comes from CADC storage, not from the local file."""
+    if args.local and not args.not_connected:
+        cache = get_cache()
+        try:
+            result = []
+            for ii in args.local:
+                if ii.endswith(HEADER_EXTENSION):
+                    result.append(ii)
+                else:
+                    # when the file was stored by this process, its header
+                    # is already known
+                    info = file_info.get_cached(ii)
+                    header = None if info is None else info.header
+                    result.append(write_header_file(
+                        ii, working_directory, cache, header))
+            args.local = result
+        finally:
+            if cache is not None:
+                cache.close()
+
+
 def _update_from_comment(observation, phangs_name, headers):
     # From ER: 04-03-21
     # COMMENT Produced with PHANGS-ALMA pipeline version 4.0 Build 935
@@ -376,13 +572,14 @@ def _update_from_comment(observation, phangs_name, headers):
     # COMMENT Observed in MJD interval [58353.589805,58381.654757]
     # COMMENT Observed in MJD interval [58064.3677,58072.458597]
     # COMMENT Observed in MJD interval [58114.347649,58139.301879]
-    chunk = None
+    values = None
     for plane in observation.planes.values():
         if plane.product_id != phangs_name.product_id:
             continue
         if plane.provenance is None:
             plane.provenance = Provenance(name='PHANGS-ALMA pipeline')
 
+        chunk = None
         for artifact in plane.artifacts.values():
             if artifact.uri != phangs_name.file_uri:
                 continue
@@ -390,49 +587,205 @@ def _update_from_comment(observation, phangs_name, headers):
                 chunk = part.chunks[0]
                 break
 
-        for entry in headers[0].get('COMMENT'):
-            if 'pipeline version ' in entry:
-                plane.provenance.version = entry.split(' version ')[1]
-            elif 'Calibration Level' in entry:
-                level = entry.split()[2]
-                if level == '4':
-                    plane.calibration_level = CalibrationLevel.ANALYSIS_PRODUCT
-            elif 'PHANGS-ALMA Public Release' in entry:
-                plane.provenance.project = 'PHANGS-ALMA'
-            elif 'in nearby GalaxieS (PHANGS) collaboration' in entry:
-                plane.provenance.organization = 'PHANGS'
-            elif 'Release generated at ' in entry:
-                plane.provenance.last_executed = mc.make_time_tz(
-                    entry.split(' at ')[1])
-            elif 'Data from ALMA Proposal ID:' in entry:
-                observation.proposal = Proposal(entry.split(':')[1].strip())
-            elif 'Canonical Reference: ' in entry:
-                plane.provenance.producer = entry.split(': ')[1]
-            elif 'ALMA Proposal PI:' in entry:
-                observation.proposal.pi_name = entry.split(': ')[1]
-            elif 'Observed in MJD interval ' in entry:
-                if chunk is not None:
-                    bits = entry.split()[4].split(',')
-                    start_ref_coord = RefCoord(
-                        0.5, mc.to_float(bits[0].replace('[', '')))
-                    end_ref_coord = RefCoord(
-                        1.5, mc.to_float(bits[1].replace(']', '')))
-                    sample = CoordRange1D(start_ref_coord, end_ref_coord)
-                    if chunk.time is None:
-                        coord_bounds = CoordBounds1D()
-                        axis = CoordAxis1D(axis=Axis('TIME', 'd'))
-                        chunk.time = TemporalWCS(axis, timesys='UTC')
-                        chunk.time.axis.bounds = coord_bounds
-                    chunk.time.axis.bounds.samples.append(sample)
-
-
-def to_caom2():
+        if values is None:
+            values = _get_comment_values(headers[0])
+        if values.version is not None:
+            plane.provenance.version = values.version
+        if values.calibration_level == '4':
+            plane.calibration_level = CalibrationLevel.ANALYSIS_PRODUCT
+        if values.project is not None:
+            plane.provenance.project = values.project
+        if values.organization is not None:
+            plane.provenance.organization = values.organization
+        if values.last_executed is not None:
+            plane.provenance.last_executed = mc.make_time_tz(
+                values.last_executed)
+        if values.proposal_id is not None:
+            observation.proposal = Proposal(values.proposal_id)
+        if values.producer is not None:
+            plane.provenance.producer = values.producer
+        if values.pi_name is not None and observation.proposal is not None:
+            observation.proposal.pi_name = values.pi_name
+        if chunk is not None and len(values.intervals) > 0:
+            if chunk.time is None:
+                coord_bounds = CoordBounds1D()
+                axis = CoordAxis1D(axis=Axis('TIME', 'd'))
+                chunk.time = TemporalWCS(axis, timesys='UTC')
+                chunk.time.axis.bounds = coord_bounds
+            samples = chunk.time.axis.bounds.samples
+            # the header is the whole truth, so samples from a previous
+            # ingest are replaced, not kept
+            merged, merged_count = _merge_intervals(values.intervals)
+            if merged_count > 0:
+                logging.info(f'Merged {merged_count} of '
+                             f'{len(values.intervals)} MJD intervals for '
+                             f'{phangs_name.file_name}.')
+            samples.clear()
+            for start, end in merged:
+                sample = CoordRange1D(RefCoord(0.5, start), RefCoord(1.5, end))
+                samples.append(sample)
+
+
+def _merge_intervals(intervals):
+    """Collapse overlapping or touching intervals.
+
+    :param intervals: list of (start, end) tuples, in any order
+    :return: list of (start, end) tuples sorted by start, with no overlaps,
+        and the int number of intervals that were merged away
+    """
+    if len(intervals) == 0:
+        return [], 0
+    values = np.array(intervals, dtype=float)
+    values = values[np.argsort(values[:, 0], kind='stable')]
+    starts = values[:, 0]
+    # the furthest end seen so far, at every position in start order
+    ends = np.maximum.accumulate(values[:, 1])
+    # an interval starts a new group when it begins after everything before
+    # it has ended
+    first = np.empty(len(starts), dtype=bool)
+    first[0] = True
+    np.greater(starts[1:], ends[:-1], out=first[1:])
+    first_indices = np.flatnonzero(first)
+    last_indices = np.append(first_indices[1:] - 1, len(starts) - 1)
+    merged = list(zip(starts[first_indices].tolist(),
+                      ends[last_indices].tolist()))
+    return merged, len(intervals) - len(merged)
+
+
+class PHANGSComments(object):
+    """The values extracted from the COMMENT cards of a PHANGS header.
+    Instances are shared by every caller that parses the same cards, so they
+    must not be modified."""
+
+    __slots__ = ('version', 'calibration_level', 'project', 'organization',
+                 'last_executed', 'proposal_id', 'producer', 'pi_name',
+                 'intervals')
+
+    def __init__(self):
+        self.version = None
+        self.calibration_level = None
+        self.project = None
+        self.organization = None
+        self.last_executed = None
+        self.proposal_id = None
+        self.producer = None
+        self.pi_name = None
+        # list of (start, end) MJD tuples, in card order - they are merged
+        # when the samples are attached to a chunk
+        self.intervals = []
+
+
+# one alternative per kind of COMMENT card, so each card is classified with
+# a single search, and the value is extracted by the same search
+_COMMENT_PATTERN = re.compile(
+    r'pipeline version (?P<version>.*)'
+    r'|Calibration Level (?P<level>\S+)'
+    r'|(?P<release>PHANGS-ALMA Public Release)'
+    r'|(?P<organization>in nearby GalaxieS \(PHANGS\) collaboration)'
+    r'|Release generated at (?P<executed>.*)'
+    r'|Data from ALMA Proposal ID:(?P<proposal>[^:]*)'
+    r'|Canonical Reference: (?P<producer>.*)'
+    r'|ALMA Proposal PI: (?P<pi>.*)'
+    r'|Observed in MJD interval \[(?P<start>[^,\]]*),(?P<end>[^\]]*)\]')
+
+
+def _parse_comments(comments):
+    """
+    :param comments: iterable of str COMMENT card values
+    :return: PHANGSComments
+    """
+    result = PHANGSComments()
+    search = _COMMENT_PATTERN.search
+    for entry in comments:
+        match = search(entry)
+        if match is None:
+            continue
+        kind = match.lastgroup
+        if kind == 'version':
+            result.version = match.group('version')
+        elif kind == 'level':
+            result.calibration_level = match.group('level')
+        elif kind == 'release':
+            result.project = 'PHANGS-ALMA'
+        elif kind == 'organization':
+            result.organization = 'PHANGS'
+        elif kind == 'executed':
+            result.last_executed = match.group('executed')
+        elif kind == 'proposal':
+            result.proposal_id = match.group('proposal').strip()
+        elif kind == 'producer':
+            result.producer = match.group('producer')
+        elif kind == 'pi':
+            result.pi_name = match.group('pi')
+        elif kind == 'end':
+            result.intervals.append(
+                (mc.to_float(match.group('start')),
+                 mc.to_float(match.group('end'))))
+    return result
+
+
+# id(header) => (weakref to header, PHANGSComments), with entries removed
+# when the header goes away
+_comment_values = {}
+
+
+def _get_comment_values(header):
+    """
+    :param header: astropy.io.fits.Header
+    :return: PHANGSComments for the header, parsed once for as long as the
+        header exists, no matter how many planes use it
+    """
+    key = id(header)
+    cached = _comment_values.get(key)
+    if cached is not None and cached[0]() is header:
+        return cached[1]
+    result = _parse_comments(
+        card.value for card in header.cards if card.keyword == 'COMMENT')
+    _comment_values[key] = (
+        weakref.ref(header, lambda ignore: _comment_values.pop(key, None)),
+        result)
+    return result
+
+
+def _append_bulk(args, uris):
+    """When there is bulk output, move the Observation from the file
+    fits2caom2 wrote to the bulk output file."""
+    fqn = bulk.get_fqn()
+    if fqn is None or args.out_obs_xml is None:
+        return
+    with open(args.out_obs_xml) as f:
+        xml = f.read()
+    bulk.append(fqn, COLLECTION, get_phangs_name(uris[0]).obs_id, xml)
+    os.unlink(args.out_obs_xml)
+
+
+def to_caom2(args=None):
     """This function is called by pipeline execution. It must have this name.
+
+    :param args: parsed fits2caom2 command-line parameters, the default is to
+        parse sys.argv
     """
-    args = get_gen_proc_arg_parser().parse_args()
-    uris = _get_uris(args)
-    blueprints = _build_blueprints(uris)
-    result = gen_proc(args, blueprints)
+    if args is None:
+        args = get_gen_proc_arg_parser().parse_args()
+    # re-use connections to storage from one call to the next
+    sessions.share_data_clients(fits2caom2)
+    timing.time_calls(fits2caom2, 'validate', 'validate')
+    timing.time_calls(fits2caom2, '_write_observation', 'xml')
+    with timing.stage('name'):
+        _get_local_files(args)
+        uris = _get_uris(args)
+    with timing.stage('blueprint'):
+        blueprints = _build_blueprints(uris)
+    with tempfile.TemporaryDirectory() as working_directory:
+        with timing.stage('header_read'):
+            _use_header_files(args, working_directory)
+        # gen_proc time is header parsing and blueprint application - the
+        # validation, serialization and update stages are recorded on
+        # their own
+        with timing.stage('gen_proc'):
+            result = gen_proc(args, blueprints)
+    if result == 0:
+        _append_bulk(args, uris)
     logging.debug(f'Done {APPLICATION} processing.')
     return result
            
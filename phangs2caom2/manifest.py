@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+A local ingest manifest, so that re-running the pipeline over a working
+directory only ingests the files that have changed since they were last
+ingested successfully.
+
+For every successfully ingested file, the manifest records the file name,
+size, modification time, md5 checksum, and the obs_id and product_id the
+file contributed to. A file is unchanged, and is not handed to the runners,
+when its size and modification time match the manifest. When only the
+modification time differs, as happens with a copy, the checksum decides.
+
+Success is taken from the success log of the run, so a file whose
+Observation could not be written is tried again the next time. The manifest
+is a SQLite file, by default in the working directory, and is only used
+with use_local_files: True, and ingest_manifest: True.
+"""
+
+import logging
+import os
+import sqlite3
+
+from contextlib import contextmanager
+from datetime import datetime
+
+from phangs2caom2 import file_info, settings
+from phangs2caom2.header_cache import get_cache
+from phangs2caom2.main_app import get_name_bits
+
+
+__all__ = ['Manifest', 'get_manifest', 'in_use', 'track']
+
+
+DEFAULT_FILE_NAME = 'ingest_manifest.db'
+
+
+class Manifest(object):
+    """What was ingested successfully, keyed by file name."""
+
+    def __init__(self, fqn):
+        self._fqn = fqn
+        self._conn = sqlite3.connect(fqn, timeout=60)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'file_name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+            'md5 TEXT, obs_id TEXT, product_id TEXT)')
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def get(self, file_name):
+        """
+        :return: dict of the recorded values for the file, or None
+        """
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, md5, obs_id, product_id FROM files '
+            'WHERE file_name = ?', (file_name,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(
+            ['size', 'mtime_ns', 'md5', 'obs_id', 'product_id'], row))
+
+    def is_unchanged(self, fqn):
+        """
+        :param fqn: str fully-qualified name of a file on disk
+        :return: True if the file is as it was when it was last ingested
+        """
+        file_name = os.path.basename(fqn)
+        stat = os.stat(fqn)
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, md5 FROM files WHERE file_name = ?',
+            (file_name,)).fetchone()
+        if row is None or row[0] != stat.st_size:
+            return False
+        if row[1] == stat.st_mtime_ns:
+            return True
+        if file_info.get_file_info(fqn).md5 != row[2]:
+            return False
+        self._conn.execute(
+            'UPDATE files SET mtime_ns = ? WHERE file_name = ?',
+            (stat.st_mtime_ns, file_name))
+        self._conn.commit()
+        return True
+
+    def record(self, fqns):
+        """
+        :param fqns: list of str fully-qualified names of successfully
+            ingested files
+        """
+        cache = get_cache()
+        try:
+            for fqn in fqns:
+                file_name = os.path.basename(fqn)
+                stat = os.stat(fqn)
+                bits = get_name_bits(file_name)
+                md5 = file_info.get_file_info(fqn, cache).md5
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                    (file_name, stat.st_size, stat.st_mtime_ns, md5,
+                     bits.obs_id, bits.product_id))
+            self._conn.commit()
+        finally:
+            if cache is not None:
+                cache.close()
+
+
+def in_use():
+    return bool(settings.get_value('ingest_manifest', False) and
+                settings.get_value('use_local_files', False))
+
+
+def get_manifest(config):
+    """
+    :param config: mc.Config
+    :return: Manifest as configured in config.yml, or None, if there is no
+        manifest for this configuration
+    """
+    if not (config.use_local_files and
+            settings.get_value('ingest_manifest', False)):
+        return None
+    fqn = os.path.join(
+        config.working_directory,
+        settings.get_value('ingest_manifest_file_name', DEFAULT_FILE_NAME))
+    return Manifest(fqn)
+
+
+def _get_successes(config, since):
+    """
+    :return: set of (obs_id, file_name) from the success log lines written
+        at, or after, since
+    """
+    result = set()
+    if not os.path.exists(config.success_fqn):
+        return result
+    with open(config.success_fqn) as f:
+        for line in f:
+            # '{date} {time} {obs_id} {file_name} {elapsed}'
+            bits = line.split()
+            if len(bits) < 4:
+                continue
+            try:
+                logged = datetime.fromisoformat(f'{bits[0]} {bits[1]}')
+            except ValueError:
+                continue
+            if logged >= since:
+                result.add((bits[2], bits[3]))
+    return result
+
+
+@contextmanager
+def track(config, entries, force=False, by_obs_id=False):
+    """
+    Leaves the unchanged files out of the work, and records the files that
+    were ingested successfully once the work is done.
+
+    :param config: mc.Config
+    :param entries: list of str file names in the working directory
+    :param force: bool when True, all the entries are processed, and
+        recorded if successful
+    :param by_obs_id: bool when True, the work is grouped by obs_id, and
+        only the first file of each group appears in the success log
+    :return: list of str entries to process
+    """
+    manifest = get_manifest(config)
+    if manifest is None:
+        yield entries
+        return
+    start = datetime.now()
+    try:
+        if force:
+            result = list(entries)
+        else:
+            result = [ii for ii in entries if not manifest.is_unchanged(
+                os.path.join(config.working_directory, ii))]
+        logging.info(f'Skipping {len(entries) - len(result)} unchanged of '
+                     f'{len(entries)} files.')
+        try:
+            yield result
+        finally:
+            successes = _get_successes(config, start)
+            if by_obs_id:
+                obs_ids = set(ii[0] for ii in successes)
+                done = [ii for ii in result
+                        if get_name_bits(ii).obs_id in obs_ids]
+            else:
+                file_names = set(ii[1] for ii in successes)
+                done = [ii for ii in result
+                        if os.path.basename(ii) in file_names]
+            manifest.record(
+                [os.path.join(config.working_directory, ii) for ii in done])
+            logging.info(f'Recorded {len(done)} ingested files in the '
+                         f'manifest.')
+    finally:
+        manifest.close()
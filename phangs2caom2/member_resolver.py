@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Resolves the members of PHANGS DerivedObservations - the ALMA observations
+that a PHANGS product was made from.
+
+The COMMENT cards of a PHANGS file name the ALMA proposal, and the file
+name names the target. The ALMA observations at CADC for a proposal are
+found with a single TAP query, and those with the same target name, ignoring
+case and punctuation, are the members.
+
+Rather than one query per file, each query is for every proposal the
+resolver knows of that has no current results - the proposal asked about,
+the 'member_proposal_ids' from config.yml, and those already cached. The
+results are kept in a SQLite file in the working directory, for
+'member_cache_ttl_hours', so in practice there is one query per run, or
+fewer, shared by all the worker processes.
+
+Resolution happens only when 'resolve_members' is True in config.yml.
+"""
+
+import csv
+import logging
+import os
+import re
+import sqlite3
+import time
+
+from io import BytesIO, StringIO
+
+from cadctap import CadcTapClient
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import sessions, settings
+
+
+__all__ = ['MemberResolver', 'get_resolver']
+
+
+DEFAULT_FILE_NAME = 'member_cache.db'
+DEFAULT_TAP_ID = 'ivo://cadc.nrc.ca/argus'
+DEFAULT_TTL_HOURS = 168
+COLLECTIONS = ['ALMA', 'ALMACA']
+
+QUERY = (
+    "SELECT O.proposal_id, O.collection, O.observationID, O.target_name "
+    "FROM caom2.Observation AS O "
+    "WHERE O.collection IN ({collections}) "
+    "AND O.proposal_id IN ({proposal_ids})")
+
+_NOT_ALPHANUMERIC = re.compile('[^a-z0-9]')
+
+
+def normalize_target(target_name):
+    """ALMA target names vary in case and punctuation - e.g. NGC_2903 and
+    ngc2903."""
+    return _NOT_ALPHANUMERIC.sub('', target_name.lower())
+
+
+def _quote(values):
+    return ', '.join("'{}'".format(ii.replace("'", "''")) for ii in values)
+
+
+class MemberResolver(object):
+    """ALMA observation URIs by proposal id and target name, from a TAP
+    service, with a TTL cache on disk."""
+
+    def __init__(self, fqn, tap_client, ttl_seconds, proposal_ids=None):
+        """
+        :param fqn: str fully-qualified name of the SQLite cache file
+        :param tap_client: an object with the same query method as
+            cadctap.CadcTapClient
+        :param ttl_seconds: how long query results are used
+        :param proposal_ids: list of str proposal ids to always include in a
+            query
+        """
+        self._tap_client = tap_client
+        self._ttl_seconds = ttl_seconds
+        self._proposal_ids = set(proposal_ids or [])
+        self.queries = 0
+        self._conn = sqlite3.connect(fqn, timeout=60)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS proposals ('
+            'proposal_id TEXT PRIMARY KEY, fetched REAL)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS members ('
+            'proposal_id TEXT, target TEXT, uri TEXT)')
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def resolve(self, proposal_id, target_name):
+        """
+        :param proposal_id: str ALMA proposal id
+        :param target_name: str PHANGS target name
+        :return: sorted list of str caom: URIs of the ALMA observations
+        """
+        if self._is_stale(proposal_id):
+            self._refresh(proposal_id)
+        rows = self._conn.execute(
+            'SELECT uri FROM members WHERE proposal_id = ? AND target = ? '
+            'ORDER BY uri',
+            (proposal_id, normalize_target(target_name))).fetchall()
+        return [ii[0] for ii in rows]
+
+    def _is_stale(self, proposal_id):
+        row = self._conn.execute(
+            'SELECT fetched FROM proposals WHERE proposal_id = ?',
+            (proposal_id,)).fetchone()
+        return row is None or time.time() - row[0] > self._ttl_seconds
+
+    def _refresh(self, proposal_id):
+        """One query for the stale proposals the resolver knows of."""
+        known = [ii[0] for ii in self._conn.execute(
+            'SELECT proposal_id FROM proposals')]
+        proposal_ids = sorted(
+            ii for ii in self._proposal_ids.union(known, [proposal_id])
+            if self._is_stale(ii))
+        rows = self._query(proposal_ids)
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                'DELETE FROM members WHERE proposal_id = ?',
+                [(ii,) for ii in proposal_ids])
+            self._conn.executemany(
+                'INSERT INTO members VALUES (?, ?, ?)',
+                [(row['proposal_id'], normalize_target(row['target_name']),
+                  f'caom:{row["collection"]}/{row["observationID"]}')
+                 for row in rows])
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO proposals VALUES (?, ?)',
+                [(ii, now) for ii in proposal_ids])
+        logging.info(f'Found {len(rows)} ALMA observations for '
+                     f'{len(proposal_ids)} proposals.')
+
+    def _query(self, proposal_ids):
+        """
+        :return: list of dicts, one per row
+        """
+        query = QUERY.format(collections=_quote(COLLECTIONS),
+                             proposal_ids=_quote(proposal_ids))
+        logging.debug(f'Query is {query}')
+        buffer = BytesIO()
+        self._tap_client.query(query, output_file=buffer, data_only=True,
+                               response_format='csv')
+        self.queries += 1
+        return list(csv.DictReader(StringIO(buffer.getvalue().decode())))
+
+
+# one resolver per process
+_resolver = None
+
+
+def get_resolver():
+    """
+    :return: MemberResolver as configured in config.yml, or None, if
+        resolve_members is not True
+    """
+    global _resolver
+    if _resolver is None and settings.get_value('resolve_members', False):
+        config = mc.Config()
+        config.get_executors()
+        tap_client = CadcTapClient(
+            sessions.get_subject(config),
+            resource_id=settings.get_value('member_tap_id', DEFAULT_TAP_ID))
+        fqn = os.path.join(
+            config.working_directory,
+            settings.get_value('member_cache_file_name', DEFAULT_FILE_NAME))
+        _resolver = MemberResolver(
+            fqn, tap_client,
+            settings.get_value('member_cache_ttl_hours',
+                               DEFAULT_TTL_HOURS) * 3600,
+            settings.get_value('member_proposal_ids', []))
+    return _resolver
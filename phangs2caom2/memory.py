@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+An optional guard on the memory use of long runs.
+
+Astropy headers, Observations and blueprints are not all released between
+entries, so the RSS of a process grows with the number of entries it works
+on. With 'memory_guard' True in config.yml, the work is done by worker
+processes (see the parallel module), and each worker process is replaced
+with a fresh one after 'memory_max_entries' entries, or as soon as its RSS
+passes 'memory_max_rss_mb', so memory use is bounded however long the todo
+list is.
+
+As the work for each entry starts, the RSS of the process is sampled. Every
+'memory_report_entries' entries, when 'memory_trace_frames' is more than 0,
+a tracemalloc snapshot is compared with the first one, and the
+'memory_top_sites' allocation sites that have grown the most are logged.
+The RSS, and the memory traced by tracemalloc, are recorded as timing
+counters, so the change in each is recorded for every entry.
+"""
+
+import logging
+import resource
+import sys
+import tracemalloc
+
+from caom2pipe import name_builder_composable as nbc
+from phangs2caom2 import settings, timing
+
+
+__all__ = ['MemoryGuard', 'MemoryNameBuilder', 'get_guard', 'get_rss_mb',
+           'in_use', 'take_unattempted']
+
+
+MB = 1024 * 1024
+
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_TRACE_FRAMES = 1
+DEFAULT_REPORT_ENTRIES = 100
+DEFAULT_TOP_SITES = 10
+
+# tracemalloc's own allocations, and the import machinery, are not leaks
+_TRACE_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+# the guard for this process
+_guard = None
+
+
+def in_use():
+    return bool(settings.get_value('memory_guard', False))
+
+
+def get_rss_mb():
+    """
+    :return: float resident set size of this process, in MB. On platforms
+        without /proc, the peak, rather than the current, resident set size.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / MB
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, KB everywhere else
+        return peak / (MB if sys.platform == 'darwin' else 1024)
+
+
+class MemoryGuard(object):
+    """Samples the memory use of this process, and decides when the process
+    has done enough work."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_rss_mb=None,
+                 trace_frames=DEFAULT_TRACE_FRAMES,
+                 report_entries=DEFAULT_REPORT_ENTRIES,
+                 top_sites=DEFAULT_TOP_SITES):
+        """
+        :param max_entries: int the most entries for one process, no limit
+            when 0 or None
+        :param max_rss_mb: float the RSS, in MB, after which a process starts
+            no more entries, no limit when 0 or None
+        :param trace_frames: int frames of traceback recorded by tracemalloc
+            for each allocation, no tracing when 0
+        :param report_entries: int entries between the reports of growing
+            allocation sites
+        :param top_sites: int allocation sites in each report
+        """
+        self._max_entries = max_entries or None
+        self._max_rss_mb = max_rss_mb or None
+        self._trace_frames = trace_frames
+        self._report_entries = max(1, report_entries)
+        self._top_sites = top_sites
+        self._baseline = None
+        self.entries = 0
+        self.rss_mb = get_rss_mb()
+        self.peak_rss_mb = self.rss_mb
+        # the entries left unattempted when the process stopped early
+        self.unattempted = []
+        if self._trace_frames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(self._trace_frames)
+
+    def get_counters(self):
+        """
+        :return: dict of the RSS, and the memory allocated since tracing
+            started, in KB
+        """
+        result = {'rss_kb': int(get_rss_mb() * 1024)}
+        if tracemalloc.is_tracing():
+            result['traced_kb'] = tracemalloc.get_traced_memory()[0] // 1024
+        return result
+
+    def sample(self, entry):
+        """Called as the work for each entry starts.
+
+        :param entry: str the entry
+        :return: bool True when the process should start no more entries
+            after this one
+        """
+        self.entries += 1
+        self.rss_mb = get_rss_mb()
+        self.peak_rss_mb = max(self.peak_rss_mb, self.rss_mb)
+        logging.debug(f'Entry {self.entries} {entry} starts with RSS '
+                      f'{self.rss_mb:.1f} MB.')
+        if (tracemalloc.is_tracing() and
+                self.entries % self._report_entries == 0):
+            self.report()
+        if (self._max_entries is not None and
+                self.entries >= self._max_entries):
+            logging.info(f'Stopping after {self.entries} entries, with RSS '
+                         f'{self.rss_mb:.1f} MB.')
+            return True
+        if self._max_rss_mb is not None and self.rss_mb >= self._max_rss_mb:
+            logging.warning(f'Stopping after {self.entries} entries, with RSS '
+                            f'{self.rss_mb:.1f} MB, over the ceiling of '
+                            f'{self._max_rss_mb} MB.')
+            return True
+        return False
+
+    def report(self):
+        """Logs the allocation sites that have grown the most since the first
+        report.
+
+        :return: list of tracemalloc.StatisticDiff, empty for the first
+            report
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+        if self._baseline is None:
+            # the first report follows some work, so caches that fill once
+            # are already full
+            self._baseline = snapshot
+            return []
+        key = 'traceback' if self._trace_frames > 1 else 'lineno'
+        result = [ii for ii in snapshot.compare_to(self._baseline, key)
+                  if ii.size_diff > 0][:self._top_sites]
+        logging.info(f'After {self.entries} entries, RSS '
+                     f'{self.rss_mb:.1f} MB, the top {len(result)} growing '
+                     f'allocation sites:')
+        for stat in result:
+            logging.info(f'{stat.size_diff / 1024:+10.1f} KB '
+                         f'{stat.count_diff:+8d} blocks '
+                         f'{stat.traceback.format()[-1].strip()}')
+        return result
+
+
+def get_guard():
+    """
+    :return: the MemoryGuard for this process, as configured in config.yml
+    """
+    global _guard
+    if _guard is None:
+        _guard = MemoryGuard(
+            int(settings.get_value('memory_max_entries',
+                                   DEFAULT_MAX_ENTRIES) or 0),
+            float(settings.get_value('memory_max_rss_mb', 0) or 0),
+            int(settings.get_value('memory_trace_frames',
+                                   DEFAULT_TRACE_FRAMES)),
+            int(settings.get_value('memory_report_entries',
+                                   DEFAULT_REPORT_ENTRIES)),
+            int(settings.get_value('memory_top_sites', DEFAULT_TOP_SITES)))
+        timing.register_counters('memory', _guard.get_counters)
+    return _guard
+
+
+def take_unattempted():
+    """
+    :return: list of the entries this process left unattempted, when the
+        guard stopped it early. There are none after this call.
+    """
+    if _guard is None:
+        return []
+    result = _guard.unattempted
+    _guard.unattempted = []
+    return result
+
+
+class MemoryNameBuilder(nbc.StorageNameBuilder):
+    """The caom2pipe runners build the StorageName for an entry before doing
+    any of the work for that entry, so this is where memory is sampled. When
+    the guard says so, the entries that have not been started are taken
+    away from the runner, so it stops once the entry in progress is done."""
+
+    def __init__(self, name_builder, source, guard=None):
+        """
+        :param name_builder: nbc.StorageNameBuilder
+        :param source: parallel.EntryListDataSource that holds the work
+        :param guard: MemoryGuard, the one for this process when None
+        """
+        super(MemoryNameBuilder, self).__init__()
+        self._name_builder = name_builder
+        self._source = source
+        self._guard = get_guard() if guard is None else guard
+
+    def build(self, entry):
+        if self._guard.sample(entry):
+            unattempted = self._source.stop()
+            if len(unattempted) > 0:
+                logging.info(f'Leaving {len(unattempted)} entries for a new '
+                             f'process.')
+            self._guard.unattempted.extend(unattempted)
+        return self._name_builder.build(entry)
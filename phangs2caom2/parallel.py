@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Executes PHANGS work across a pool of worker processes.
+
+The entries are partitioned by obs_id before they are handed out, so all the
+files that contribute to one Observation are processed by the same worker,
+and two workers never read-modify-write the same Observation at the same
+time.
+
+Each worker runs the usual todo-based execution (see composed._run_by_todo),
+grouped by obs_id when so configured, with its own log
+directory, so that workers never interleave writes to the same log file.
+When the pool completes, the per-worker success, failure, retry, progress
+and rejected records are merged into the locations named in config.yml.
+
+The obs_id groups are scheduled longest-first, from the cost estimates of
+the costs module, so that a multi-GB cube at the end of a todo list does not
+leave one worker running long after the others have finished. The predicted
+and actual makespans are logged when the pool completes.
+
+When the memory guard of the memory module is in use, a worker process that
+the guard stops is replaced by a fresh one, for the rest of its work.
+"""
+
+import heapq
+import logging
+import os
+import queue
+import shutil
+import time
+import traceback
+
+from collections import deque
+from multiprocessing import get_context
+
+from caom2pipe import data_source_composable as dsc
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import costs, memory, work
+
+
+__all__ = ['EntryListDataSource', 'partition', 'run_parallel']
+
+
+WORKER_DIRECTORY_PREFIX = 'worker_'
+
+
+class EntryListDataSource(dsc.DataSource):
+    """Hands a pre-determined list of entries to the caom2pipe runners."""
+
+    def __init__(self, config, entries):
+        super(EntryListDataSource, self).__init__(config)
+        self._entries = entries
+        self._work = None
+
+    def get_work(self):
+        self._work = deque(self._entries)
+        return self._work
+
+    def stop(self):
+        """The runners take entries from the front of the deque returned by
+        get_work, so emptying it ends the work once the entry in progress
+        is done.
+
+        :return: list of the entries not started
+        """
+        if self._work is None:
+            return []
+        result = list(self._work)
+        self._work.clear()
+        return result
+
+
+def partition(entries, workers, entry_costs=None):
+    """
+    Divide the entries into at most 'workers' lists, keeping all the entries
+    with the same obs_id in the same list. The obs_id groups are assigned
+    longest-first, each to the list with the smallest total cost so far, and
+    each list holds its groups in that order, so the costliest work starts
+    first.
+
+    :param entries: iterable of str file names
+    :param workers: int maximum number of lists
+    :param entry_costs: dict of entry => float estimated cost. Every entry
+        costs the same when None.
+    :return: list of lists of entries, with no empty lists
+    """
+    def _cost(group):
+        if entry_costs is None:
+            return len(group)
+        return sum(entry_costs[ii] for ii in group)
+
+    groups = sorted(
+        ((_cost(ii), ii) for ii in work.group_by_obs_id(entries).values()),
+        key=lambda ii: ii[0], reverse=True)
+    count = max(1, min(workers, len(groups)))
+    result = [[] for _ in range(count)]
+    # (total cost, index) for each list, so ties go to the first list
+    loads = [(0, index) for index in range(count)]
+    for cost, group in groups:
+        load, index = heapq.heappop(loads)
+        result[index].extend(group)
+        heapq.heappush(loads, (load + cost, index))
+    return [ii for ii in result if len(ii) > 0]
+
+
+def _get_config(log_directory=None):
+    config = mc.Config()
+    config.get_executors()
+    if log_directory is not None:
+        # the log and rejected file locations are derived from these
+        # directories, so each worker gets its own copy of every file
+        config.log_file_directory = log_directory
+        config.rejected_directory = log_directory
+    return config
+
+
+def _get_unattempted(config, entries):
+    """
+    :return: list of the entries the memory guard stopped this process
+        from starting. When grouping, the runner only sees the first entry
+        of each obs_id, so the other entries of the obs_id go with it.
+    """
+    # import here to avoid a circular import
+    from phangs2caom2 import composed
+    unattempted = set(memory.take_unattempted())
+    if len(unattempted) == 0:
+        return []
+    if composed._group_by_observation(config):
+        obs_ids = set(work.get_obs_id(ii) for ii in unattempted)
+        return [ii for ii in entries if work.get_obs_id(ii) in obs_ids]
+    return [ii for ii in entries if ii in unattempted]
+
+
+def _run_worker(entries, log_directory):
+    """Executes in a child process.
+
+    :return: the result, the elapsed seconds, and the list of entries the
+        memory guard left for another process
+    """
+    # import here to avoid a circular import
+    from phangs2caom2 import changes, composed
+    start = time.perf_counter()
+    unattempted = []
+    try:
+        config = _get_config(log_directory)
+        mc.create_dir(log_directory)
+        result = composed._run_by_todo(config, entries)
+        unattempted = _get_unattempted(config, entries)
+        changes.log_counts()
+    except Exception as e:
+        logging.error(f'Worker in {log_directory} failed with {e}')
+        logging.debug(traceback.format_exc())
+        result = -1
+    return result, time.perf_counter() - start, unattempted
+
+
+def _run_recycled(partitions, log_file_directory):
+    """Each worker process does the work of one partition, until the memory
+    guard stops it. The work it did not start goes to a fresh process, with
+    its own log directory.
+
+    :return: list of (result, elapsed seconds) for each partition, and the
+        list of log directories
+    """
+    done = queue.Queue()
+    results = [[0, 0.0] for ignore in partitions]
+    log_directories = []
+    # 'spawn' so that workers do not inherit the parent's open connections
+    with get_context('spawn').Pool(processes=len(partitions),
+                                   maxtasksperchild=1) as pool:
+
+        def _submit(index, entries):
+            log_directory = os.path.join(
+                log_file_directory,
+                f'{WORKER_DIRECTORY_PREFIX}{len(log_directories)}')
+            log_directories.append(log_directory)
+            pool.apply_async(
+                _run_worker, (entries, log_directory),
+                callback=lambda result: done.put((index, result)),
+                error_callback=lambda e: done.put((index, (-1, 0.0, []))))
+
+        for index, entries in enumerate(partitions):
+            _submit(index, entries)
+        outstanding = len(partitions)
+        while outstanding > 0:
+            index, (result, elapsed, unattempted) = done.get()
+            outstanding -= 1
+            results[index][0] |= result
+            results[index][1] += elapsed
+            if len(unattempted) > 0:
+                logging.info(f'Replacing worker {index}, with '
+                             f'{len(unattempted)} entries to go.')
+                _submit(index, unattempted)
+                outstanding += 1
+    return [tuple(ii) for ii in results], log_directories
+
+
+def _append_file(source_fqn, target_fqn):
+    if os.path.exists(source_fqn):
+        with open(source_fqn, 'r') as source, open(target_fqn, 'a') as target:
+            shutil.copyfileobj(source, target)
+
+
+def _merge_rejected(source_fqn, target_fqn):
+    if not os.path.exists(source_fqn):
+        return
+    source = mc.read_as_yaml(source_fqn)
+    if source is None:
+        return
+    target = {}
+    if os.path.exists(target_fqn):
+        target = mc.read_as_yaml(target_fqn) or {}
+    for reason, obs_ids in source.items():
+        existing = target.setdefault(reason, [])
+        for obs_id in obs_ids:
+            if obs_id not in existing:
+                existing.append(obs_id)
+    mc.write_as_yaml(target, target_fqn)
+
+
+def _merge_logs(config, log_directories):
+    mc.create_dir(config.log_file_directory)
+    mc.create_dir(config.rejected_directory)
+    for log_directory in log_directories:
+        for file_name in [config.success_log_file_name,
+                          config.failure_log_file_name,
+                          config.retry_file_name,
+                          config.progress_file_name]:
+            _append_file(os.path.join(log_directory, file_name),
+                         os.path.join(config.log_file_directory, file_name))
+        _merge_rejected(
+            os.path.join(log_directory, config.rejected_file_name),
+            config.rejected_fqn)
+        shutil.rmtree(log_directory, ignore_errors=True)
+
+
+def run_parallel(entries, workers, config=None):
+    """
+    :param entries: list of str entries to process
+    :param workers: int number of worker processes
+    :param config: mc.Config, read from config.yml if not provided
+    :return: 0 if all the workers succeeded, -1 otherwise
+    """
+    if config is None:
+        config = _get_config()
+    entry_costs = costs.get_costs(config, entries)
+    partitions = partition(entries, workers, entry_costs)
+    if len(partitions) == 0:
+        logging.info('No work to do.')
+        return 0
+    logging.info(f'Processing {len(entries)} entries with '
+                 f'{len(partitions)} workers.')
+    start = time.perf_counter()
+    if memory.in_use():
+        results, log_directories = _run_recycled(
+            partitions, config.log_file_directory)
+    else:
+        log_directories = [
+            os.path.join(config.log_file_directory,
+                         f'{WORKER_DIRECTORY_PREFIX}{index}')
+            for index in range(len(partitions))]
+        # 'spawn' so that workers do not inherit the parent's open
+        # connections
+        with get_context('spawn').Pool(processes=len(partitions)) as pool:
+            results = pool.starmap(
+                _run_worker, zip(partitions, log_directories))
+    _report_makespan(
+        [sum(entry_costs[jj] for jj in ii) for ii in partitions],
+        [ii[1] for ii in results], time.perf_counter() - start)
+    _merge_logs(config, log_directories)
+    return -1 if any(ii[0] != 0 for ii in results) else 0
+
+
+def _report_makespan(predicted, actual, elapsed):
+    """
+    :param predicted: list of float estimated seconds, for each worker
+    :param actual: list of float elapsed seconds, for each worker
+    :param elapsed: float elapsed seconds for the pool
+    """
+    for index, (estimate, seconds) in enumerate(zip(predicted, actual)):
+        logging.info(f'Worker {index} predicted {estimate:.1f}s actual '
+                     f'{seconds:.1f}s')
+    makespan = max(predicted)
+    ratio = elapsed / makespan if makespan > 0 else 0.0
+    logging.info(f'Makespan predicted {makespan:.1f}s actual {elapsed:.1f}s '
+                 f'(actual / predicted {ratio:.2f}). The longest worker '
+                 f'took {max(actual):.1f}s, the shortest '
+                 f'{min(actual):.1f}s.')
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+An asyncio execution mode for PHANGS ingestion.
+
+The usual todo-based execution does the work for an entry one step at a
+time - retrieve the header and the existing Observation, generate the
+CAOM2 record, then write it to the 'resource_id' service - so the CPU is
+idle during the network waits, and the network is idle during the CAOM2
+generation.
+
+Here the work for an entry happens in three stages:
+- fetch: read any existing Observation from the repository, and, when the
+  files are not local, retrieve the primary headers from storage
+- generate: run main_app.to_caom2 in a separate process
+- write: create or update the Observation in the repository
+
+Each stage has its own workers, and its own bound on concurrency, from the
+config.yml 'async_limits' values, with bounded queues in between, so the
+headers for entry N+k are retrieved while the record for entry N is
+generated and written.
+
+Successes and failures are recorded in the success, failure and retry logs
+named in config.yml.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+from cadcutils import exceptions
+from caom2pipe import manage_composable as mc
+from caom2utils import get_gen_proc_arg_parser
+from phangs2caom2 import changes, main_app, sessions, settings
+from phangs2caom2.headers import HEADER_EXTENSION
+
+
+__all__ = ['AsyncRunner', 'DataService', 'RepoService', 'get_limits', 'run']
+
+
+FETCH = 'fetch'
+GENERATE = 'generate'
+WRITE = 'write'
+DEFAULT_LIMITS = {FETCH: 4, GENERATE: 2, WRITE: 4}
+
+# signals the workers of a stage that there is no more work
+_DONE = object()
+
+
+def get_limits():
+    """
+    :return: dict of stage name => maximum number of entries in that stage at
+        the same time, with config.yml 'async_limits' values overriding the
+        defaults
+    """
+    result = dict(DEFAULT_LIMITS)
+    configured = settings.get_value('async_limits', None)
+    if configured is not None:
+        for key, value in configured.items():
+            if key not in result:
+                raise mc.CadcException(
+                    f'Unexpected async_limits stage {key}. Expected one of '
+                    f'{", ".join(DEFAULT_LIMITS)}.')
+            result[key] = max(1, int(value))
+    return result
+
+
+class DataService(object):
+    """Retrieves primary headers from CADC storage."""
+
+    def __init__(self, subject, archive):
+        self._client = sessions.get_data_client(subject)
+        self._archive = archive
+
+    def get_header(self, file_name, working_directory):
+        """
+        :param file_name: str name of the file in storage
+        :param working_directory: str where to write the header
+        :return: str fully-qualified name of a text file that contains the
+            headers
+        """
+        fqn = os.path.join(working_directory, f'{file_name}{HEADER_EXTENSION}')
+        self._client.get_file(self._archive, file_name, destination=fqn,
+                              fhead=True)
+        return fqn
+
+
+class RepoService(object):
+    """Reads and writes Observations with the CAOM2 repository service.
+    Updates of unchanged Observations are skipped - see the changes
+    module."""
+
+    def __init__(self, subject, resource_id):
+        self._client = sessions.get_repo_client(subject, resource_id)
+        if changes.in_use():
+            self._client = changes.SkipUnchangedClient(self._client)
+
+    def read(self, collection, obs_id):
+        """
+        :return: the Observation, or None if it does not exist
+        """
+        try:
+            return self._client.read(collection, obs_id)
+        except exceptions.NotFoundException:
+            return None
+
+    def write(self, observation, exists):
+        if exists:
+            self._client.update(observation)
+        else:
+            self._client.create(observation)
+
+
+def _generate(argv):
+    """Runs in a generation process. Module-level, so it can be pickled.
+
+    :param argv: list of str fits2caom2 command-line parameters
+    :return: 0 if successful, -1 otherwise
+    """
+    args = get_gen_proc_arg_parser().parse_args(argv)
+    return main_app.to_caom2(args)
+
+
+class _Work(object):
+    """The state of one entry as it moves through the stages."""
+
+    __slots__ = ('entry', 'storage_name', 'working_directory', 'observation',
+                 'local', 'result', 'start_time')
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.storage_name = None
+        self.working_directory = None
+        # the Observation as read from the repository
+        self.observation = None
+        # str fully-qualified names of the local files for gen_proc
+        self.local = []
+        # the generated Observation
+        self.result = None
+        self.start_time = datetime.now()
+
+
+class AsyncRunner(object):
+    """
+    Moves entries through the fetch, generate and write stages.
+
+    The data and repo services are called from threads, and generation
+    happens in the supplied executor, so any object with the same methods as
+    DataService and RepoService may stand in for them.
+    """
+
+    def __init__(self, config, name_builder, data_service, repo_service,
+                 limits=None, generate_executor=None, generate=_generate):
+        """
+        :param config: mc.Config
+        :param name_builder: nbc.StorageNameBuilder that turns entries into
+            PHANGSName instances
+        :param data_service: DataService
+        :param repo_service: RepoService
+        :param limits: dict of stage name => int concurrency, the defaults are
+            from get_limits
+        :param generate_executor: concurrent.futures.Executor for the
+            generate stage. The default is a process pool.
+        :param generate: callable that accepts fits2caom2 command-line
+            parameters, and returns 0 on success
+        """
+        self._config = config
+        self._name_builder = name_builder
+        self._data_service = data_service
+        self._repo_service = repo_service
+        self._limits = get_limits() if limits is None else limits
+        self._generate_executor = generate_executor
+        self._generate = generate
+        self._io_executor = None
+        self.successes = 0
+        self.failures = 0
+
+    async def run(self, entries):
+        """
+        :param entries: iterable of str entries to process. Entries are taken
+            from it only as the fetch stage has room for them, so it may be a
+            generator that is still discovering work.
+        :return: 0 if successful, -1 if there's any sort of failure.
+        """
+        mc.create_dir(self._config.log_file_directory)
+        own_executor = self._generate_executor is None
+        if own_executor:
+            self._generate_executor = ProcessPoolExecutor(
+                max_workers=self._limits[GENERATE],
+                mp_context=get_context('spawn'))
+        self._io_executor = ThreadPoolExecutor(
+            max_workers=self._limits[FETCH] + self._limits[WRITE])
+        try:
+            # bounded, so no stage gets far ahead of the stages that follow
+            # it
+            fetch_queue = asyncio.Queue(maxsize=self._limits[FETCH])
+            generate_queue = asyncio.Queue(maxsize=self._limits[GENERATE])
+            write_queue = asyncio.Queue(maxsize=self._limits[WRITE])
+            await asyncio.gather(
+                self._produce(entries, fetch_queue),
+                self._stage(FETCH, self._fetch, fetch_queue, generate_queue,
+                            self._limits[GENERATE]),
+                self._stage(GENERATE, self._generate_one, generate_queue,
+                            write_queue, self._limits[WRITE]),
+                self._stage(WRITE, self._write, write_queue, None, 0))
+        finally:
+            self._io_executor.shutdown()
+            if own_executor:
+                self._generate_executor.shutdown()
+                self._generate_executor = None
+        logging.info(f'Async execution of '
+                     f'{self.successes + self.failures} entries: '
+                     f'{self.successes} succeeded, {self.failures} failed.')
+        logging.info(f'HTTP counts {sessions.get_counters()}')
+        changes.log_counts()
+        return -1 if self.failures > 0 else 0
+
+    async def _produce(self, entries, fetch_queue):
+        for entry in entries:
+            await fetch_queue.put(_Work(entry))
+        for ignore in range(self._limits[FETCH]):
+            await fetch_queue.put(_DONE)
+
+    async def _stage(self, name, step, inbound, outbound, outbound_workers):
+        """Runs the workers for one stage, and tells the workers of the next
+        stage when there is no more work."""
+
+        async def _worker():
+            while True:
+                work = await inbound.get()
+                if work is _DONE:
+                    break
+                try:
+                    await step(work)
+                except Exception as e:
+                    self._capture_failure(work, name, e)
+                    continue
+                if outbound is None:
+                    self._capture_success(work)
+                else:
+                    await outbound.put(work)
+
+        await asyncio.gather(*[_worker() for ignore in range(
+            self._limits[name])])
+        for ignore in range(outbound_workers):
+            await outbound.put(_DONE)
+
+    def _in_thread(self, f, *args):
+        return asyncio.get_running_loop().run_in_executor(
+            self._io_executor, f, *args)
+
+    async def _fetch(self, work):
+        work.storage_name = self._name_builder.build(work.entry)
+        work.working_directory = tempfile.mkdtemp(
+            dir=self._config.working_directory)
+        work.observation = await self._in_thread(
+            self._repo_service.read, self._config.collection,
+            work.storage_name.obs_id)
+        for file_name in work.storage_name.multiple_files(self._config):
+            if self._config.use_local_files:
+                work.local.append(os.path.join(
+                    self._config.working_directory, file_name))
+            else:
+                work.local.append(await self._in_thread(
+                    self._data_service.get_header, file_name,
+                    work.working_directory))
+
+    async def _generate_one(self, work):
+        in_fqn = os.path.join(work.working_directory, 'in.xml')
+        out_fqn = os.path.join(work.working_directory, 'out.xml')
+        argv = self._get_argv(work, in_fqn, out_fqn)
+        if work.observation is not None:
+            mc.write_obs_to_file(work.observation, in_fqn)
+        result = await asyncio.get_running_loop().run_in_executor(
+            self._generate_executor, self._generate, argv)
+        if result != 0:
+            raise mc.CadcException(
+                f'Failed to generate {work.storage_name.obs_id}.')
+        work.result = mc.read_obs_from_file(out_fqn)
+
+    async def _write(self, work):
+        await self._in_thread(self._repo_service.write, work.result,
+                              work.observation is not None)
+
+    def _get_argv(self, work, in_fqn, out_fqn):
+        plugin = main_app.__file__
+        result = []
+        if self._config.proxy_fqn is not None and os.path.exists(
+                self._config.proxy_fqn):
+            result += ['--cert', self._config.proxy_fqn]
+        elif self._config.netrc_file is not None:
+            result += ['--netrc', self._config.netrc_file]
+        if work.observation is None:
+            result += ['--observation', self._config.collection,
+                       work.storage_name.obs_id]
+        else:
+            result += ['--in', in_fqn]
+        result += ['--out', out_fqn, '--plugin', plugin, '--module', plugin,
+                   '--local'] + work.local
+        result += ['--lineage'] + work.storage_name.lineage.split()
+        return result
+
+    def _capture_success(self, work):
+        self.successes += 1
+        elapsed = (datetime.now() - work.start_time).total_seconds()
+        self._append(self._config.success_fqn,
+                     f'{work.storage_name.obs_id} {work.entry} '
+                     f'{elapsed:.2f}')
+        self._clean_up(work)
+
+    def _capture_failure(self, work, stage, e):
+        self.failures += 1
+        obs_id = (work.entry if work.storage_name is None
+                  else work.storage_name.obs_id)
+        logging.warning(f'{stage} failed for {work.entry}: {e}')
+        logging.debug(traceback.format_exc())
+        message = str(e).replace('\n', ' ')
+        self._append(self._config.failure_fqn,
+                     f'{obs_id} {work.entry} {message}')
+        self._append(self._config.retry_fqn, work.entry, timestamp=False)
+        self._clean_up(work)
+
+    @staticmethod
+    def _append(fqn, line, timestamp=True):
+        # called only from the event loop thread, so there are no
+        # interleaved writes
+        with open(fqn, 'a') as f:
+            if timestamp:
+                f.write(f'{datetime.now()} {line}\n')
+            else:
+                f.write(f'{line}\n')
+
+    @staticmethod
+    def _clean_up(work):
+        if work.working_directory is not None:
+            shutil.rmtree(work.working_directory, ignore_errors=True)
+
+
+def run(config, entries, name_builder):
+    """
+    Executes a known list of entries with the fetch, generate and write
+    stages overlapping.
+
+    :param config: mc.Config
+    :param entries: iterable of str entries to process
+    :param name_builder: nbc.StorageNameBuilder
+    :return 0 if successful, -1 if there's any sort of failure.
+    """
+    if config.task_types != [mc.TaskType.INGEST]:
+        raise mc.CadcException(
+            f'Async execution supports only the ingest task type, not '
+            f'{config.task_types}.')
+    subject = sessions.get_subject(config)
+    runner = AsyncRunner(config, name_builder,
+                         DataService(subject, config.archive),
+                         RepoService(subject, config.resource_id))
+    return asyncio.run(runner.run(entries))
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+
+"""
+Previews and thumbnails for PHANGS science products.
+
+A 2-D moment map is its own preview image. For a cube, the preview is the
+peak along the spectral axis. The cube is read in blocks of spectral planes
+with the data_unit module, and each block is reduced to a single plane with
+a vectorized NumPy reduction, so the peak memory is one block, plus the
+running peak image, whatever the size of the cube.
+"""
+
+import logging
+import os
+import warnings
+
+import numpy as np
+
+from matplotlib import image
+
+from caom2 import Artifact, Observation, ProductType, ReleaseType
+from caom2 import ChecksumURI
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import data_unit, file_info
+
+
+__all__ = ['PEAK', 'get_images', 'visit']
+
+
+PEAK = 'peak'
+
+PREVIEW_SIZE = 1024
+THUMBNAIL_SIZE = 256
+# the display range is clipped to these percentiles
+CLIP_PERCENTILES = [0.5, 99.5]
+COLOUR_MAP = 'inferno'
+MIME_TYPE = 'image/jpeg'
+
+
+def get_images(fqn, block_bytes=None):
+    """
+    :param fqn: str fully-qualified name of a single-HDU FITS file,
+        optionally gzip'd
+    :param block_bytes: int the most data unit bytes to hold at once. The
+        'data_block_mb' value by default. A block is never less than one
+        spectral plane.
+    :return: dict with the PEAK image along the spectral axis, as a 2-D
+        float array. For a 2-D file, it is the image. A pixel that is blank
+        in every plane is NaN.
+    """
+    header, blocks = data_unit.iter_blocks(fqn, block_bytes)
+    plane_shape = (header['NAXIS2'], header['NAXIS1'])
+    floating = header['BITPIX'] < 0
+    peak = np.full(plane_shape, np.nan, dtype=np.float64)
+    for block in blocks:
+        if floating:
+            # fmax ignores NaN, unless every value is NaN
+            np.fmax(peak, np.fmax.reduce(block, axis=0), out=peak)
+        else:
+            np.fmax(peak, block.max(axis=0), out=peak)
+    # scaling is linear, so scale the reduced images, not every plane
+    bscale = header.get('BSCALE', 1.0)
+    bzero = header.get('BZERO', 0.0)
+    if bscale != 1.0 or bzero != 0.0:
+        peak = peak * bscale + bzero
+        if bscale < 0:
+            logging.warning(f'Negative BSCALE in {fqn}. The preview is of '
+                            f'the minimum, not the peak.')
+    return {PEAK: peak}
+
+
+def _scale(data, size):
+    """Block-average down to at most size pixels on a side, then map the
+    clipped range of values to [0, 1]. Blank pixels are 0."""
+    step = max(1, int(np.ceil(max(data.shape) / size)))
+    if step > 1:
+        rows = data.shape[0] // step * step
+        columns = data.shape[1] // step * step
+        data = data[:rows, :columns].reshape(
+            rows // step, step, columns // step, step)
+        with warnings.catch_warnings():
+            # an all-blank block is NaN, and a warning
+            warnings.simplefilter('ignore', RuntimeWarning)
+            data = np.nanmean(data, axis=(1, 3))
+    finite = np.isfinite(data)
+    result = np.zeros(data.shape, dtype=np.float32)
+    if finite.any():
+        low, high = np.percentile(data[finite], CLIP_PERCENTILES)
+        if high > low:
+            result[finite] = np.clip(
+                (data[finite] - low) / (high - low), 0.0, 1.0)
+    return result
+
+
+def _write_image(data, fqn, size):
+    image.imsave(fqn, _scale(data, size), cmap=COLOUR_MAP, vmin=0.0,
+                 vmax=1.0, origin='lower', format='jpg')
+    logging.debug(f'Wrote {fqn}.')
+
+
+def _augment(plane, uri, fqn, product_type):
+    # update an Artifact from an earlier ingest in place, so it keeps its
+    # id, and an unchanged Observation is not written again
+    artifact = plane.artifacts.get(uri)
+    if artifact is None:
+        artifact = Artifact(uri, product_type, ReleaseType.DATA)
+        plane.artifacts[uri] = artifact
+    artifact.product_type = product_type
+    artifact.content_type = MIME_TYPE
+    artifact.content_length = os.path.getsize(fqn)
+    artifact.content_checksum = ChecksumURI(
+        f'md5:{file_info.scan(fqn).md5}')
+
+
+def _do_prev(plane, artifact, science_fqn, working_directory, cadc_client,
+             stream, observable):
+    images = get_images(science_fqn)
+    file_id = mc.StorageName.remove_extensions(
+        os.path.basename(science_fqn))
+    scheme_path = artifact.uri.rsplit('/', 1)[0]
+    count = 0
+    for file_name, size, product_type in [
+            (f'{file_id}_prev.jpg', PREVIEW_SIZE, ProductType.PREVIEW),
+            (f'{file_id}_prev_256.jpg', THUMBNAIL_SIZE,
+             ProductType.THUMBNAIL)]:
+        fqn = os.path.join(working_directory, file_name)
+        _write_image(images[PEAK], fqn, size)
+        if cadc_client is not None:
+            archive = mc.decompose_uri(artifact.uri)[1]
+            metrics = None if observable is None else observable.metrics
+            mc.data_put(cadc_client, working_directory, file_name, archive,
+                        stream, MIME_TYPE, metrics=metrics)
+        _augment(plane, f'{scheme_path}/{file_name}', fqn, product_type)
+        count += 1
+    return count
+
+
+def visit(observation, **kwargs):
+    """Add a preview and a thumbnail of each science file to its plane.
+
+    :param observation: Observation
+    :param kwargs: 'science_file', the local file name, is required.
+        'working_directory' is where the file is, and where the images are
+        written. The images are stored with 'cadc_client', when there is one.
+    :return: dict with the number of artifacts added
+    """
+    mc.check_param(observation, Observation)
+    working_directory = kwargs.get('working_directory', './')
+    science_file = kwargs.get('science_file')
+    if science_file is None:
+        raise mc.CadcException('Visitor needs a science_file parameter.')
+    cadc_client = kwargs.get('cadc_client')
+    stream = kwargs.get('stream')
+    observable = kwargs.get('observable')
+    science_fqn = os.path.join(working_directory,
+                               os.path.basename(science_file))
+
+    count = 0
+    for plane in observation.planes.values():
+        for artifact in list(plane.artifacts.values()):
+            if (artifact.product_type == ProductType.SCIENCE and
+                    artifact.uri.endswith(f'/{science_file}')):
+                count += _do_prev(plane, artifact, science_fqn,
+                                  working_directory, cadc_client, stream,
+                                  observable)
+    logging.info(f'Completed preview augmentation for '
+                 f'{observation.observation_id}. Added {count} artifacts.')
+    return {'artifacts': count}
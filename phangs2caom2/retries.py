@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Retries, within a run, of the entries that fail for a transient reason, and
+rejection of the entries that fail for a permanent one.
+
+A failure is classified by its message in the failure log:
+- transient: network errors, timeouts and 5xx responses. The work for the
+  obs_id is retried in the same run, after an exponential backoff with
+  jitter, up to 'retry_attempts' times. The default of 0 turns retries,
+  and rejection, off.
+- permanent: failures that happen again however often the work is tried,
+  such as a file name with an unexpected telescope value. The obs_id is
+  added to the rejected file, and left out of every later run. Remove it
+  from the rejected file to try it again.
+- anything else is left in the retry log, as it always was.
+
+Each pass over the work, the first one and every retry, logs to its own
+directory, the same way as the workers of the parallel module, so the
+failures of a pass are read back whatever caom2pipe does with its log files.
+The logs of a pass are then appended to the ones named in config.yml, except
+for the retry log, which ends up with only the entries that still fail.
+"""
+
+import copy
+import heapq
+import logging
+import os
+import random
+import re
+import shutil
+import time
+
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import parallel, settings, work
+
+
+__all__ = ['PERMANENT', 'TRANSIENT', 'UNKNOWN', 'RetryQueue', 'classify',
+           'drop_rejected', 'in_use', 'run']
+
+
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+UNKNOWN = 'unknown'
+
+# rejected file reasons
+BAD_METADATA = 'bad_metadata'
+BAD_DATA = 'bad_data'
+
+TRANSIENT_PATTERNS = [
+    r'[Tt]imed? ?out',
+    r'[Cc]onnection (aborted|error|refused|reset)',
+    r'reset by peer',
+    r'[Bb]roken pipe',
+    r'Max retries exceeded',
+    r'Remote end closed connection',
+    r'Temporary failure in name resolution',
+    r'Internal Server Error',
+    r'Bad Gateway',
+    r'Service (Temporarily )?Unavailable',
+    r'\b50[0-4]\b',
+]
+PERMANENT_PATTERNS = [
+    (r'Unexpected telescope value', BAD_METADATA),
+    (r'Invalid name format', BAD_METADATA),
+    (r'No END card', BAD_DATA),
+    (r'Unsupported BITPIX', BAD_DATA),
+    (r'Truncated data unit', BAD_DATA),
+    (r'No image in a data unit', BAD_DATA),
+]
+
+DEFAULT_ATTEMPTS = 0
+DEFAULT_BACKOFF_SECONDS = 10.0
+DEFAULT_BACKOFF_MAX_SECONDS = 300.0
+PASS_DIRECTORY_PREFIX = 'pass_'
+BATCH_SECONDS = 1.0
+
+
+def in_use():
+    return int(settings.get_value('retry_attempts', DEFAULT_ATTEMPTS)) > 0
+
+
+def _get_patterns():
+    """The config.yml 'transient_failures' and 'permanent_failures' regular
+    expressions are in addition to the built-in ones. The configured
+    permanent failures are rejected as bad metadata."""
+    transient = TRANSIENT_PATTERNS + list(
+        settings.get_value('transient_failures', None) or [])
+    permanent = PERMANENT_PATTERNS + [
+        (ii, BAD_METADATA)
+        for ii in settings.get_value('permanent_failures', None) or []]
+    return ([re.compile(ii) for ii in transient],
+            [(re.compile(ii), reason) for ii, reason in permanent])
+
+
+def classify(message, patterns=None):
+    """
+    :param message: str failure message
+    :param patterns: the result of _get_patterns, read from config.yml if
+        None
+    :return: (TRANSIENT, PERMANENT or UNKNOWN, str rejected file reason or
+        None). Permanent patterns win over transient ones.
+    """
+    transient, permanent = _get_patterns() if patterns is None else patterns
+    for pattern, reason in permanent:
+        if pattern.search(message):
+            return PERMANENT, reason
+    for pattern in transient:
+        if pattern.search(message):
+            return TRANSIENT, None
+    return UNKNOWN, None
+
+
+def get_delay(attempt, base, maximum):
+    """
+    :param attempt: int the retry about to be made, from 1
+    :param base: float seconds before the first retry
+    :param maximum: float the most seconds before any retry
+    :return: float seconds to wait, half of the exponential backoff, plus up
+        to the same again at random, so entries that failed together are not
+        all retried at the same moment
+    """
+    backoff = min(maximum, base * 2 ** (attempt - 1))
+    return backoff / 2.0 + random.uniform(0.0, backoff / 2.0)
+
+
+class RetryQueue(object):
+    """The obs_ids waiting for a retry, ordered by when each is due."""
+
+    def __init__(self, base, maximum):
+        self._base = base
+        self._maximum = maximum
+        # (due time, sequence, obs_id, attempt)
+        self._heap = []
+        self._count = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, obs_id, attempt):
+        delay = get_delay(attempt, self._base, self._maximum)
+        logging.info(f'Retry {attempt} of {obs_id} in {delay:.1f}s.')
+        heapq.heappush(
+            self._heap, (time.monotonic() + delay, self._count, obs_id,
+                         attempt))
+        self._count += 1
+
+    def pop_due(self):
+        """Waits until the first obs_id is due.
+
+        :return: dict of obs_id => attempt, for every obs_id that is due,
+            or that is due within BATCH_SECONDS
+        """
+        if len(self._heap) == 0:
+            return {}
+        due = self._heap[0][0]
+        wait = due - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        # a pass has a start-up cost, so the obs_ids due soon after go too
+        now = max(due, time.monotonic()) + BATCH_SECONDS
+        result = {}
+        while len(self._heap) > 0 and self._heap[0][0] <= now:
+            ignore, ignore, obs_id, attempt = heapq.heappop(self._heap)
+            result[obs_id] = attempt
+        return result
+
+
+def get_rejected(config):
+    """
+    :param config: mc.Config
+    :return: set of the obs_ids in the rejected file, for any reason
+    """
+    if not os.path.exists(config.rejected_fqn):
+        return set()
+    content = mc.read_as_yaml(config.rejected_fqn) or {}
+    return set(ii for obs_ids in content.values() for ii in obs_ids or [])
+
+
+def drop_rejected(config, entries):
+    """
+    :param config: mc.Config
+    :param entries: list of str entries
+    :return: list of the entries whose obs_id is not in the rejected file
+    """
+    rejected = get_rejected(config)
+    if len(rejected) == 0:
+        return entries
+    result = [ii for ii in entries if work.get_obs_id(ii) not in rejected
+              and os.path.basename(ii) not in rejected]
+    if len(result) < len(entries):
+        logging.info(f'Skipping {len(entries) - len(result)} entries with a '
+                     f'rejected obs_id.')
+    return result
+
+
+def _reject(fqn, rejections):
+    """
+    :param fqn: str the rejected file
+    :param rejections: dict of reason => list of obs_ids
+    """
+    content = {}
+    if os.path.exists(fqn):
+        content = mc.read_as_yaml(fqn) or {}
+    for reason, obs_ids in rejections.items():
+        existing = content.setdefault(reason, [])
+        for obs_id in obs_ids:
+            if obs_id not in existing:
+                existing.append(obs_id)
+    mc.create_dir(os.path.dirname(fqn))
+    mc.write_as_yaml(content, fqn)
+
+
+def _read_failures(fqn):
+    """
+    :param fqn: str failure log, with lines of 'date time obs_id entry
+        message'
+    :return: list of (obs_id, entry, message)
+    """
+    result = []
+    if os.path.exists(fqn):
+        with open(fqn) as f:
+            for line in f:
+                bits = line.rstrip('\n').split(' ', 4)
+                if len(bits) >= 4:
+                    result.append((bits[2], bits[3],
+                                   bits[4] if len(bits) == 5 else ''))
+    return result
+
+
+def _get_pass_config(config, log_directory):
+    result = copy.copy(config)
+    # the log and rejected file locations are derived from these
+    # directories
+    result.log_file_directory = log_directory
+    result.rejected_directory = log_directory
+    return result
+
+
+def _merge_pass(config, pass_config):
+    mc.create_dir(config.log_file_directory)
+    for file_name in [config.success_log_file_name,
+                      config.failure_log_file_name,
+                      config.progress_file_name]:
+        parallel._append_file(
+            os.path.join(pass_config.log_file_directory, file_name),
+            os.path.join(config.log_file_directory, file_name))
+    parallel._merge_rejected(pass_config.rejected_fqn, config.rejected_fqn)
+    shutil.rmtree(pass_config.log_file_directory, ignore_errors=True)
+
+
+def _find_obs_id(groups, obs_id, entry):
+    """The failure log records the obs_id, or, when the name of an entry
+    cannot be parsed, the entry, so this is the key of the group of entries
+    to retry."""
+    if obs_id in groups:
+        return obs_id
+    for key, members in groups.items():
+        if any(os.path.basename(ii) == os.path.basename(entry)
+               for ii in members):
+            return key
+    groups[obs_id] = [entry]
+    return obs_id
+
+
+def run(config, entries, run_pass):
+    """
+    Executes the entries, then retries the ones with transient failures,
+    and rejects the ones with permanent failures.
+
+    :param config: mc.Config
+    :param entries: list of str entries
+    :param run_pass: callable that accepts an mc.Config and a list of
+        entries, and returns 0 if successful, -1 otherwise
+    :return: 0 if every entry eventually succeeds, -1 otherwise
+    """
+    attempts = int(settings.get_value('retry_attempts', DEFAULT_ATTEMPTS))
+    queue = RetryQueue(
+        float(settings.get_value('retry_backoff_seconds',
+                                 DEFAULT_BACKOFF_SECONDS)),
+        float(settings.get_value('retry_backoff_max_seconds',
+                                 DEFAULT_BACKOFF_MAX_SECONDS)))
+    patterns = _get_patterns()
+    groups = work.group_by_obs_id(drop_rejected(config, entries))
+    # obs_id => the number of retries so far, for the obs_ids in a pass
+    due = {obs_id: 0 for obs_id in groups}
+    # the obs_ids that fail, and are not rejected
+    failed = set()
+    rejected = 0
+    result = 0
+    pass_index = 0
+    while len(due) > 0:
+        if pass_index > 0:
+            logging.info(f'Retrying {len(due)} obs_ids.')
+        pass_config = _get_pass_config(config, os.path.join(
+            config.log_file_directory,
+            f'{PASS_DIRECTORY_PREFIX}{pass_index}'))
+        mc.create_dir(pass_config.log_file_directory)
+        pass_result = run_pass(
+            pass_config, [ii for obs_id in due for ii in groups[obs_id]])
+        failures = _read_failures(pass_config.failure_fqn)
+        _merge_pass(config, pass_config)
+        if pass_result != 0 and len(failures) == 0:
+            # there is no telling what failed, so nothing to retry
+            result = -1
+        failed.difference_update(due)
+        rejections = {}
+        seen = set()
+        for obs_id, entry, message in failures:
+            obs_id = _find_obs_id(groups, obs_id, entry)
+            if obs_id in seen:
+                # there may be a failure for each entry of a group
+                continue
+            seen.add(obs_id)
+            kind, reason = classify(message, patterns)
+            retries = due.get(obs_id, 0)
+            if kind == PERMANENT:
+                logging.warning(f'Rejecting {obs_id}: {message}')
+                rejections.setdefault(reason, []).append(obs_id)
+                rejected += 1
+                continue
+            failed.add(obs_id)
+            if kind == TRANSIENT and retries < attempts:
+                queue.push(obs_id, retries + 1)
+        if len(rejections) > 0:
+            _reject(config.rejected_fqn, rejections)
+        due = queue.pop_due()
+        pass_index += 1
+    if len(failed) > 0:
+        mc.create_dir(os.path.dirname(config.retry_fqn))
+        with open(config.retry_fqn, 'a') as f:
+            for obs_id in sorted(failed):
+                for entry in groups[obs_id]:
+                    f.write(f'{entry}\n')
+    if len(failed) > 0 or rejected > 0:
+        result = -1
+    logging.info(f'After {pass_index} passes, {len(failed)} obs_ids failed, '
+                 f'and {rejected} were rejected.')
+    return result
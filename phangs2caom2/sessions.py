@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Shared, pooled HTTP sessions for the CADC data and CAOM2 repository clients.
+
+Each cadcutils client creates its own requests session, so creating a client
+per entry pays the TCP and TLS handshakes, and the proxy certificate
+loading, over and over. Here there is one client for each kind of client,
+set of credentials and service in a process, shared by all the entries and
+threads of the process, with a keep-alive connection pool of
+'http_pool_size' connections per host.
+
+Servers close keep-alive connections that are idle for too long. As a health
+check, a pool that has been idle for longer than 'http_idle_seconds' is
+dropped before the next request, so that request opens a fresh connection
+rather than failing on a closed one.
+
+The request, connection and reuse counts are included in the per-entry
+stage timing records, and in the run summary - see the timing module.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from cadcdata import CadcDataClient
+from cadcutils import net
+from caom2pipe import manage_composable as mc
+from caom2repo import CAOM2RepoClient
+from requests.adapters import HTTPAdapter
+
+from phangs2caom2 import settings, timing
+
+
+__all__ = ['PooledAdapter', 'get_counters', 'get_data_client',
+           'get_repo_client', 'get_subject', 'share_data_clients']
+
+
+POOL_SIZE_DEFAULT = 10
+IDLE_SECONDS_DEFAULT = 60
+COUNTERS_NAME = 'http'
+
+_lock = threading.Lock()
+# key => client, for the life of the process
+_clients = {}
+# the adapters mounted on the sessions of all the clients
+_adapters = []
+
+
+class PooledAdapter(HTTPAdapter):
+    """An HTTPAdapter that counts requests and new connections, and drops its
+    connections when they have been idle for too long."""
+
+    def __init__(self, pool_size, idle_seconds):
+        super(PooledAdapter, self).__init__(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        self._idle_seconds = idle_seconds
+        self._last_send = None
+        self._send_lock = threading.Lock()
+        # connections opened by pools that have been dropped
+        self._dropped_connections = 0
+        self.requests = 0
+        self.health_resets = 0
+
+    def send(self, request, **kwargs):
+        with self._send_lock:
+            now = time.monotonic()
+            if (self._last_send is not None and
+                    now - self._last_send > self._idle_seconds):
+                self._dropped_connections += self._opened_connections()
+                self.poolmanager.clear()
+                self.health_resets += 1
+            self._last_send = now
+            self.requests += 1
+        return super(PooledAdapter, self).send(request, **kwargs)
+
+    def _opened_connections(self):
+        pools = self.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    @property
+    def connections(self):
+        """The number of connections opened, over the life of the adapter."""
+        return self._dropped_connections + self._opened_connections()
+
+
+def _mount(client):
+    """Mount a PooledAdapter on the session of every cadcutils web service
+    client held by client."""
+    pool_size = int(settings.get_value('http_pool_size', POOL_SIZE_DEFAULT))
+    idle_seconds = float(
+        settings.get_value('http_idle_seconds', IDLE_SECONDS_DEFAULT))
+    for value in vars(client).values():
+        if isinstance(value, net.BaseWsClient):
+            adapter = PooledAdapter(pool_size, idle_seconds)
+            session = value._get_session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _adapters.append(adapter)
+
+
+def _subject_key(subject):
+    return (getattr(subject, 'username', None),
+            getattr(subject, 'certificate', None),
+            getattr(subject, 'netrc', None))
+
+
+def _get_client(factory, subject, *args, **kwargs):
+    key = (factory, _subject_key(subject), args,
+           tuple(sorted(kwargs.items())))
+    with _lock:
+        result = _clients.get(key)
+        if result is None:
+            logging.debug(f'Creating shared {factory} client.')
+            result = factory(subject, *args, **kwargs)
+            _mount(result)
+            _clients[key] = result
+        return result
+
+
+def get_subject(config):
+    """
+    :param config: mc.Config
+    :return: cadcutils.net.Subject for the proxy certificate, or, when there
+        is none, the netrc file, named in config.yml
+    """
+    if config.proxy_fqn is not None and os.path.exists(config.proxy_fqn):
+        return net.Subject(certificate=config.proxy_fqn)
+    if config.netrc_file is not None:
+        return net.Subject(netrc=config.netrc_file)
+    raise mc.CadcException(
+        'One of proxy_file_name or netrc_filename must have a value.')
+
+
+def get_data_client(subject):
+    """
+    :param subject: cadcutils.net.Subject
+    :return: the CadcDataClient for the subject's credentials, shared by the
+        process
+    """
+    return _get_client(CadcDataClient, subject)
+
+
+def get_repo_client(subject, resource_id):
+    """
+    :param subject: cadcutils.net.Subject
+    :param resource_id: str repository service
+    :return: the CAOM2RepoClient for the subject's credentials and service,
+        shared by the process
+    """
+    return _get_client(CAOM2RepoClient, subject, resource_id=resource_id)
+
+
+class _SharedClientFactory(object):
+    """Stands in for a client class, returning shared instances."""
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self, subject, *args, **kwargs):
+        return _get_client(self.factory, subject, *args, **kwargs)
+
+
+def share_data_clients(module):
+    """fits2caom2 creates a CadcDataClient for every gen_proc call. Replace
+    the module's CadcDataClient with a factory that returns shared
+    clients.
+
+    :param module: a module with a CadcDataClient attribute
+    """
+    current = module.CadcDataClient
+    if not isinstance(current, _SharedClientFactory):
+        module.CadcDataClient = _SharedClientFactory(current)
+
+
+def get_counters():
+    """
+    :return: dict of str => int, the process totals for requests, opened
+        connections, reused connections, and idle pool drops
+    """
+    with _lock:
+        adapters = list(_adapters)
+    requests = sum(ii.requests for ii in adapters)
+    connections = sum(ii.connections for ii in adapters)
+    return {'requests': requests,
+            'connections': connections,
+            'reused': max(0, requests - connections),
+            'health_resets': sum(ii.health_resets for ii in adapters)}
+
+
+timing.register_counters(COUNTERS_NAME, get_counters)
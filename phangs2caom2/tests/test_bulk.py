@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import gzip
+import json
+import os
+import pytest
+
+from mock import patch
+
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import bulk
+
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+TEST_DATA_DIR = os.path.join(THIS_DIR, 'data')
+TEST_OBS_IDS = ['ngc2903_7m+tp_co21', 'ngc2903_12m+7m+tp_co21']
+
+
+def _expected(obs_id):
+    return os.path.join(TEST_DATA_DIR, f'{obs_id}.expected.xml')
+
+
+def _write(fqn):
+    for obs_id in TEST_OBS_IDS + TEST_OBS_IDS[:1]:
+        with open(_expected(obs_id)) as f:
+            bulk.append(fqn, 'PHANGS', obs_id, f.read())
+
+
+def test_bulk(tmpdir):
+    fqn = os.path.join(str(tmpdir), 'scrape.ndjson.gz')
+    _write(fqn)
+
+    # a single stream of newline-delimited JSON
+    with gzip.open(fqn, 'rt') as f:
+        records = [json.loads(line) for line in f]
+    assert [ii['obs_id'] for ii in records] == \
+        TEST_OBS_IDS + TEST_OBS_IDS[:1], 'wrong content'
+
+    test_subject = bulk.BulkReader(fqn)
+    assert len(test_subject) == 2, 'duplicates should collapse'
+    assert list(test_subject) == TEST_OBS_IDS[::-1], 'last one wins'
+    assert 'ngc2903_7m+tp_co21' in test_subject, 'should contain'
+    for obs_id in TEST_OBS_IDS:
+        assert test_subject.read(obs_id).observation_id == obs_id, \
+            'wrong observation'
+        assert bulk.compare_observations(
+            test_subject, obs_id, _expected(obs_id)) is None, \
+            'should be the same'
+    assert bulk.compare_observations(
+        test_subject, TEST_OBS_IDS[0], _expected(TEST_OBS_IDS[1])) \
+        is not None, 'should differ'
+    with pytest.raises(mc.CadcException):
+        test_subject.read('ngc0000_7m+tp_co21')
+
+
+def test_bulk_no_index(tmpdir):
+    fqn = os.path.join(str(tmpdir), 'scrape.ndjson.gz')
+    _write(fqn)
+    with open(f'{fqn}{bulk.INDEX_EXTENSION}') as f:
+        expected = f.read()
+    os.unlink(f'{fqn}{bulk.INDEX_EXTENSION}')
+    test_subject = bulk.BulkReader(fqn)
+    assert list(test_subject) == TEST_OBS_IDS[::-1], 'wrong scan'
+    assert [json.dumps(ii) for ii in bulk._scan(fqn)] == \
+        expected.splitlines(), 'scan should match the index'
+    for read_size in [7, 1000]:
+        # members that span blocks, and blocks that span members
+        assert [json.dumps(ii) for ii in bulk._scan(fqn, read_size)] == \
+            expected.splitlines(), f'read_size {read_size}'
+    assert test_subject.read(TEST_OBS_IDS[1]).observation_id == \
+        TEST_OBS_IDS[1], 'wrong observation'
+
+
+def test_get_fqn():
+    values = {'bulk_output': 'scrape.ndjson.gz',
+              'working_directory': '/usr/src/app',
+              'task_types': ['scrape']}
+    with patch('phangs2caom2.bulk.settings.get_value',
+               side_effect=lambda key, default=None:
+               values.get(key, default)):
+        assert bulk.get_fqn() == '/usr/src/app/scrape.ndjson.gz', \
+            'wrong fqn'
+        values['task_types'] = ['ingest']
+        assert bulk.get_fqn() is None, 'only when scraping'
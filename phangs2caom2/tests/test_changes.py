@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import os
+import test_footprint_augmentation
+
+import numpy as np
+
+from datetime import datetime
+from mock import patch
+from types import SimpleNamespace
+
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import changes, footprint_augmentation
+from phangs2caom2 import preview_augmentation
+
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+TEST_DATA_DIR = os.path.join(THIS_DIR, 'data')
+TEST_OBS_ID = 'ngc2903_7m+tp_co21'
+
+
+class FakeRepoClient(object):
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.written = []
+        self.directory = TEST_DATA_DIR
+
+    def read(self, collection, observation_id):
+        return mc.read_obs_from_file(
+            os.path.join(self.directory, f'{observation_id}.expected.xml'))
+
+    def create(self, observation):
+        self.written.append(observation.observation_id)
+
+    def update(self, observation):
+        self.written.append(observation.observation_id)
+
+
+def test_skip_unchanged():
+    fake = FakeRepoClient()
+    test_subject = changes.SkipUnchangedClient(fake)
+    before = changes.get_counts()
+
+    observation = test_subject.read('PHANGS', TEST_OBS_ID)
+    # the service sets timestamps
+    observation.last_modified = datetime(2021, 3, 4)
+    for plane in observation.planes.values():
+        plane.max_last_modified = datetime(2021, 3, 4)
+    test_subject.update(observation)
+    assert fake.written == [], 'unchanged should not be written'
+
+    observation = test_subject.read('PHANGS', TEST_OBS_ID)
+    plane = list(observation.planes.values())[0]
+    plane.provenance.version = '4.1'
+    test_subject.update(observation)
+    assert fake.written == [TEST_OBS_ID], 'changed should be written'
+
+    # not read first, so nothing to compare with
+    test_subject.update(observation)
+    test_subject.create(observation)
+    assert len(fake.written) == 3, 'should be written'
+
+    after = changes.get_counts()
+    assert after['skipped'] - before['skipped'] == 1, 'wrong skipped'
+    assert after['written'] - before['written'] == 3, 'wrong written'
+
+
+@patch('phangs2caom2.footprint_augmentation.settings.get_value')
+def test_skip_unchanged_visitors(get_value_mock, tmpdir):
+    get_value_mock.side_effect = lambda key, default=None: default
+    science_file = test_footprint_augmentation.CUBE
+    data = np.full((1, 3, 20, 30), np.nan, dtype=np.float32)
+    data[0, 1, 5:15, 10:25] = 1.0
+    test_footprint_augmentation._write(
+        os.path.join(tmpdir, science_file), data)
+    kwargs = {'working_directory': str(tmpdir), 'science_file': science_file}
+    visitors = [footprint_augmentation, preview_augmentation]
+
+    # what the repository has from the first ingest
+    observation = test_footprint_augmentation._get_observation()
+    for visitor in visitors:
+        visitor.visit(observation, **kwargs)
+    mc.write_obs_to_file(
+        observation,
+        os.path.join(tmpdir, f'{observation.observation_id}.expected.xml'))
+
+    fake = FakeRepoClient()
+    fake.directory = str(tmpdir)
+    test_subject = changes.SkipUnchangedClient(fake)
+    observation = test_subject.read('PHANGS', observation.observation_id)
+    ids = [artifact._id for plane in observation.planes.values()
+           for artifact in plane.artifacts.values()]
+    for visitor in visitors:
+        visitor.visit(observation, **kwargs)
+    assert [artifact._id for plane in observation.planes.values()
+            for artifact in plane.artifacts.values()] == ids, \
+        'artifacts should be updated in place'
+    test_subject.update(observation)
+    assert fake.written == [], 'a re-run should not be written'
+
+
+def test_skip_unchanged_writes():
+    module = SimpleNamespace(CAOM2RepoClient=FakeRepoClient)
+    with patch('phangs2caom2.changes.settings.get_value', return_value=True):
+        changes.skip_unchanged_writes(module)
+        changes.skip_unchanged_writes(module)
+    assert module.CAOM2RepoClient.factory is FakeRepoClient, 'wrapped once'
+    test_result = module.CAOM2RepoClient('subject', 20, 'ivo://a')
+    assert isinstance(test_result, changes.SkipUnchangedClient), \
+        'wrong client'
+    assert test_result.args == ('subject', 20, 'ivo://a'), \
+        'other attributes from the wrapped client'
+
+    module = SimpleNamespace(CAOM2RepoClient=FakeRepoClient)
+    with patch('phangs2caom2.changes.settings.get_value', return_value=False):
+        changes.skip_unchanged_writes(module)
+    assert module.CAOM2RepoClient is FakeRepoClient, 'should not wrap'
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import os
+import pytest
+
+from datetime import datetime
+from mock import Mock, patch
+
+from phangs2caom2 import checkpoint, composed
+
+
+TEST_ENTRIES = ['ngc2903_7m+tp_co21.fits',
+                'ngc2903_7m+tp_co21_noise.fits',
+                'ngc5236_7m+tp_co21.fits',
+                'ngc5236_7m+tp_co21_strict_mom0.fits']
+START = datetime(2021, 5, 1, 10, 0, 0)
+
+
+def _settings(key, default=None):
+    if key in ['state_checkpoints', 'use_local_files']:
+        return True
+    return default
+
+
+def test_checkpoint(tmpdir):
+    test_subject = checkpoint.Checkpoint(
+        os.path.join(str(tmpdir), 'checkpoint.db'))
+    try:
+        test_subject.record('a', TEST_ENTRIES[:2])
+        test_subject.record('a', TEST_ENTRIES[1:3])
+        test_subject.record('b', TEST_ENTRIES[3:])
+        assert test_subject.get_done('a') == set(TEST_ENTRIES[:3]), 'a'
+        test_subject.begin('b')
+        assert test_subject.get_done('a') == set(), 'a is forgotten'
+        assert test_subject.get_done('b') == {TEST_ENTRIES[3]}, 'b is kept'
+    finally:
+        test_subject.close()
+
+
+class Crash(Exception):
+    pass
+
+
+def _run_by_todo(crash_at):
+    """Stands in for rc.run_by_todo, building the StorageName for each
+    entry, and stopping the process partway through."""
+
+    def _run(**kwargs):
+        for index, entry in enumerate(kwargs['source'].get_work()):
+            if index == crash_at:
+                raise Crash()
+            kwargs['name_builder'].build(entry)
+        return 0
+    return _run
+
+
+@patch('phangs2caom2.composed.settings.get_value', new=_settings)
+@patch('phangs2caom2.checkpoint.settings.get_value', new=_settings)
+@patch('phangs2caom2.composed.rc.run_by_todo')
+def test_resume(run_mock, tmpdir):
+    config = Mock(task_types=[], working_directory=str(tmpdir))
+    run_mock.side_effect = _run_by_todo(crash_at=2)
+    with checkpoint.time_box(config, START, TEST_ENTRIES) as entries:
+        assert entries == TEST_ENTRIES, 'nothing attempted yet'
+        with pytest.raises(Crash):
+            composed._run_by_todo(config, entries)
+    assert checkpoint.TIME_BOX_ENV not in os.environ, 'environment'
+
+    # the entry in progress when the process stopped is attempted again
+    run_mock.side_effect = _run_by_todo(crash_at=None)
+    with checkpoint.time_box(config, START, TEST_ENTRIES) as entries:
+        assert entries == TEST_ENTRIES[1:], 'resumed'
+        assert composed._run_by_todo(config, entries) == 0, 'result'
+
+    with checkpoint.time_box(config, START, TEST_ENTRIES) as entries:
+        assert entries == [], 'all attempted'
+
+    # a new time-box starts from nothing
+    with checkpoint.time_box(
+            config, datetime(2021, 5, 2), TEST_ENTRIES) as entries:
+        assert entries == TEST_ENTRIES, 'next time-box'
+
+
+@patch('phangs2caom2.checkpoint.settings.get_value')
+def test_not_in_use(settings_mock, tmpdir):
+    settings_mock.return_value = False
+    config = Mock(working_directory=str(tmpdir))
+    with checkpoint.time_box(config, START, TEST_ENTRIES) as entries:
+        assert entries is TEST_ENTRIES, 'unchanged'
+    assert not os.path.exists(
+        os.path.join(str(tmpdir), checkpoint.DEFAULT_FILE_NAME)), 'no file'
+    # outside of a time-box, entries are not recorded
+    name_builder = checkpoint.CheckpointNameBuilder(Mock())
+    name_builder.build(TEST_ENTRIES[0])
+    name_builder.close()
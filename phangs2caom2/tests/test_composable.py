@@ -70,6 +70,7 @@
 import os
 import test_main_app
 
+from datetime import datetime, timedelta
 from mock import Mock, patch
 
 from phangs2caom2 import composed, PHANGSName, COLLECTION
@@ -79,6 +80,93 @@ def test_run_by_state():
     pass
 
 
+@patch('phangs2caom2.composed.timing.finish_entry')
+@patch('phangs2caom2.composed._set_up_clients')
+@patch('phangs2caom2.composed._run_time_boxes')
+@patch('phangs2caom2.composed.rc.run_by_state')
+@patch('phangs2caom2.composed.settings.get_value')
+def test_run_state_defaults(settings_mock, run_mock, time_boxes_mock,
+                            clients_mock, finish_mock):
+    settings_mock.side_effect = lambda key, default=None: default
+    run_mock.return_value = 0
+    time_boxes_mock.return_value = 0
+    assert composed._run_state() == 0, 'wrong result'
+    assert run_mock.called, 'remote work stays with the caom2pipe runner'
+    assert not time_boxes_mock.called, 'no time-boxes for remote work'
+
+    run_mock.reset_mock()
+    settings_mock.side_effect = \
+        lambda key, default=None: key == 'use_local_files' or default
+    assert composed._run_state() == 0, 'wrong result'
+    assert time_boxes_mock.called, 'local work gets sized time-boxes'
+    assert not run_mock.called, 'no caom2pipe interval windows'
+
+
+@patch('phangs2caom2.composed._run_entries')
+@patch('phangs2caom2.composed.work.get_pending')
+@patch('phangs2caom2.composed.mc.State')
+@patch('phangs2caom2.composed.mc.Config')
+@patch('phangs2caom2.time_boxes.settings.get_value')
+def test_run_time_boxes_sized(settings_mock, config_mock, state_mock,
+                              pending_mock, run_mock):
+    settings_mock.side_effect = lambda key, default=None: {
+        'use_local_files': True,
+        'time_box_target_entries': 2}.get(key, default)
+    start = datetime(2021, 5, 1, 10)
+    end_time = datetime(2021, 5, 2, 10)
+    # an interval window would hold all five entries
+    config_mock.return_value = Mock(interval=600, task_types=[])
+    state_mock.return_value.get_bookmark.return_value = start
+    pending_mock.return_value = [
+        ((start + timedelta(minutes=20 * ii)).timestamp(), f'entry_{ii}')
+        for ii in range(1, 6)]
+    run_mock.return_value = 0
+    assert composed._run_time_boxes(1, end_time) == 0, 'wrong result'
+    assert [args[1] for args, kwargs in run_mock.call_args_list] == [
+        ['entry_1', 'entry_2'], ['entry_3', 'entry_4'], ['entry_5']], \
+        'time-boxes should be sized by entry count'
+
+
+@patch('phangs2caom2.composed.mc.Config')
+@patch('phangs2caom2.composed.pipeline.run')
+@patch('phangs2caom2.composed.settings.get_value')
+def test_run_async_streams(settings_mock, run_mock, config_mock, tmpdir):
+    settings_mock.side_effect = \
+        lambda key, default=None: key == 'async_ingest' or default
+    run_mock.return_value = 0
+    config_mock.return_value = Mock(
+        use_local_files=False, task_types=[],
+        work_fqn=os.path.join(str(tmpdir), 'todo.txt'))
+    with open(config_mock.return_value.work_fqn, 'w') as f:
+        f.write('ngc2903_7m+tp_co21.fits\n')
+    assert composed._run() == 0, 'wrong result'
+    args, kwargs = run_mock.call_args
+    assert not isinstance(args[1], list), 'entries are found as needed'
+    assert list(args[1]) == ['ngc2903_7m+tp_co21.fits'], 'wrong entries'
+
+
+@patch('phangs2caom2.composed.settings.get_value')
+@patch('phangs2caom2.composed.rc.run_by_todo')
+def test_run_by_todo_grouped(run_mock, settings_mock):
+    settings_mock.side_effect = \
+        lambda key, default=None: key == 'group_by_observation' or default
+    run_mock.return_value = 0
+    config = Mock(task_types=[])
+    test_entries = ['ngc2903_7m+tp_co21_broad_mom0.fits',
+                    'ngc2903_12m+7m+tp_co21.fits',
+                    'ngc2903_7m+tp_co21_noise.fits']
+    assert composed._run_by_todo(config, test_entries) == 0, 'wrong result'
+    args, kwargs = run_mock.call_args
+    assert list(kwargs.get('source').get_work()) == [
+        'ngc2903_7m+tp_co21_broad_mom0.fits',
+        'ngc2903_12m+7m+tp_co21.fits'], 'one entry per obs_id'
+    test_storage = kwargs.get('name_builder').build(test_entries[0])
+    assert test_storage.obs_id == 'ngc2903_7m+tp_co21', 'wrong obs id'
+    assert test_storage.multiple_files() == [
+        'ngc2903_7m+tp_co21_broad_mom0.fits',
+        'ngc2903_7m+tp_co21_noise.fits'], 'wrong members'
+
+
 @patch('caom2pipe.execute_composable.OrganizeExecutes.do_one')
 def test_run(run_mock):
     test_obs_id = 'test_obs_id'
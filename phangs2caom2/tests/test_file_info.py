@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import gzip
+import hashlib
+import os
+
+import numpy as np
+
+from astropy.io import fits
+
+from phangs2caom2 import file_info, header_cache, headers
+
+
+def _make_file(fqn, value, shape=(40, 50)):
+    hdu = fits.PrimaryHDU(data=np.ones(shape, dtype=np.float32))
+    hdu.header['OBJECT'] = value
+    for index in range(60):
+        # more than one header block
+        hdu.header[f'KEY{index}'] = index
+    hdu.writeto(fqn, overwrite=True)
+
+
+def _md5(fqn):
+    with open(fqn, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def test_scan(tmpdir):
+    fqn = os.path.join(str(tmpdir), 'ngc2903_7m+tp_co21.fits')
+    _make_file(fqn, 'NGC2903')
+    gz_fqn = f'{fqn}.gz'
+    with open(fqn, 'rb') as f_in, gzip.open(gz_fqn, 'wb') as f_out:
+        f_out.write(f_in.read())
+    for ii in [fqn, gz_fqn]:
+        test_result = file_info.scan(ii)
+        assert test_result.size == os.path.getsize(ii), 'wrong size'
+        assert test_result.md5 == _md5(ii), 'wrong md5'
+        assert test_result.header == headers.read_primary_header(ii), \
+            'wrong header'
+
+    other_fqn = os.path.join(str(tmpdir), 'ngc2903_7m+tp_co21_prev.jpg')
+    with open(other_fqn, 'wb') as f:
+        f.write(b'\xff\xd8' * 3000)
+    test_result = file_info.scan(other_fqn)
+    assert test_result.header is None, 'not a FITS file'
+    assert test_result.md5 == _md5(other_fqn), 'wrong md5'
+
+
+def test_get_file_info(tmpdir):
+    fqn = os.path.join(str(tmpdir), 'ngc2903_7m+tp_co21.fits')
+    _make_file(fqn, 'NGC2903')
+    cache = header_cache.HeaderCache(os.path.join(str(tmpdir), 'cache.db'))
+    try:
+        assert file_info.get_cached(fqn) is None, 'not read yet'
+        before = file_info.get_counters()
+        test_result = file_info.get_file_info(fqn, cache)
+        assert test_result.header['OBJECT'] == 'NGC2903', 'wrong header'
+        assert file_info.get_cached(fqn) is test_result, 'kept'
+        assert file_info.get_file_info(fqn, cache) is test_result, 'kept'
+        after = file_info.get_counters()
+        assert after['scans'] == before['scans'] + 1, 'one pass'
+        assert after['bytes_read'] == \
+            before['bytes_read'] + os.path.getsize(fqn), 'bytes read'
+        assert cache.get_md5(fqn) == test_result.md5, 'in the header cache'
+
+        # another process has the result from the header cache
+        file_info._infos.clear()
+        from_cache = file_info.get_file_info(fqn, cache)
+        assert from_cache.md5 == test_result.md5, 'cached md5'
+        assert from_cache.header['OBJECT'] == 'NGC2903', 'cached header'
+        assert file_info.get_counters()['scans'] == after['scans'], \
+            'not read again'
+
+        # a changed file is read again
+        _make_file(fqn, 'NGC5236', shape=(10, 10))
+        stat = os.stat(fqn)
+        os.utime(fqn, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        assert file_info.get_cached(fqn) is None, 'stale'
+        assert file_info.get_file_info(fqn, cache).md5 == _md5(fqn), 'new'
+    finally:
+        cache.close()
+
+
+class FakeDataClient(object):
+    """Computes the Content-MD5 checksum the way CadcDataClient does."""
+
+    def __init__(self):
+        self.headers = None
+
+    def _get_md5sum(self, src_file):
+        raise AssertionError('the file should not be read for its md5')
+
+    def put_file(self, archive, src_file, md5_check=True, **kwargs):
+        self.headers = {}
+        if md5_check:
+            self.headers['Content-MD5'] = self._get_md5sum(src_file)
+
+    def get_file(self, archive, file_name):
+        return file_name
+
+
+def test_single_pass_put(tmpdir):
+    fqn = os.path.join(str(tmpdir), 'ngc2903_7m+tp_co21.fits')
+    _make_file(fqn, 'NGC2903')
+    client = FakeDataClient()
+    test_subject = file_info.SinglePassDataClient(client)
+    file_info.get_file_info(fqn)
+    before = file_info.get_counters()['scans']
+    test_subject.put_file('PHANGS', fqn, mime_type='application/fits')
+    assert client.headers == {'Content-MD5': _md5(fqn)}, \
+        'the client check should have the single pass md5'
+    assert file_info.get_counters()['scans'] == before, 'no more reads'
+    test_subject.put_file('PHANGS', fqn, md5_check=False)
+    assert client.headers == {}, 'md5_check is passed through'
+    assert test_subject.get_file('PHANGS', 'x') == 'x', 'delegated'
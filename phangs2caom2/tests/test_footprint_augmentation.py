@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import os
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.wcs import WCS
+from mock import patch
+
+from caom2 import Algorithm, Artifact, Chunk, CoordAxis2D, Axis, Part
+from caom2 import Plane, ProductType, ReleaseType, SimpleObservation
+from caom2 import SpatialWCS
+from phangs2caom2 import footprint_augmentation, headers
+
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+TEST_DATA_DIR = os.path.join(THIS_DIR, 'data')
+OBS_ID = 'ngc2903_7m+tp_co21'
+CUBE = f'{OBS_ID}.fits'
+MASK = f'{OBS_ID}_broadmask.fits'
+
+
+def _write(fqn, data):
+    header = headers.get_local_headers(
+        os.path.join(TEST_DATA_DIR, f'{CUBE}.header'))[0]
+    hdu = fits.PrimaryHDU(data=data)
+    for key, value in header.items():
+        if key not in hdu.header and not key.startswith('NAXIS') and \
+                key not in ['COMMENT', 'HISTORY', '']:
+            hdu.header[key] = value
+    hdu.writeto(fqn, overwrite=True)
+    return hdu.header
+
+
+def test_get_outline():
+    valid = np.zeros((10, 12), dtype=bool)
+    valid[2:8, 3:9] = True
+    valid[4, 1] = True
+    expected = [[8.5, 1.5], [8.5, 7.5], [2.5, 7.5], [2.5, 4.5], [0.5, 4.5],
+                [0.5, 3.5], [2.5, 3.5], [2.5, 1.5]]
+    np.testing.assert_array_equal(
+        footprint_augmentation.get_outline(valid), expected)
+    # fewer bands, so fewer vertices, still covering every valid pixel
+    np.testing.assert_array_equal(
+        footprint_augmentation.get_outline(valid, 2),
+        [[8.5, 1.5], [8.5, 7.5], [2.5, 7.5], [2.5, 4.5], [0.5, 4.5],
+         [0.5, 1.5]])
+    assert footprint_augmentation.get_outline(
+        np.zeros((3, 3), dtype=bool)) is None, 'no valid pixels'
+
+
+def test_get_valid_pixels(tmpdir):
+    data = np.full((1, 4, 6, 8), np.nan, dtype=np.float32)
+    data[0, 1, 2:4, 3:5] = 1.0
+    data[0, 3, 5, 0] = 2.0
+    fqn = os.path.join(tmpdir, CUBE)
+    _write(fqn, data)
+    header, valid = footprint_augmentation.get_valid_pixels(fqn, False, 1)
+    expected = np.zeros((6, 8), dtype=bool)
+    expected[2:4, 3:5] = True
+    expected[5, 0] = True
+    np.testing.assert_array_equal(valid, expected)
+
+    mask = np.zeros((4, 6, 8), dtype=np.uint8)
+    mask[2, 1, 1] = 1
+    mask_fqn = os.path.join(tmpdir, MASK)
+    _write(mask_fqn, mask)
+    header, valid = footprint_augmentation.get_valid_pixels(
+        mask_fqn, True, 1)
+    assert valid.sum() == 1 and valid[1, 1], 'mask'
+
+
+def _get_observation():
+    observation = SimpleObservation('PHANGS', OBS_ID, Algorithm('exposure'))
+    for file_name, product_type in [
+            (CUBE, ProductType.SCIENCE),
+            (f'{OBS_ID}_noise.fits', ProductType.NOISE)]:
+        plane = Plane(file_name.replace('.fits', ''))
+        artifact = Artifact(
+            f'ad:PHANGS/{file_name}', product_type, ReleaseType.DATA)
+        part = Part('0')
+        chunk = Chunk()
+        chunk.position = SpatialWCS(
+            CoordAxis2D(Axis('RA---SIN', 'deg'), Axis('DEC--SIN', 'deg')))
+        part.chunks.append(chunk)
+        artifact.parts['0'] = part
+        plane.artifacts[artifact.uri] = artifact
+        observation.planes[plane.product_id] = plane
+    return observation
+
+
+@patch('phangs2caom2.footprint_augmentation.settings.get_value')
+def test_visit(get_value_mock, tmpdir):
+    get_value_mock.side_effect = lambda key, default=None: default
+    data = np.full((1, 3, 20, 30), np.nan, dtype=np.float32)
+    data[0, 1, 5:15, 10:25] = 1.0
+    header = _write(os.path.join(tmpdir, CUBE), data)
+    kwargs = {'working_directory': str(tmpdir), 'science_file': CUBE}
+
+    observation = _get_observation()
+    result = footprint_augmentation.visit(observation, **kwargs)
+    assert result == {'chunks': 2}, 'every plane shares the footprint'
+    vertices = []
+    for plane in observation.planes.values():
+        for artifact in plane.artifacts.values():
+            bounds = artifact.parts['0'].chunks[0].position.axis.bounds
+            vertices.append(
+                [[ii.coord1, ii.coord2] for ii in bounds.vertices])
+    assert vertices[0] == vertices[1], 'same footprint'
+    assert len(vertices[0]) == 4, 'a rectangle'
+    # the corners of the pixels with data
+    ra, dec = WCS(header).celestial.all_pix2world(
+        [24.5, 24.5, 9.5, 9.5], [4.5, 14.5, 14.5, 4.5], 0)
+    np.testing.assert_allclose(
+        sorted(vertices[0]), sorted(np.column_stack([ra, dec]).tolist()),
+        rtol=1e-9)
+    # counter-clockwise on the sky, with RA increasing to the east
+    x = np.array([ii[0] for ii in vertices[0]])
+    y = np.array([ii[1] for ii in vertices[0]])
+    assert np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) > 0, 'winding'
+
+    # the mask takes precedence, and the footprint is cached by obs_id
+    mask = np.zeros((3, 20, 30), dtype=np.uint8)
+    mask[1, 8:10, 12:14] = 1
+    _write(os.path.join(tmpdir, MASK), mask)
+    cache = footprint_augmentation._get_cache(str(tmpdir))
+    misses = cache.misses
+    observation = _get_observation()
+    footprint_augmentation.visit(observation, **kwargs)
+    assert cache.misses == misses + 1, 'mask is new'
+    bounds = list(observation.planes.values())[0].artifacts[
+        f'ad:PHANGS/{CUBE}'].parts['0'].chunks[0].position.axis.bounds
+    assert len(bounds.vertices) == 4, 'mask rectangle'
+    hits = cache.hits
+    kwargs['science_file'] = f'{OBS_ID}_noise.fits'
+    footprint_augmentation.visit(_get_observation(), **kwargs)
+    assert cache.hits == hits + 1, 'cached by obs_id'
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import os
+
+from astropy.io import fits
+
+from phangs2caom2 import header_cache
+
+
+def _make_file(fqn, value):
+    header = fits.Header()
+    header['OBJECT'] = value
+    fits.PrimaryHDU(header=header).writeto(fqn, overwrite=True)
+    return header
+
+
+def test_get_put(tmpdir):
+    cache = header_cache.HeaderCache(os.path.join(str(tmpdir), 'cache.db'))
+    try:
+        fqn = os.path.join(str(tmpdir), 'ngc2903_7m+tp_co21.fits')
+        header = _make_file(fqn, 'NGC2903')
+        assert cache.get(fqn) is None, 'empty cache'
+        cache.put(fqn, header)
+        assert cache.get(fqn).get('OBJECT') == 'NGC2903', 'wrong header'
+        assert cache.hits == 1 and cache.misses == 1, 'wrong counts'
+
+        # a changed file is a miss
+        _make_file(fqn, 'NGC5236 has a longer name')
+        stat = os.stat(fqn)
+        os.utime(fqn, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        assert cache.get(fqn) is None, 'stale entry'
+
+        assert cache.invalidate([fqn]) == 1, 'wrong invalidate count'
+        assert len(cache) == 0, 'should be empty'
+    finally:
+        cache.close()
+
+
+def test_eviction(tmpdir):
+    cache = header_cache.HeaderCache(
+        os.path.join(str(tmpdir), 'cache.db'), max_entries=2)
+    try:
+        fqns = []
+        for index in range(3):
+            fqn = os.path.join(str(tmpdir), f'f{index}.fits')
+            cache.put(fqn, _make_file(fqn, f'{index}'))
+            fqns.append(fqn)
+        assert len(cache) == 2, 'wrong size'
+        assert cache.get(fqns[0]) is None, 'least recently used is evicted'
+        assert cache.get(fqns[2]) is not None, 'most recent is kept'
+        assert cache.invalidate() == 2, 'wrong invalidate all count'
+    finally:
+        cache.close()
+
+
+def test_md5(tmpdir):
+    cache = header_cache.HeaderCache(os.path.join(str(tmpdir), 'cache.db'))
+    try:
+        fqn = os.path.join(str(tmpdir), 'ngc2903_7m+tp_co21.fits')
+        header = _make_file(fqn, 'NGC2903')
+        cache.put(fqn, header)
+        assert cache.get_md5(fqn) is None, 'no md5 yet'
+        cache.put(fqn, header, 'abc')
+        assert cache.get_md5(fqn) == 'abc', 'md5'
+        # a header-only put keeps the md5 of the same version of the file
+        cache.put(fqn, header)
+        assert cache.get_md5(fqn) == 'abc', 'md5 kept'
+        stat = os.stat(fqn)
+        os.utime(fqn, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        assert cache.get_md5(fqn) is None, 'stale md5'
+        cache.put(fqn, header)
+        assert cache.get_md5(fqn) is None, 'md5 dropped'
+    finally:
+        cache.close()
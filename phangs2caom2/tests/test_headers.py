@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import gzip
+import numpy as np
+import os
+import pytest
+import shutil
+
+from astropy.io import fits
+
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import headers
+
+import test_main_app
+
+
+def _make_cube(fqn):
+    header = headers.get_local_headers(os.path.join(
+        test_main_app.TEST_DATA_DIR,
+        'ngc2903_7m+tp_co21.fits.header'))[0]
+    data = np.zeros((8, 175, 130), dtype=np.float32)
+    fits.PrimaryHDU(data=data, header=header).writeto(fqn)
+
+
+def test_read_primary_header(tmpdir):
+    fqn = os.path.join(str(tmpdir), 'ngc2903_7m+tp_co21.fits')
+    _make_cube(fqn)
+    raw = headers.read_header_blocks(fqn)
+    assert len(raw) % headers.BLOCK_SIZE == 0, 'whole blocks only'
+    assert len(raw) < os.path.getsize(fqn), 'read past the header'
+
+    test_result = headers.read_primary_header(fqn)
+    assert test_result.get('NAXIS') == 3, 'wrong NAXIS'
+    assert test_result.get('MOLECULE') == 'CO', 'wrong MOLECULE'
+    assert len(test_result.get('COMMENT')) > 0, 'lost COMMENT cards'
+
+    gz_fqn = f'{fqn}.gz'
+    with open(fqn, 'rb') as f_in, gzip.open(gz_fqn, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    assert headers.read_header_blocks(gz_fqn) == raw, 'gzip differs'
+
+
+def test_read_no_end_card(tmpdir):
+    fqn = os.path.join(str(tmpdir), 'truncated.fits')
+    with open(fqn, 'wb') as f:
+        f.write(b'SIMPLE  =                    T'.ljust(headers.BLOCK_SIZE))
+    with pytest.raises(mc.CadcException):
+        headers.read_header_blocks(fqn)
+
+
+def test_write_header_file(tmpdir):
+    fqn = os.path.join(str(tmpdir), 'ngc2903_7m+tp_co21.fits')
+    _make_cube(fqn)
+    test_result = headers.write_header_file(fqn, str(tmpdir))
+    assert test_result == f'{fqn}.header', 'wrong file name'
+    assert headers.get_local_headers(test_result)[0] == \
+        headers.read_primary_header(fqn), 'headers differ'
@@ -69,11 +69,16 @@
 
 from mock import patch
 
+from caom2 import Algorithm, Artifact, Chunk, CoordRange1D, Part, Plane
+from caom2 import ProductType, RefCoord, ReleaseType, SimpleObservation
+from caom2utils import ObsBlueprint
+
 from phangs2caom2 import main_app, APPLICATION, COLLECTION, PHANGSName
-from phangs2caom2 import ARCHIVE
+from phangs2caom2 import ARCHIVE, headers
 from caom2pipe import manage_composable as mc
 
 import glob
+import importlib
 import os
 import sys
 
@@ -165,10 +170,11 @@ LOOKUP = {'ngc2903_12m+7m+tp_co21':
 def pytest_generate_tests(metafunc):
     # obs_id_list = glob.glob(f'{TEST_DATA_DIR}/*.header')
     # metafunc.parametrize('test_name', obs_id_list)
-    obs_id_list = []
-    for ii in LOOKUP:
-        obs_id_list.append(ii)
-    metafunc.parametrize('test_name', obs_id_list)
+    if 'test_name' in metafunc.fixturenames:
+        obs_id_list = []
+        for ii in LOOKUP:
+            obs_id_list.append(ii)
+        metafunc.parametrize('test_name', obs_id_list)
 
 
 @patch('caom2utils.fits2caom2.CadcDataClient')
@@ -202,6 +208,131 @@ def test_main_app(data_client_mock, test_name):
     # assert False  # cause I want to see logging messages
 
 
+def test_build_blueprints():
+    module = importlib.import_module(main_app.__name__)
+    uris = [f'ad:{ARCHIVE}/{ii.replace(".header", "")}'
+            for ii in LOOKUP['ngc2903_7m+tp_co21']]
+    uris.append(f'ad:{ARCHIVE}/ngc5236_7m+tp_co21_broad_mom0.fits')
+    test_result = main_app._build_blueprints(uris)
+    for uri in uris:
+        expected = ObsBlueprint(module=module)
+        main_app.accumulate_bp(expected, uri)
+        assert str(test_result[uri]) == str(expected), f'wrong {uri}'
+    assert test_result[uris[-1]]._get('Observation.target.name') == \
+        'ngc5236', 'target name should not come from the template'
+    # copies of the same template are independent
+    test_result[uris[0]].add_fits_attribute('Plane.dataRelease', 'DATE-OBS')
+    copied = main_app._build_blueprints(uris[:1])[uris[0]]
+    assert str(copied) != str(test_result[uris[0]]), 'template modified'
+
+
+def test_parse_comments():
+    test_header = headers.get_local_headers(
+        f'{TEST_DATA_DIR}/ngc2903_7m+tp_co21.fits.header')[0]
+    test_result = main_app._get_comment_values(test_header)
+    assert test_result.calibration_level == '3', 'wrong level'
+    assert test_result.project == 'PHANGS-ALMA', 'wrong project'
+    assert test_result.organization == 'PHANGS', 'wrong organization'
+    assert test_result.producer == 'Leroy et al. (2021), ApJ, Submitted', \
+        'wrong producer'
+    assert test_result.last_executed == '2021-03-06T11:03:14.174468', \
+        'wrong last executed'
+    assert test_result.proposal_id == '2017.1.00886.L', 'wrong proposal'
+    assert test_result.pi_name == 'Schinnerer, Eva', 'wrong pi'
+    assert len(test_result.intervals) == 6, 'wrong interval count'
+    assert test_result.intervals[0] == (58077.386275, 58081.464121), \
+        'wrong first interval'
+    assert main_app._get_comment_values(test_header) is test_result, \
+        'should be cached'
+    del test_header
+    assert len(main_app._comment_values) == 0, 'should be released'
+
+
+def test_merge_intervals():
+    test_result, test_count = main_app._merge_intervals([])
+    assert test_result == [], 'empty'
+    assert test_count == 0, 'empty count'
+    test_header = headers.get_local_headers(
+        f'{TEST_DATA_DIR}/ngc2903_7m+tp_co21.fits.header')[0]
+    test_result, test_count = main_app._merge_intervals(
+        main_app._get_comment_values(test_header).intervals)
+    assert test_count == 1, 'wrong merged count'
+    assert test_result == [(58037.515807, 58047.541173),
+                           (58064.3677, 58072.458597),
+                           (58077.386275, 58081.464121),
+                           (58114.347649, 58139.301879),
+                           (58290.770032, 58381.654757)], 'wrong intervals'
+    # touching, contained and repeated intervals
+    test_result, test_count = main_app._merge_intervals(
+        [(5.0, 6.0), (1.0, 2.0), (2.0, 3.0), (1.5, 1.7), (5.0, 6.0)])
+    assert test_result == [(1.0, 3.0), (5.0, 6.0)], 'wrong merge'
+    assert test_count == 3, 'wrong count'
+
+
+def _get_observation(phangs_name):
+    chunk = Chunk()
+    part = Part('0')
+    part.chunks.append(chunk)
+    artifact = Artifact(phangs_name.file_uri, ProductType.SCIENCE,
+                        ReleaseType.DATA)
+    artifact.parts.add(part)
+    plane = Plane(phangs_name.product_id)
+    plane.artifacts.add(artifact)
+    observation = SimpleObservation(COLLECTION, phangs_name.obs_id,
+                                    Algorithm('exposure'))
+    observation.planes.add(plane)
+    return observation, chunk
+
+
+@patch('phangs2caom2.main_app.member_resolver.get_resolver')
+def test_update_header_file(resolver_mock):
+    # a connected --local run gives caom2utils the '.header' file, and the
+    # lineage names the '.fits' artifact
+    resolver_mock.return_value = None
+    test_header = headers.get_local_headers(
+        f'{TEST_DATA_DIR}/ngc2903_7m+tp_co21.fits.header')[0]
+    phangs_name = PHANGSName(file_name='ngc2903_7m+tp_co21.fits')
+    for kwargs in [
+            {'fqn': f'{TEST_DATA_DIR}/ngc2903_7m+tp_co21.fits.header',
+             'uri': phangs_name.file_uri},
+            {'fqn': f'{TEST_DATA_DIR}/ngc2903_7m+tp_co21.fits.header'}]:
+        observation, chunk = _get_observation(phangs_name)
+        main_app.update(observation, headers=[test_header], **kwargs)
+        assert chunk.time is not None, f'no time axis for {kwargs}'
+        assert len(chunk.time.axis.bounds.samples) == 5, 'wrong samples'
+        plane = observation.planes[phangs_name.product_id]
+        assert plane.provenance.project == 'PHANGS-ALMA', 'no provenance'
+
+
+def test_update_from_comment_replaces_samples():
+    test_header = headers.get_local_headers(
+        f'{TEST_DATA_DIR}/ngc2903_7m+tp_co21.fits.header')[0]
+    phangs_name = PHANGSName(file_name='ngc2903_7m+tp_co21.fits')
+    observation, chunk = _get_observation(phangs_name)
+    main_app._update_from_comment(observation, phangs_name, [test_header])
+    expected = [(ii.start.val, ii.end.val)
+                for ii in chunk.time.axis.bounds.samples]
+    assert len(expected) == 5, 'wrong first ingest'
+    # a stale interval from an earlier ingest, that the header no longer has
+    chunk.time.axis.bounds.samples.append(
+        CoordRange1D(RefCoord(0.5, 50000.0), RefCoord(1.5, 50001.0)))
+    main_app._update_from_comment(observation, phangs_name, [test_header])
+    assert [(ii.start.val, ii.end.val)
+            for ii in chunk.time.axis.bounds.samples] == expected, \
+        'samples should come only from the header'
+
+
+def test_get_local_files():
+    args = type('Args', (), {})()
+    args.local = [f'{TEST_DATA_DIR}/ngc2903_7m+tp_co21.fits']
+    args.lineage = _get_lineage('ngc2903_7m+tp_co21').split()
+    main_app._get_local_files(args)
+    assert len(args.local) == len(args.lineage), 'wrong number of files'
+    assert args.local[0] == os.path.join(
+        TEST_DATA_DIR, 'ngc2903_7m+tp_co21_11as_strict_emom0.fits.header'), \
+        'local files should follow the lineage order'
+
+
 def _get_file_info(archive, file_id):
     return {'type': 'application/fits'}
 
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import os
+
+from datetime import datetime, timedelta
+from mock import patch
+
+from phangs2caom2 import file_info, manifest
+
+
+TEST_ENTRIES = [
+    'ngc2903_7m+tp_co21.fits',
+    'ngc2903_7m+tp_co21_noise.fits',
+    'ngc5236_7m+tp_co21.fits',
+]
+
+
+def _get_config(tmpdir):
+    config = type('Config', (), {})()
+    config.working_directory = str(tmpdir)
+    config.use_local_files = True
+    config.success_fqn = os.path.join(str(tmpdir), 'success_log.txt')
+    for entry in TEST_ENTRIES:
+        tmpdir.join(entry).write(entry)
+    return config
+
+
+def _log_success(config, obs_id, file_name, when=None):
+    when = datetime.now() if when is None else when
+    with open(config.success_fqn, 'a') as f:
+        f.write(f'{when} {obs_id} {file_name} 1.23\n')
+
+
+def _settings(key, default=None):
+    return {'ingest_manifest': True}.get(key, default)
+
+
+@patch('phangs2caom2.manifest.settings.get_value', side_effect=_settings)
+def test_manifest(get_value_mock, tmpdir):
+    config = _get_config(tmpdir)
+    fqn = os.path.join(str(tmpdir), TEST_ENTRIES[0])
+    test_subject = manifest.get_manifest(config)
+    assert os.path.exists(os.path.join(
+        str(tmpdir), manifest.DEFAULT_FILE_NAME)), 'wrong manifest location'
+    try:
+        assert not test_subject.is_unchanged(fqn), 'not recorded yet'
+        test_subject.record([fqn])
+        assert len(test_subject) == 1, 'wrong length'
+        test_result = test_subject.get(TEST_ENTRIES[0])
+        assert test_result['obs_id'] == 'ngc2903_7m+tp_co21', 'wrong obs_id'
+        assert test_result['product_id'] == 'ngc2903_7m+tp_co21', \
+            'wrong product_id'
+        assert test_result['md5'] == file_info.scan(fqn).md5, 'wrong md5'
+        assert test_subject.is_unchanged(fqn), 'should be unchanged'
+
+        # a copy has a new modification time, and the same content
+        stat = os.stat(fqn)
+        os.utime(fqn, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert test_subject.is_unchanged(fqn), 'same content'
+        assert test_subject.get(TEST_ENTRIES[0])['mtime_ns'] == \
+            stat.st_mtime_ns + 10**9, 'mtime should be updated'
+
+        with open(fqn, 'w') as f:
+            f.write('ngc2903_7m+tp_co22.fits')
+        assert not test_subject.is_unchanged(fqn), 'content changed'
+    finally:
+        test_subject.close()
+
+
+@patch('phangs2caom2.manifest.settings.get_value', side_effect=_settings)
+def test_track(get_value_mock, tmpdir):
+    config = _get_config(tmpdir)
+    with manifest.track(config, TEST_ENTRIES) as test_result:
+        assert test_result == TEST_ENTRIES, 'nothing recorded yet'
+        # from an earlier run
+        _log_success(config, 'ngc5236_7m+tp_co21', TEST_ENTRIES[2],
+                     datetime.now() - timedelta(days=1))
+        _log_success(config, 'ngc2903_7m+tp_co21', TEST_ENTRIES[0])
+
+    with manifest.track(config, TEST_ENTRIES) as test_result:
+        assert test_result == TEST_ENTRIES[1:], 'one file ingested'
+        _log_success(config, 'ngc5236_7m+tp_co21', TEST_ENTRIES[2])
+
+    with manifest.track(config, TEST_ENTRIES) as test_result:
+        assert test_result == [TEST_ENTRIES[1]], 'two files ingested'
+
+    with manifest.track(config, TEST_ENTRIES, force=True) as test_result:
+        assert test_result == TEST_ENTRIES, 'should process everything'
+
+
+@patch('phangs2caom2.manifest.settings.get_value', side_effect=_settings)
+def test_track_by_obs_id(get_value_mock, tmpdir):
+    config = _get_config(tmpdir)
+    with manifest.track(config, TEST_ENTRIES, by_obs_id=True):
+        # one success log line for all the files of the obs_id
+        _log_success(config, 'ngc2903_7m+tp_co21', TEST_ENTRIES[0])
+
+    with manifest.track(config, TEST_ENTRIES) as test_result:
+        assert test_result == [TEST_ENTRIES[2]], 'group ingested'
+
+
+@patch('phangs2caom2.manifest.settings.get_value', return_value=None)
+def test_track_not_in_use(get_value_mock, tmpdir):
+    config = _get_config(tmpdir)
+    with manifest.track(config, TEST_ENTRIES) as test_result:
+        assert test_result is TEST_ENTRIES, 'no filtering'
+    assert not os.path.exists(os.path.join(
+        str(tmpdir), manifest.DEFAULT_FILE_NAME)), 'no manifest'
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import csv
+import io
+import os
+import sqlite3
+
+from mock import patch
+
+from caom2 import Algorithm, DerivedObservation
+from phangs2caom2 import headers, main_app, member_resolver
+
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+TEST_DATA_DIR = os.path.join(THIS_DIR, 'data')
+
+TEST_ROWS = [
+    ('2017.1.00886.L', 'ALMA', 'A001_X1284_X0001', 'NGC_2903'),
+    ('2017.1.00886.L', 'ALMACA', 'A001_X1284_X0002', 'ngc2903'),
+    ('2017.1.00886.L', 'ALMA', 'A001_X1284_X0003', 'NGC5236'),
+    ('2018.1.01651.S', 'ALMA', 'A001_X1296_X0001', 'ngc2903'),
+    ('2017.1.00886.L', 'JCMT', 'ngc2903_850', 'ngc2903'),
+]
+
+
+class LocalTap(object):
+    """Stands in for CadcTapClient, with a SQLite caom2.Observation
+    table."""
+
+    def __init__(self):
+        self.queries = []
+        self._conn = sqlite3.connect(':memory:')
+        self._conn.execute("ATTACH DATABASE ':memory:' AS caom2")
+        self._conn.execute(
+            'CREATE TABLE caom2.Observation (proposal_id TEXT, '
+            'collection TEXT, observationID TEXT, target_name TEXT)')
+        self._conn.executemany(
+            'INSERT INTO caom2.Observation VALUES (?, ?, ?, ?)', TEST_ROWS)
+
+    def query(self, query, output_file=None, response_format='VOTable',
+              data_only=False, **kwargs):
+        assert response_format == 'csv', 'wrong format'
+        self.queries.append(query)
+        cursor = self._conn.execute(query)
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow([ii[0] for ii in cursor.description])
+        writer.writerows(cursor.fetchall())
+        output_file.write(text.getvalue().encode())
+
+
+def test_resolve(tmpdir):
+    fqn = os.path.join(str(tmpdir), 'member_cache.db')
+    tap = LocalTap()
+    test_subject = member_resolver.MemberResolver(
+        fqn, tap, ttl_seconds=3600, proposal_ids=['2018.1.01651.S'])
+    try:
+        assert test_subject.resolve('2017.1.00886.L', 'ngc2903') == [
+            'caom:ALMA/A001_X1284_X0001', 'caom:ALMACA/A001_X1284_X0002'], \
+            'wrong members'
+        assert test_subject.resolve('2017.1.00886.L', 'ngc5236') == [
+            'caom:ALMA/A001_X1284_X0003'], 'wrong other target'
+        assert test_subject.resolve('2018.1.01651.S', 'ngc2903') == [
+            'caom:ALMA/A001_X1296_X0001'], 'wrong configured proposal'
+        assert test_subject.resolve('2017.1.00886.L', 'ngc0628') == [], \
+            'no members'
+        assert len(tap.queries) == 1, 'one query for all of it'
+    finally:
+        test_subject.close()
+
+    # the cache is on disk
+    test_subject = member_resolver.MemberResolver(fqn, tap, ttl_seconds=3600)
+    try:
+        assert len(test_subject.resolve('2017.1.00886.L', 'NGC 2903')) == 2, \
+            'wrong cached members'
+        assert len(tap.queries) == 1, 'should be cached'
+    finally:
+        test_subject.close()
+
+    # past the TTL
+    test_subject = member_resolver.MemberResolver(fqn, tap, ttl_seconds=0)
+    try:
+        with patch('phangs2caom2.member_resolver.time.time',
+                   return_value=2e9):
+            assert len(test_subject.resolve('2017.1.00886.L', 'ngc2903')) \
+                == 2, 'wrong refreshed members'
+        assert len(tap.queries) == 2, 'should query again'
+        assert "'2018.1.01651.S'" in tap.queries[1], \
+            'cached proposals should be refreshed together'
+    finally:
+        test_subject.close()
+
+
+def test_update_members(tmpdir):
+    tap = LocalTap()
+    test_resolver = member_resolver.MemberResolver(
+        os.path.join(str(tmpdir), 'member_cache.db'), tap, ttl_seconds=3600)
+    test_header = headers.get_local_headers(
+        f'{TEST_DATA_DIR}/ngc2903_7m+tp_co21.fits.header')
+    observation = DerivedObservation(
+        'PHANGS', 'ngc2903_7m+tp_co21', Algorithm('phangs_imaging'))
+    phangs_name = main_app.PHANGSName(file_name='ngc2903_7m+tp_co21.fits')
+    try:
+        with patch('phangs2caom2.main_app.member_resolver.get_resolver',
+                   return_value=test_resolver):
+            main_app._update_members(observation, phangs_name, test_header)
+    finally:
+        test_resolver.close()
+    assert sorted(ii.uri for ii in observation.members) == [
+        'caom:ALMA/A001_X1284_X0001', 'caom:ALMACA/A001_X1284_X0002'], \
+        'wrong members'
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+
+import os
+import tracemalloc
+
+from mock import Mock, patch
+
+from phangs2caom2 import memory, parallel
+
+
+TEST_ENTRIES = ['ngc2903_7m+tp_co21.fits',
+                'ngc2903_7m+tp_co21_noise.fits',
+                'ngc5236_7m+tp_co21.fits',
+                'ngc5236_7m+tp_co21_strict_mom0.fits']
+
+
+def _run_by_todo(source, name_builder):
+    """Takes entries the way the caom2pipe runners do."""
+    todo = source.get_work()
+    result = []
+    while len(todo) > 0:
+        entry = todo.popleft()
+        name_builder.build(entry)
+        result.append(entry)
+    return result
+
+
+def test_max_entries():
+    guard = memory.MemoryGuard(max_entries=3, trace_frames=0)
+    source = parallel.EntryListDataSource(None, TEST_ENTRIES)
+    test_subject = memory.MemoryNameBuilder(Mock(), source, guard)
+    assert _run_by_todo(source, test_subject) == TEST_ENTRIES[:3], 'done'
+    assert guard.unattempted == TEST_ENTRIES[3:], 'unattempted'
+    assert guard.entries == 3, 'entries'
+
+
+@patch('phangs2caom2.memory.get_rss_mb')
+def test_max_rss(rss_mock):
+    rss_mock.side_effect = [100.0, 100.0, 250.0, 600.0]
+    guard = memory.MemoryGuard(max_entries=None, max_rss_mb=500,
+                               trace_frames=0)
+    source = parallel.EntryListDataSource(None, TEST_ENTRIES)
+    test_subject = memory.MemoryNameBuilder(Mock(), source, guard)
+    assert _run_by_todo(source, test_subject) == TEST_ENTRIES[:3], 'done'
+    assert guard.unattempted == TEST_ENTRIES[3:], 'unattempted'
+    assert guard.peak_rss_mb == 600.0, 'peak'
+
+
+def test_report():
+    was_tracing = tracemalloc.is_tracing()
+    guard = memory.MemoryGuard(max_entries=None, trace_frames=1,
+                               report_entries=1, top_sites=3)
+    try:
+        leak = []
+        assert guard.sample(TEST_ENTRIES[0]) is False, 'no limits'
+        for ignore in range(100):
+            leak.append(bytearray(10000))
+        guard.sample(TEST_ENTRIES[1])
+        result = guard.report()
+        assert len(result) > 0, 'growth'
+        assert result[0].size_diff >= 1000000, 'largest first'
+        assert result[0].traceback[0].filename == os.path.abspath(
+            __file__), 'site'
+        assert 'traced_kb' in guard.get_counters(), 'counters'
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
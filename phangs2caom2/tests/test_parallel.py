@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import os
+
+from mock import patch
+
+from phangs2caom2 import parallel
+
+
+TEST_ENTRIES = [
+    'ngc2903_7m+tp_co21_broad_mom0.fits',
+    'ngc2903_12m+7m+tp_co21.fits',
+    'ngc2903_7m+tp_co21_noise.fits',
+    'ngc2903_12m+7m+tp_co21_strictmask.fits',
+    'ngc5236_7m+tp_co21.fits',
+    'ngc2903_7m+tp_co21.fits',
+]
+
+
+def test_partition():
+    result = parallel.partition(TEST_ENTRIES, 2)
+    assert len(result) == 2, 'wrong number of partitions'
+    assert sorted(result[0] + result[1]) == sorted(TEST_ENTRIES), \
+        'lost entries'
+    # all the ngc2903_7m+tp_co21 files in the same partition
+    assert result[0] == [
+        'ngc2903_7m+tp_co21_broad_mom0.fits',
+        'ngc2903_7m+tp_co21_noise.fits',
+        'ngc2903_7m+tp_co21.fits'], 'wrong first partition'
+    assert len(result[1]) == 3, 'wrong second partition'
+
+    result = parallel.partition(TEST_ENTRIES, 10)
+    assert len(result) == 3, 'one partition per obs_id'
+    result = parallel.partition([], 4)
+    assert len(result) == 0, 'no work, no partitions'
+
+
+def test_partition_costs():
+    # one big cube, and many small groups, longest-first
+    costs = {'ngc0628_12m+7m+tp_co21.fits': 100.0}
+    entries = list(costs.keys())
+    for index in range(6):
+        entry = f'ngc{index:04d}_7m+tp_co21_strict_mom0.fits'
+        costs[entry] = 10.0 + index
+        entries.append(entry)
+    entries.reverse()
+    result = parallel.partition(entries, 2, costs)
+    assert result[0] == ['ngc0628_12m+7m+tp_co21.fits'], 'cube alone'
+    assert result[1] == [
+        f'ngc{index:04d}_7m+tp_co21_strict_mom0.fits'
+        for index in range(5, -1, -1)], 'the rest, costliest first'
+
+    # the obs_id group cost is the sum of its members
+    costs = {'ngc2903_7m+tp_co21.fits': 6.0,
+             'ngc2903_7m+tp_co21_noise.fits': 6.0,
+             'ngc5236_7m+tp_co21.fits': 10.0,
+             'ngc0628_7m+tp_co21.fits': 3.0}
+    result = parallel.partition(list(costs.keys()), 2, costs)
+    assert result == [
+        ['ngc2903_7m+tp_co21.fits', 'ngc2903_7m+tp_co21_noise.fits'],
+        ['ngc5236_7m+tp_co21.fits', 'ngc0628_7m+tp_co21.fits']], 'groups'
+
+
+def test_merge_logs(tmpdir):
+    config = type('Config', (), {})()
+    config.log_file_directory = str(tmpdir)
+    config.rejected_directory = str(tmpdir)
+    config.success_log_file_name = 'success_log.txt'
+    config.failure_log_file_name = 'failure_log.txt'
+    config.retry_file_name = 'retries.txt'
+    config.progress_file_name = 'progress.txt'
+    config.rejected_file_name = 'rejected.yml'
+    config.rejected_fqn = os.path.join(str(tmpdir), 'rejected.yml')
+    worker_dirs = []
+    for index in range(2):
+        worker_dir = tmpdir.mkdir(f'{parallel.WORKER_DIRECTORY_PREFIX}{index}')
+        worker_dir.join('success_log.txt').write(f'success {index}\n')
+        worker_dir.join('rejected.yml').write(
+            f'bad_metadata:\n- obs_{index}\n')
+        worker_dirs.append(str(worker_dir))
+
+    parallel._merge_logs(config, worker_dirs)
+    assert tmpdir.join('success_log.txt').read() == \
+        'success 0\nsuccess 1\n', 'wrong merged success log'
+    assert not tmpdir.join('failure_log.txt').exists(), 'no failures'
+    assert 'obs_0' in tmpdir.join('rejected.yml').read(), 'obs_0 lost'
+    assert 'obs_1' in tmpdir.join('rejected.yml').read(), 'obs_1 lost'
+    for worker_dir in worker_dirs:
+        assert not os.path.exists(worker_dir), 'worker dir not cleaned up'
+
+
+@patch('phangs2caom2.parallel._merge_logs')
+@patch('phangs2caom2.parallel.get_context')
+def test_run_parallel(context_mock, merge_mock):
+    pool_mock = context_mock.return_value.Pool.return_value.__enter__
+    pool_mock.return_value.starmap.return_value = [(0, 3.0), (-1, 2.5)]
+    config = type('Config', (), {'log_file_directory': '/tmp/logs',
+                                 'use_local_files': False})()
+    result = parallel.run_parallel(TEST_ENTRIES, 2, config)
+    assert result == -1, 'failure in one worker should be reported'
+    assert merge_mock.called, 'logs should be merged'
+    args, kwargs = pool_mock.return_value.starmap.call_args
+    assert args[0] == parallel._run_worker, 'wrong worker function'
+
+
+@patch('phangs2caom2.parallel._run_worker')
+@patch('phangs2caom2.parallel.get_context')
+def test_run_recycled(context_mock, worker_mock):
+    worker_mock.side_effect = [(0, 2.0, TEST_ENTRIES[1:2]),
+                               (-1, 1.5, []),
+                               (0, 1.0, [])]
+
+    def _apply_async(f, args, callback, error_callback):
+        callback(f(*args))
+
+    pool_mock = context_mock.return_value.Pool.return_value.__enter__
+    pool_mock.return_value.apply_async.side_effect = _apply_async
+    results, log_directories = parallel._run_recycled(
+        [TEST_ENTRIES[:2], TEST_ENTRIES[2:]], '/tmp/logs')
+    assert results == [(0, 3.0), (-1, 1.5)], 'per partition'
+    assert len(log_directories) == 3, 'a directory for each process'
+    args, kwargs = worker_mock.call_args
+    assert args == (TEST_ENTRIES[1:2], log_directories[2]), 'replacement'
+    assert context_mock.return_value.Pool.call_args[1] == {
+        'processes': 2, 'maxtasksperchild': 1}, 'recycled'
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import asyncio
+import os
+import pytest
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from mock import patch
+
+from caom2 import Algorithm, DerivedObservation
+from caom2pipe import manage_composable as mc
+from caom2pipe import name_builder_composable as nbc
+from phangs2caom2 import pipeline, work, PHANGSName
+
+
+TEST_ENTRIES = [
+    'ngc2903_7m+tp_co21.fits',
+    'ngc2903_7m+tp_co21_noise.fits',
+    'ngc5236_7m+tp_co21.fits',
+    'ngc1087_12m+7m+tp_co21.fits',
+]
+
+
+class FakeDataService(object):
+    """Stands in for storage, and tracks how many header retrievals are in
+    progress at the same time."""
+
+    def __init__(self, fail=None):
+        self.retrieved = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self._fail = fail
+        self._lock = threading.Lock()
+
+    def get_header(self, file_name, working_directory):
+        with self._lock:
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            time.sleep(0.05)
+            if file_name == self._fail:
+                raise mc.CadcException(f'Could not retrieve {file_name}')
+            fqn = os.path.join(working_directory, f'{file_name}.header')
+            with open(fqn, 'w') as f:
+                f.write('SIMPLE  =                    T\n')
+            self.retrieved.append(file_name)
+            return fqn
+        finally:
+            with self._lock:
+                self.concurrent -= 1
+
+
+class FakeRepoService(object):
+
+    def __init__(self, observations=None):
+        self.observations = {} if observations is None else observations
+        self.created = []
+        self.updated = []
+
+    def read(self, collection, obs_id):
+        return self.observations.get(obs_id)
+
+    def write(self, observation, exists):
+        if exists:
+            self.updated.append(observation.observation_id)
+        else:
+            self.created.append(observation.observation_id)
+        self.observations[observation.observation_id] = observation
+
+
+def _generate(argv):
+    """Stands in for fits2caom2 - checks the parameters, and writes an
+    Observation."""
+    out_fqn = argv[argv.index('--out') + 1]
+    if '--in' in argv:
+        observation = mc.read_obs_from_file(argv[argv.index('--in') + 1])
+    else:
+        index = argv.index('--observation')
+        observation = DerivedObservation(
+            argv[index + 1], argv[index + 2], Algorithm('phangs'))
+    local = argv[argv.index('--local') + 1:argv.index('--lineage')]
+    lineage = argv[argv.index('--lineage') + 1:]
+    assert len(local) == len(lineage), 'local and lineage should align'
+    assert all(os.path.exists(ii) for ii in local), 'local should exist'
+    mc.write_obs_to_file(observation, out_fqn)
+    return 0
+
+
+def _get_config(tmpdir):
+    config = type('Config', (), {})()
+    config.working_directory = str(tmpdir)
+    config.log_file_directory = os.path.join(str(tmpdir), 'logs')
+    config.success_fqn = os.path.join(
+        config.log_file_directory, 'success_log.txt')
+    config.failure_fqn = os.path.join(
+        config.log_file_directory, 'failure_log.txt')
+    config.retry_fqn = os.path.join(config.log_file_directory, 'retries.txt')
+    config.use_local_files = False
+    config.collection = 'PHANGS'
+    config.proxy_fqn = None
+    config.netrc_file = None
+    return config
+
+
+def _run(config, data_service, repo_service, name_builder=None,
+         entries=TEST_ENTRIES):
+    if name_builder is None:
+        name_builder = nbc.FileNameBuilder(PHANGSName)
+    limits = {pipeline.FETCH: 3, pipeline.GENERATE: 2, pipeline.WRITE: 2}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        runner = pipeline.AsyncRunner(
+            config, name_builder, data_service, repo_service, limits=limits,
+            generate_executor=executor, generate=_generate)
+        return runner, asyncio.run(runner.run(entries))
+
+
+def test_run(tmpdir):
+    config = _get_config(tmpdir)
+    existing = DerivedObservation(
+        'PHANGS', 'ngc5236_7m+tp_co21', Algorithm('phangs'))
+    data_service = FakeDataService()
+    repo_service = FakeRepoService({'ngc5236_7m+tp_co21': existing})
+    runner, result = _run(config, data_service, repo_service)
+    assert result == 0, 'should succeed'
+    assert runner.successes == 4, 'wrong success count'
+    assert sorted(data_service.retrieved) == sorted(TEST_ENTRIES), \
+        'every header retrieved once'
+    assert data_service.max_concurrent > 1, 'retrievals should overlap'
+    assert data_service.max_concurrent <= 3, 'fetch limit exceeded'
+    assert repo_service.updated == ['ngc5236_7m+tp_co21'], 'wrong update'
+    assert len(repo_service.created) == 3, 'wrong creates'
+    with open(config.success_fqn) as f:
+        assert len(f.readlines()) == 4, 'wrong success log'
+    assert not os.path.exists(config.failure_fqn), 'no failures'
+    assert os.listdir(str(tmpdir)) == ['logs'], 'working files remain'
+
+
+def test_run_failure(tmpdir):
+    config = _get_config(tmpdir)
+    data_service = FakeDataService(fail='ngc5236_7m+tp_co21.fits')
+    repo_service = FakeRepoService()
+    runner, result = _run(config, data_service, repo_service)
+    assert result == -1, 'should fail'
+    assert runner.successes == 3, 'other entries should succeed'
+    assert runner.failures == 1, 'wrong failure count'
+    assert 'ngc5236_7m+tp_co21' not in repo_service.observations, \
+        'should not write'
+    with open(config.failure_fqn) as f:
+        content = f.read()
+    assert 'Could not retrieve ngc5236_7m+tp_co21.fits' in content, \
+        'wrong failure log'
+    with open(config.retry_fqn) as f:
+        assert f.read() == 'ngc5236_7m+tp_co21.fits\n', 'wrong retries'
+
+
+def test_run_grouped(tmpdir):
+    config = _get_config(tmpdir)
+    groups = work.group_by_obs_id(TEST_ENTRIES)
+    data_service = FakeDataService()
+    repo_service = FakeRepoService()
+    runner, result = _run(config, data_service, repo_service,
+                          work.ObservationNameBuilder(groups),
+                          work.group_leaders(groups))
+    assert result == 0, 'should succeed'
+    assert runner.successes == 3, 'one success per observation'
+    assert sorted(data_service.retrieved) == sorted(TEST_ENTRIES), \
+        'every header retrieved'
+    assert len(repo_service.created) == 3, 'one write per observation'
+
+
+@patch('phangs2caom2.pipeline.settings.get_value')
+def test_get_limits(get_value_mock):
+    get_value_mock.return_value = None
+    assert pipeline.get_limits() == pipeline.DEFAULT_LIMITS, 'defaults'
+    get_value_mock.return_value = {'generate': 0, 'write': '8'}
+    result = pipeline.get_limits()
+    assert result[pipeline.GENERATE] == 1, 'at least one'
+    assert result[pipeline.WRITE] == 8, 'configured'
+    get_value_mock.return_value = {'header': 2}
+    with pytest.raises(mc.CadcException):
+        pipeline.get_limits()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import gzip
+import os
+
+import numpy as np
+
+from astropy.io import fits
+from mock import patch
+
+from caom2 import Artifact, Plane, ProductType, ReleaseType
+from caom2 import SimpleObservation, Algorithm
+from phangs2caom2 import preview_augmentation
+
+
+CUBE = 'ngc2903_7m+tp_co21.fits'
+
+
+def _write(fqn, data, **cards):
+    hdu = fits.PrimaryHDU(data=data)
+    for key, value in cards.items():
+        hdu.header[key] = value
+    hdu.writeto(fqn, overwrite=True)
+
+
+def _cube():
+    np.random.seed(17)
+    # degenerate Stokes axis, as in the PHANGS cubes
+    result = np.random.random((1, 9, 20, 30)).astype(np.float32)
+    result[0, :, 0, 0] = np.nan
+    result[0, 2:5, 3, 4] = np.nan
+    return result
+
+
+def test_get_images(tmpdir):
+    data = _cube()
+    fqn = os.path.join(tmpdir, CUBE)
+    _write(fqn, data)
+    # blocks of 2 planes, so the last block is short
+    plane_bytes = 20 * 30 * 4
+    for block_bytes in [plane_bytes * 2, plane_bytes * 100, 1]:
+        images = preview_augmentation.get_images(fqn, block_bytes)
+        peak = images[preview_augmentation.PEAK]
+        assert peak.shape == (20, 30), 'wrong shape'
+        assert np.isnan(peak[0, 0]), 'all-blank pixel'
+        np.testing.assert_allclose(
+            peak[1:, 1:], np.nanmax(data[0, :, 1:, 1:], axis=0))
+
+    gz_fqn = f'{fqn}.gz'
+    with open(fqn, 'rb') as f_in, gzip.open(gz_fqn, 'wb') as f_out:
+        f_out.write(f_in.read())
+    images = preview_augmentation.get_images(gz_fqn, plane_bytes * 2)
+    np.testing.assert_allclose(
+        images[preview_augmentation.PEAK][1:, 1:],
+        np.nanmax(data[0, :, 1:, 1:], axis=0))
+
+
+def test_get_images_scaled(tmpdir):
+    data = np.arange(24, dtype=np.int16).reshape((2, 3, 4))
+    fqn = os.path.join(tmpdir, CUBE)
+    _write(fqn, data)
+    with fits.open(fqn, mode='update') as hdul:
+        hdul[0].header['BSCALE'] = 2.0
+        hdul[0].header['BZERO'] = 10.0
+    images = preview_augmentation.get_images(fqn, 1)
+    np.testing.assert_array_equal(
+        images[preview_augmentation.PEAK], data[1] * 2.0 + 10.0)
+
+
+def test_get_images_moment_map(tmpdir):
+    data = np.random.random((40, 50))
+    fqn = os.path.join(tmpdir, 'ngc2903_7m+tp_co21_strict_mom0.fits')
+    _write(fqn, data)
+    images = preview_augmentation.get_images(fqn)
+    np.testing.assert_array_equal(images[preview_augmentation.PEAK], data)
+
+
+@patch('phangs2caom2.preview_augmentation.mc.data_put')
+def test_visit(data_put_mock, tmpdir):
+    _write(os.path.join(tmpdir, CUBE), _cube())
+    observation = SimpleObservation(
+        'PHANGS', 'ngc2903_7m+tp_co21', Algorithm('exposure'))
+    plane = Plane('ngc2903_7m+tp_co21')
+    for file_name, product_type in [
+            (CUBE, ProductType.SCIENCE),
+            ('ngc2903_7m+tp_co21_noise.fits', ProductType.NOISE)]:
+        uri = f'ad:PHANGS/{file_name}'
+        plane.artifacts[uri] = Artifact(uri, product_type, ReleaseType.DATA)
+    observation.planes[plane.product_id] = plane
+
+    kwargs = {'working_directory': str(tmpdir), 'science_file': CUBE}
+    result = preview_augmentation.visit(observation, **kwargs)
+    assert result == {'artifacts': 2}, 'wrong count'
+    assert not data_put_mock.called, 'no client, so no put'
+    for file_name, product_type in [
+            ('ngc2903_7m+tp_co21_prev.jpg', ProductType.PREVIEW),
+            ('ngc2903_7m+tp_co21_prev_256.jpg', ProductType.THUMBNAIL)]:
+        fqn = os.path.join(tmpdir, file_name)
+        assert os.path.exists(fqn), f'no {file_name}'
+        artifact = plane.artifacts[f'ad:PHANGS/{file_name}']
+        assert artifact.product_type == product_type, 'product type'
+        assert artifact.content_type == 'image/jpeg', 'content type'
+        assert artifact.content_length == os.path.getsize(fqn), 'length'
+
+    kwargs['cadc_client'] = object()
+    kwargs['science_file'] = 'ngc2903_7m+tp_co21_noise.fits'
+    result = preview_augmentation.visit(observation, **kwargs)
+    assert result == {'artifacts': 0}, 'previews of science files only'
+    assert not data_put_mock.called, 'nothing to put'
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+
+import os
+
+from mock import patch
+
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import retries
+
+
+TEST_ENTRIES = ['ngc2903_7m+tp_co21.fits',
+                'ngc2903_7m+tp_co21_noise.fits',
+                'ngc5236_7m+tp_co21.fits',
+                'ngc1365_9m+tp_co21.fits']
+
+
+class _Config(object):
+    """The parts of mc.Config used by the retries module."""
+
+    success_log_file_name = 'success_log.txt'
+    failure_log_file_name = 'failure_log.txt'
+    retry_file_name = 'retries.txt'
+    progress_file_name = 'progress.txt'
+    rejected_file_name = 'rejected.yml'
+
+    def __init__(self, log_file_directory):
+        self.log_file_directory = log_file_directory
+        self.rejected_directory = log_file_directory
+
+    @property
+    def success_fqn(self):
+        return os.path.join(self.log_file_directory,
+                            self.success_log_file_name)
+
+    @property
+    def failure_fqn(self):
+        return os.path.join(self.log_file_directory,
+                            self.failure_log_file_name)
+
+    @property
+    def retry_fqn(self):
+        return os.path.join(self.log_file_directory, self.retry_file_name)
+
+    @property
+    def rejected_fqn(self):
+        return os.path.join(self.rejected_directory, self.rejected_file_name)
+
+
+def test_classify():
+    for message in ['Read timed out. (read timeout=20)',
+                    'Connection reset by peer',
+                    '503 Server Error: Service Unavailable for url',
+                    'Max retries exceeded with url']:
+        assert retries.classify(message, retries._get_patterns()) == (
+            retries.TRANSIENT, None), message
+    assert retries.classify(
+        'Unexpected telescope value in ngc1365_9m+tp_co21') == (
+            retries.PERMANENT, retries.BAD_METADATA), 'telescope'
+    assert retries.classify('Truncated data unit in x.fits.') == (
+        retries.PERMANENT, retries.BAD_DATA), 'data'
+    assert retries.classify('Failed to generate ngc2903_7m+tp_co21.') == (
+        retries.UNKNOWN, None), 'unknown'
+
+
+def test_get_delay():
+    for attempt, low, high in [(1, 5.0, 10.0), (2, 10.0, 20.0),
+                               (5, 50.0, 100.0)]:
+        for ignore in range(20):
+            result = retries.get_delay(attempt, 10.0, 100.0)
+            assert low <= result <= high, f'attempt {attempt} {result}'
+
+
+@patch('phangs2caom2.retries.random.uniform')
+@patch('phangs2caom2.retries.time.sleep')
+@patch('phangs2caom2.retries.settings.get_value')
+def test_run(settings_mock, sleep_mock, uniform_mock, tmpdir):
+    uniform_mock.return_value = 0.0
+    settings_mock.side_effect = \
+        lambda key, default=None: 3 if key == 'retry_attempts' else default
+    config = _Config(str(tmpdir))
+    passes = []
+
+    def _run_pass(pass_config, entries):
+        passes.append(entries)
+        with open(pass_config.failure_fqn, 'a') as f:
+            for entry in entries:
+                if entry.startswith('ngc1365'):
+                    f.write(f'2021-05-01 10:00:00.0 {entry} {entry} '
+                            f'Unexpected telescope value in {entry[:-5]}\n')
+                elif entry == TEST_ENTRIES[0] and len(passes) < 3:
+                    f.write(f'2021-05-01 10:00:00.0 ngc2903_7m+tp_co21 '
+                            f'{entry} Read timed out.\n')
+                elif entry == TEST_ENTRIES[2]:
+                    f.write(f'2021-05-01 10:00:00.0 ngc5236_7m+tp_co21 '
+                            f'{entry} 503 Server Error\n')
+        return 0
+
+    assert retries.run(config, TEST_ENTRIES, _run_pass) == -1, 'result'
+    assert passes[0] == TEST_ENTRIES, 'first pass'
+    assert passes[1] == TEST_ENTRIES[:3], 'whole groups are retried'
+    assert passes[2] == TEST_ENTRIES[:3], 'second retry'
+    assert passes[3] == [TEST_ENTRIES[2]], 'succeeded after two retries'
+    assert len(passes) == 4, 'retry_attempts'
+    assert sleep_mock.call_count == 3, 'backoff'
+    assert mc.read_as_yaml(config.rejected_fqn) == {
+        retries.BAD_METADATA: ['ngc1365_9m+tp_co21.fits']}, 'rejected'
+    with open(config.retry_fqn) as f:
+        assert f.read() == f'{TEST_ENTRIES[2]}\n', 'still failing'
+    with open(config.failure_fqn) as f:
+        assert len(f.readlines()) == 7, 'every failure is logged'
+    assert not os.path.exists(
+        os.path.join(str(tmpdir), f'{retries.PASS_DIRECTORY_PREFIX}0')), \
+        'pass logs are merged'
+
+    passes.clear()
+    assert retries.run(config, TEST_ENTRIES[3:], _run_pass) == 0, \
+        'rejected'
+    assert passes == [], 'rejected entries are not attempted'
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from cadcutils import net
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import sessions
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+    server.server_close()
+
+
+def test_pooled_adapter(server_url):
+    adapter = sessions.PooledAdapter(pool_size=2, idle_seconds=60)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    for ignore in range(5):
+        assert session.get(server_url).text == 'ok', 'wrong response'
+    assert adapter.requests == 5, 'wrong request count'
+    assert adapter.connections == 1, 'connection should be re-used'
+    assert adapter.health_resets == 0, 'no idle time'
+
+
+def test_pooled_adapter_idle(server_url):
+    adapter = sessions.PooledAdapter(pool_size=2, idle_seconds=0.01)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.get(server_url)
+    time.sleep(0.05)
+    session.get(server_url)
+    assert adapter.requests == 2, 'wrong request count'
+    assert adapter.connections == 2, 'idle connection should be replaced'
+    assert adapter.health_resets == 1, 'wrong reset count'
+
+
+class FakeClient(object):
+    instances = 0
+
+    def __init__(self, subject, resource_id=None):
+        FakeClient.instances += 1
+        self.resource_id = resource_id
+
+
+def test_share_data_clients():
+    module = SimpleNamespace(CadcDataClient=FakeClient)
+    sessions.share_data_clients(module)
+    sessions.share_data_clients(module)
+    assert module.CadcDataClient.factory is FakeClient, 'wrapped once'
+    before = FakeClient.instances
+    first = module.CadcDataClient(net.Subject(username='a'))
+    second = module.CadcDataClient(net.Subject(username='a'))
+    assert first is second, 'same credentials should share a client'
+    third = module.CadcDataClient(net.Subject(username='b'))
+    assert third is not first, 'different credentials, different client'
+    assert FakeClient.instances == before + 2, 'wrong number of clients'
+    other = sessions._get_client(FakeClient, net.Subject(
+        username='a'), resource_id='ivo://cadc.nrc.ca/sc2repo')
+    assert other is not first, 'different service, different client'
+
+
+def test_get_counters():
+    test_result = sessions.get_counters()
+    assert set(test_result) == {
+        'requests', 'connections', 'reused', 'health_resets'}, 'wrong keys'
+
+
+def test_get_subject(tmpdir):
+    proxy_fqn = os.path.join(str(tmpdir), 'cadcproxy.pem')
+    config = SimpleNamespace(proxy_fqn=proxy_fqn, netrc_file=None)
+    with pytest.raises(mc.CadcException):
+        # no silent fall back to ~/.netrc
+        sessions.get_subject(config)
+    config.netrc_file = os.path.join(str(tmpdir), 'test_netrc')
+    with open(config.netrc_file, 'w') as f:
+        f.write('machine example.org login a password b\n')
+    assert sessions.get_subject(config).netrc == config.netrc_file, 'netrc'
+    with open(proxy_fqn, 'w') as f:
+        f.write('')
+    assert sessions.get_subject(config).certificate == proxy_fqn, 'proxy'
@@ -66,7 +66,11 @@
 #
 # ***********************************************************************
 #
-from phangs2caom2 import PHANGSName
+import pytest
+
+from caom2pipe import manage_composable as mc
+from phangs2caom2 import PHANGSName, get_name_bits, get_phangs_name
+from phangs2caom2 import main_app
 
 
 def test_is_valid():
@@ -81,3 +85,53 @@ def test_bits():
     assert test_subject.obs_id == 'ngc5236_7m+tp_co21', 'wrong obs id'
     assert test_subject.product_id == 'ngc5236_7m+tp_co21_broad_mom0', \
         'wrong product id'
+
+
+def test_members():
+    test_members = ['ngc5236_7m+tp_co21.fits',
+                    'ngc5236_7m+tp_co21_broad_mom0.fits']
+    test_subject = PHANGSName(file_name=test_members[0],
+                              members=test_members)
+    assert test_subject.multiple_files() == test_members, 'wrong files'
+    assert test_subject.lineage == \
+        'ngc5236_7m+tp_co21/ad:PHANGS/ngc5236_7m+tp_co21.fits ' \
+        'ngc5236_7m+tp_co21_broad_mom0/ad:PHANGS/' \
+        'ngc5236_7m+tp_co21_broad_mom0.fits', 'wrong lineage'
+
+    test_subject = PHANGSName(file_name=test_members[0])
+    assert test_subject.multiple_files() == [test_members[0]], \
+        'wrong single file'
+
+
+def test_name_bits():
+    test_subject = get_name_bits('ad:PHANGS/ngc5236_7m+tp_co21_broad_mom0.fits')
+    assert test_subject.obs_id == 'ngc5236_7m+tp_co21', 'wrong obs id'
+    assert test_subject.telescope == 'ALMA-7m + ALMA-TP', 'wrong telescope'
+    assert test_subject is \
+        get_name_bits('ad:PHANGS/ngc5236_7m+tp_co21_broad_mom0.fits'), \
+        'should be cached'
+    assert test_subject is \
+        get_name_bits('/data/ngc5236_7m+tp_co21_broad_mom0.fits.header'), \
+        'file ids should share the parse'
+    assert not hasattr(test_subject, '__dict__'), 'should use slots'
+
+
+def test_get_phangs_name():
+    file_name = 'ngc5236_7m+tp_co21_broad_mom0.fits'
+    test_subject = get_phangs_name(f'ad:PHANGS/{file_name}')
+    assert test_subject.file_name == file_name, 'wrong file name'
+    size = main_app._get_phangs_name.cache_info().currsize
+    for index in range(3):
+        assert get_phangs_name(f'/tmp/{index}/{file_name}') is \
+            test_subject, 'should be cached by file name'
+    assert main_app._get_phangs_name.cache_info().currsize == size, \
+        'temporary paths should not add cache entries'
+    with pytest.raises(mc.CadcException):
+        get_name_bits('ngc5236_8m_co21.fits')
+
+    test_name = get_phangs_name('ngc5236_7m+tp_co21_broad_mom0.fits')
+    assert test_name is \
+        get_phangs_name('ngc5236_7m+tp_co21_broad_mom0.fits'), \
+        'should be interned'
+    assert test_name.product_id == 'ngc5236_7m+tp_co21_broad_mom0', \
+        'wrong product id'
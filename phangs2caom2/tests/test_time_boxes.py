@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+from datetime import datetime, timedelta
+from mock import patch
+
+from phangs2caom2 import time_boxes
+
+
+START = datetime(2021, 5, 1, 0, 0, 0)
+
+
+def _pending(minutes):
+    return [((START + timedelta(minutes=ii)).timestamp(), f'f{index}.fits')
+            for index, ii in enumerate(minutes)]
+
+
+def _sizer(pending, target_entries=3, target_seconds=None,
+           seconds_per_entry=None):
+    return time_boxes.TimeBoxSizer(
+        pending, target_entries, target_seconds, timedelta(minutes=10),
+        timedelta(days=1), seconds_per_entry)
+
+
+def test_quiet_period():
+    # two entries over three days, so two time-boxes of the longest
+    # span, and one to the end of the run
+    sizer = _sizer(_pending([60, 2000]))
+    end_time = START + timedelta(days=3)
+    end, entries = sizer.next_box(START, end_time)
+    assert end == START + timedelta(days=1), 'longest span'
+    assert entries == ['f0.fits'], 'first day'
+    end, entries = sizer.next_box(end, end_time)
+    assert end == START + timedelta(days=2), 'longest span'
+    assert entries == ['f1.fits'], 'second day'
+    end, entries = sizer.next_box(end, end_time)
+    assert end == end_time, 'to the end'
+    assert entries == [], 'nothing left'
+
+
+def test_release_day():
+    # eight entries in less than an hour, in time-boxes of three
+    sizer = _sizer(_pending([1, 2, 3, 20, 30, 31, 32, 40]))
+    end_time = START + timedelta(days=3)
+    end, entries = sizer.next_box(START, end_time)
+    # the shortest time-box holds more than three entries
+    assert end == START + timedelta(minutes=10), 'shortest span'
+    assert entries == ['f0.fits', 'f1.fits', 'f2.fits'], 'first'
+    end, entries = sizer.next_box(end, end_time)
+    assert entries == ['f3.fits', 'f4.fits', 'f5.fits'], 'second'
+    assert START + timedelta(minutes=31) < end < \
+        START + timedelta(minutes=32), 'ends at the third entry'
+    previous = end
+    end, entries = sizer.next_box(end, end_time)
+    assert entries == ['f6.fits', 'f7.fits'], 'the rest'
+    assert end == previous + timedelta(days=1), 'longest span'
+    assert len(sizer) == 0, 'all handed out'
+
+
+def test_throughput():
+    sizer = _sizer(_pending(range(100)), target_entries=50,
+                   target_seconds=60.0)
+    assert sizer.limit == 50, 'no throughput yet'
+    sizer.measure(10, 60.0)
+    assert sizer.limit == 10, '6s per entry'
+    sizer.measure(10, 20.0)
+    assert sizer.seconds_per_entry == 4.0, 'moving average'
+    assert sizer.limit == 15, '4s per entry'
+    sizer.measure(0, 100.0)
+    assert sizer.limit == 15, 'no entries, no measurement'
+    end, entries = sizer.next_box(START, START + timedelta(days=1))
+    assert len(entries) == 15, 'throughput limit'
+
+
+@patch('phangs2caom2.time_boxes.settings.get_value')
+def test_get_sizer(settings_mock):
+    settings_mock.side_effect = lambda key, default=None: {
+        'time_box_target_entries': 7,
+        'time_box_seconds_per_entry': 2}.get(key, default)
+    sizer = time_boxes.get_sizer(_pending([1]))
+    assert sizer.limit == 7, 'configured'
+    assert sizer.seconds_per_entry == 2.0, 'configured'
+    settings_mock.side_effect = \
+        lambda key, default=None: key != 'adaptive_time_boxes' and default
+    assert time_boxes.get_sizer([]) is None, 'fixed intervals'
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import json
+import os
+import time
+
+from types import SimpleNamespace
+
+from mock import patch
+
+from phangs2caom2 import timing
+
+
+def _settings(tmpdir):
+    values = {'observe_execution': True,
+              'observable_directory': str(tmpdir)}
+
+    def _get_value(key, default=None):
+        return values.get(key, default)
+
+    return _get_value
+
+
+def test_stages(tmpdir):
+    with patch('phangs2caom2.timing.settings.get_value',
+               side_effect=_settings(tmpdir)):
+        timing._observable_directories.clear()
+        timing._record = None
+        try:
+            run_id = timing.begin_run()
+            for entry in ['a.fits', 'b.fits']:
+                timing.start_entry(entry)
+                with timing.stage('gen_proc'):
+                    time.sleep(0.02)
+                    with timing.stage('update'):
+                        time.sleep(0.01)
+            timing.finish_entry()
+            assert not timing.in_entry(), 'entry should be finished'
+
+            fqn = os.path.join(
+                str(tmpdir),
+                f'{timing.FILE_PREFIX}_{run_id}_{os.getpid()}.jsonl')
+            with open(fqn) as f:
+                records = [json.loads(line) for line in f]
+            assert [ii['entry'] for ii in records] == ['a.fits', 'b.fits'], \
+                'wrong entries'
+            stages = records[0]['stages']
+            assert stages['update'] >= 0.01, 'wrong update'
+            assert 0.02 <= stages['gen_proc'] < 0.03, \
+                'nested time should not be in the outer stage'
+            assert abs(sum(stages.values()) - records[0]['total']) < 1e-6, \
+                'stages should add up to the total'
+
+            test_result = timing.summarize(run_id)
+            assert test_result['update']['count'] == 2, 'wrong count'
+            assert 'p99' in test_result['total'], 'no percentiles'
+            assert os.path.exists(os.path.join(
+                str(tmpdir), f'{timing.FILE_PREFIX}_{run_id}_summary.yml')), \
+                'no summary'
+        finally:
+            timing._observable_directories.clear()
+
+
+def test_not_observed():
+    with patch('phangs2caom2.timing.settings.get_value', return_value=None):
+        timing._observable_directories.clear()
+        try:
+            timing.start_entry('a.fits')
+            assert not timing.in_entry(), 'should not time'
+            with timing.stage('gen_proc'):
+                pass
+            assert timing.summarize() is None, 'should not summarize'
+        finally:
+            timing._observable_directories.clear()
+
+
+def test_counters(tmpdir):
+    counts = {'requests': 0}
+
+    def _source():
+        return dict(counts)
+
+    with patch('phangs2caom2.timing.settings.get_value',
+               side_effect=_settings(tmpdir)), \
+            patch.dict(timing._counter_sources, {'fake': _source},
+                       clear=True):
+        timing._observable_directories.clear()
+        timing._record = None
+        try:
+            run_id = timing.begin_run()
+            for entry, requests in [('a.fits', 3), ('b.fits', 2)]:
+                timing.start_entry(entry)
+                counts['requests'] += requests
+            timing.finish_entry()
+            fqn = os.path.join(
+                str(tmpdir),
+                f'{timing.FILE_PREFIX}_{run_id}_{os.getpid()}.jsonl')
+            with open(fqn) as f:
+                records = [json.loads(line) for line in f]
+            assert [ii['counters']['fake']['requests'] for ii in records] \
+                == [3, 2], 'counts should be per entry'
+            test_result = timing.summarize(run_id)
+            assert test_result['counters'] == {'fake': {'requests': 5}}, \
+                'wrong totals'
+        finally:
+            timing._observable_directories.clear()
+
+
+def test_time_calls(tmpdir):
+    owner = SimpleNamespace(write=lambda value: time.sleep(0.01) or value)
+    timing.time_calls(owner, 'write', 'xml')
+    timing.time_calls(owner, 'write', 'xml')
+    timing.time_calls(owner, 'missing', 'xml')
+    assert not hasattr(owner, 'missing'), 'nothing to time'
+    with patch('phangs2caom2.timing.settings.get_value',
+               side_effect=_settings(tmpdir)):
+        timing._observable_directories.clear()
+        timing._record = None
+        try:
+            timing.start_entry('a.fits')
+            with timing.stage('gen_proc'):
+                assert owner.write(3) == 3, 'wrong result'
+            stages = timing._record['stages']
+            assert 0.01 <= stages['xml'] < 0.02, 'timed once'
+            assert stages['gen_proc'] < 0.01, 'nested time'
+            timing.finish_entry()
+        finally:
+            timing._observable_directories.clear()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+import os
+
+from datetime import datetime
+
+from phangs2caom2 import work
+
+
+TEST_FILES = [
+    'ngc5236_7m+tp_co21_broad_mom0.fits',
+    'ngc2903_7m+tp_co21_noise.fits',
+    'ngc5236_7m+tp_co21.fits',
+    'ngc2903_7m+tp_co21.fits.gz',
+    'ngc5236_8m_co21.fits',
+    'ngc5236_7m+tp_co21.txt',
+]
+
+
+def _get_config(tmpdir, use_local_files=True):
+    config = type('Config', (), {})()
+    config.working_directory = str(tmpdir)
+    config.use_local_files = use_local_files
+    config.work_fqn = os.path.join(str(tmpdir), 'todo.txt')
+    for file_name in TEST_FILES:
+        tmpdir.join(file_name).write(file_name)
+    tmpdir.join('ngc0628_7m+tp_co21.fits').ensure(dir=True)
+    return config
+
+
+def test_iter_local_groups(tmpdir):
+    config = _get_config(tmpdir)
+    test_result = work.iter_local_groups(config.working_directory)
+    assert next(test_result) == (
+        'ngc2903_7m+tp_co21',
+        ['ngc2903_7m+tp_co21.fits.gz', 'ngc2903_7m+tp_co21_noise.fits']), \
+        'wrong first group'
+    assert list(test_result) == [(
+        'ngc5236_7m+tp_co21',
+        ['ngc5236_7m+tp_co21.fits', 'ngc5236_7m+tp_co21_broad_mom0.fits'])], \
+        'wrong rest, and no unexpected names or directories'
+
+
+def test_iter_entries(tmpdir):
+    config = _get_config(tmpdir)
+    test_result = work.iter_entries(config)
+    first = next(test_result)
+    assert first in TEST_FILES[:4], 'handed out as the scan goes'
+    assert sorted([first] + list(test_result)) == sorted(TEST_FILES[:4]), \
+        'wrong local entries, and no unexpected names or directories'
+
+    config = _get_config(tmpdir, use_local_files=False)
+    with open(config.work_fqn, 'w') as f:
+        f.write('\n'.join(TEST_FILES[:3]) + '\n\n')
+    assert list(work.iter_entries(config)) == TEST_FILES[:3], 'todo order'
+
+
+def test_get_entries(tmpdir):
+    config = _get_config(tmpdir)
+    assert work.get_entries(config) == [
+        'ngc2903_7m+tp_co21.fits.gz', 'ngc2903_7m+tp_co21_noise.fits',
+        'ngc5236_7m+tp_co21.fits', 'ngc5236_7m+tp_co21_broad_mom0.fits'], \
+        'wrong local entries'
+
+    config = _get_config(tmpdir, use_local_files=False)
+    with open(config.work_fqn, 'w') as f:
+        f.write('\n'.join(TEST_FILES[:3]) + '\n\n')
+    assert work.get_entries(config) == [
+        'ngc5236_7m+tp_co21_broad_mom0.fits', 'ngc5236_7m+tp_co21.fits',
+        'ngc2903_7m+tp_co21_noise.fits'], 'wrong todo entries'
+
+
+def test_stream_leaders(tmpdir):
+    config = _get_config(tmpdir)
+    name_builder = work.ObservationNameBuilder({})
+    test_result = work.stream_leaders(work.iter_groups(config), name_builder)
+    leader = next(test_result)
+    assert leader == 'ngc2903_7m+tp_co21.fits.gz', 'wrong leader'
+    assert name_builder.build(leader).multiple_files() == [
+        'ngc2903_7m+tp_co21.fits.gz', 'ngc2903_7m+tp_co21_noise.fits'], \
+        'group should be known when its leader is handed out'
+    assert list(test_result) == ['ngc5236_7m+tp_co21.fits'], 'wrong rest'
+
+
+def test_get_pending(tmpdir):
+    config = _get_config(tmpdir)
+    for index, file_name in enumerate(TEST_FILES):
+        # modified an hour apart, in reverse order
+        mtime = datetime(2021, 5, 1, 10 - index).timestamp()
+        os.utime(os.path.join(str(tmpdir), file_name), (mtime, mtime))
+    start = datetime(2021, 5, 1, 7)
+    end = datetime(2021, 5, 1, 9)
+    test_result = work.get_pending(config, start, end)
+    assert [ii[1] for ii in test_result] == TEST_FILES[2:0:-1], 'order'
+    assert work.get_time_box_entries(config, start, end) == \
+        TEST_FILES[2:0:-1], 'entries'
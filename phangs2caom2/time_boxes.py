@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+
+"""
+Adaptive time-box sizing for phangs_run_by_state.
+
+With a fixed 'interval', quiet periods produce many near-empty time-boxes
+that each pay the set-up cost of a run, and release days produce
+time-boxes far too large to finish in one scheduled run. The pending
+entries are found once, with a single scan of the working directory, and
+each time-box then ends where it holds about the target number of entries.
+
+The target is the smaller of 'time_box_target_entries', and the number of
+entries that the measured throughput says will be processed in
+'time_box_target_minutes'. The throughput is a moving average over the
+time-boxes of the run, starting from 'time_box_seconds_per_entry' when it
+is set. Every time-box spans at least 'time_box_min_minutes', and at most
+'time_box_max_minutes'. Entries with the same modification time are never
+split across time-boxes.
+
+Adaptive sizing is used when 'adaptive_time_boxes' is True, which is the
+default, and 'use_local_files' is True, because the pending entries are
+found on disk. Otherwise, every time-box spans 'interval' minutes.
+"""
+
+import logging
+
+from collections import deque
+from datetime import datetime, timedelta
+
+from phangs2caom2 import settings
+
+
+__all__ = ['TimeBoxSizer', 'get_sizer', 'in_use']
+
+
+TARGET_ENTRIES_DEFAULT = 500
+TARGET_MINUTES_DEFAULT = 60
+MIN_MINUTES_DEFAULT = 10
+MAX_MINUTES_DEFAULT = 7 * 24 * 60
+# the weight of the latest time-box in the moving average
+SMOOTHING = 0.5
+
+
+class TimeBoxSizer(object):
+    """Hands out time-boxes, and the entries in them, from the pending
+    entries of a run."""
+
+    def __init__(self, pending, target_entries, target_seconds,
+                 min_interval, max_interval, seconds_per_entry=None):
+        """
+        :param pending: list of (float modification time, str entry),
+            ordered by modification time
+        :param target_entries: int the most entries for a time-box
+        :param target_seconds: float the wall-clock time to aim for, for a
+            time-box, or None
+        :param min_interval: timedelta the shortest time-box
+        :param max_interval: timedelta the longest time-box
+        :param seconds_per_entry: float the throughput to start with, or
+            None, when it is not known yet
+        """
+        self._pending = deque(pending)
+        self._target_entries = max(1, target_entries)
+        self._target_seconds = target_seconds
+        self._min_interval = min_interval
+        self._max_interval = max(min_interval, max_interval)
+        self.seconds_per_entry = seconds_per_entry
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def limit(self):
+        """The number of entries to aim for in the next time-box."""
+        result = self._target_entries
+        if self._target_seconds is not None and self.seconds_per_entry:
+            result = min(result, max(
+                1, int(self._target_seconds / self.seconds_per_entry)))
+        return result
+
+    def next_box(self, start, end_time):
+        """
+        :param start: datetime start of the time-box, exclusive
+        :param end_time: datetime end of the run, inclusive
+        :return: datetime end of the time-box, inclusive, and the list of
+            str entries modified within it
+        """
+        limit = self.limit
+        if len(self._pending) > limit:
+            # rounded up, so the limit-th entry is in the time-box
+            end = datetime.fromtimestamp(
+                self._pending[limit - 1][0]) + timedelta(microseconds=1)
+        else:
+            end = end_time
+        end = max(end, start + self._min_interval)
+        end = min(end, start + self._max_interval, end_time)
+        stop = end.timestamp()
+        result = []
+        while len(self._pending) > 0 and self._pending[0][0] <= stop:
+            result.append(self._pending.popleft()[1])
+        logging.debug(f'Time-box from {start} to {end} holds {len(result)} '
+                      f'entries, for a limit of {limit}.')
+        return end, result
+
+    def measure(self, count, elapsed):
+        """
+        :param count: int entries processed in a time-box
+        :param elapsed: float seconds it took
+        """
+        if count > 0:
+            latest = elapsed / count
+            if self.seconds_per_entry is None:
+                self.seconds_per_entry = latest
+            else:
+                self.seconds_per_entry = (
+                    SMOOTHING * latest +
+                    (1.0 - SMOOTHING) * self.seconds_per_entry)
+            logging.info(f'Throughput {self.seconds_per_entry:.3f}s per '
+                         f'entry. The next time-box limit is {self.limit} '
+                         f'entries.')
+
+
+def in_use():
+    return bool(settings.get_value('adaptive_time_boxes', True) and
+                settings.get_value('use_local_files', False))
+
+
+def get_sizer(pending):
+    """
+    :param pending: list of (float modification time, str entry),
+        ordered by modification time
+    :return: TimeBoxSizer as configured in config.yml, or None, when
+        time-boxes are not adaptive
+    """
+    if not settings.get_value('adaptive_time_boxes', True):
+        return None
+    target_minutes = settings.get_value(
+        'time_box_target_minutes', TARGET_MINUTES_DEFAULT)
+    seconds_per_entry = settings.get_value('time_box_seconds_per_entry')
+    return TimeBoxSizer(
+        pending,
+        int(settings.get_value(
+            'time_box_target_entries', TARGET_ENTRIES_DEFAULT)),
+        None if target_minutes is None else float(target_minutes) * 60.0,
+        timedelta(minutes=float(settings.get_value(
+            'time_box_min_minutes', MIN_MINUTES_DEFAULT))),
+        timedelta(minutes=float(settings.get_value(
+            'time_box_max_minutes', MAX_MINUTES_DEFAULT))),
+        None if seconds_per_entry is None else float(seconds_per_entry))
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Per-stage timing of PHANGS pipeline execution.
+
+The caom2pipe 'observe_execution' metrics cover the CADC service calls
+only. This module records how long each stage of the work for an entry
+takes - name parsing, header read, blueprint build, gen_proc (header
+parsing and blueprint application), WCS validation, XML serialization, the
+PHANGS update, member resolution, repository reads and writes, and
+everything else the runner does for the entry.
+
+There is one JSON-lines record per entry, in a file per process in the
+'observable_directory', so that worker processes never share a file. At the
+end of a run, summarize writes the count, total and percentiles for each
+stage across all the processes of the run. Counts registered with
+register_counters, such as the connection reuse counts of the sessions
+module, are recorded for each entry too, and totalled in the summary.
+
+Timing happens only when 'observe_execution' is True in config.yml.
+"""
+
+import glob
+import json
+import logging
+import os
+import time
+
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+import numpy as np
+
+from caom2pipe import manage_composable as mc
+from caom2pipe import name_builder_composable as nbc
+from phangs2caom2 import settings
+
+
+__all__ = ['TimedNameBuilder', 'begin_run', 'finish_entry',
+           'register_counters', 'stage', 'start_entry', 'summarize',
+           'time_calls']
+
+
+RUN_ID_ENV = 'PHANGS_TIMING_RUN_ID'
+FILE_PREFIX = 'phangs_stages'
+OTHER_STAGE = 'other'
+PERCENTILES = [50, 90, 99]
+
+COUNTERS = 'counters'
+
+# the record for the entry being processed by this process
+_record = None
+# name => callable that returns a dict of cumulative int counts for the
+# process
+_counter_sources = {}
+# working directory => observable directory, None when not observing
+_observable_directories = {}
+
+
+def _observable_directory():
+    # config.yml is read once per process, and working directory, rather
+    # than once per entry
+    cwd = os.getcwd()
+    if cwd not in _observable_directories:
+        result = None
+        if settings.get_value('observe_execution', False):
+            result = settings.get_value('observable_directory')
+        _observable_directories[cwd] = result
+    return _observable_directories[cwd]
+
+
+def begin_run():
+    """Called once, in the parent process, before any work is done. Worker
+    processes inherit the run id through the environment.
+
+    :return: str run id
+    """
+    run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+    os.environ[RUN_ID_ENV] = run_id
+    return run_id
+
+
+def _run_id():
+    if RUN_ID_ENV not in os.environ:
+        begin_run()
+    return os.environ[RUN_ID_ENV]
+
+
+def register_counters(name, source):
+    """
+    Include the change in a set of process-wide counts with each entry
+    record, and the totals in the run summary.
+
+    :param name: str name of the set of counts
+    :param source: callable that returns a dict of str => int, with the
+        counts since the process started
+    """
+    _counter_sources[name] = source
+
+
+def _get_counters():
+    return {name: source() for name, source in _counter_sources.items()}
+
+
+def start_entry(entry):
+    """Start timing the work for an entry. Finishes timing the work for the
+    previous entry of this process, if there is one."""
+    global _record
+    finish_entry()
+    directory = _observable_directory()
+    if directory is not None:
+        _record = {'entry': str(entry),
+                   'pid': os.getpid(),
+                   'start': time.time(),
+                   'stages': {},
+                   '_start': time.perf_counter(),
+                   '_directory': directory,
+                   '_nested': [],
+                   '_counters': _get_counters()}
+
+
+def in_entry():
+    return _record is not None
+
+
+@contextmanager
+def stage(name):
+    """Accumulates the time spent in the 'with' block to the named stage
+    of the current entry. Time spent in a nested stage is accounted to the
+    nested stage only, so the stages of an entry add up to its total.
+    Does nothing when no entry is being timed."""
+    record = _record
+    if record is None:
+        yield
+        return
+    nested = record['_nested']
+    nested.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        inner = nested.pop()
+        if len(nested) > 0:
+            nested[-1] += elapsed
+        stages = record['stages']
+        stages[name] = stages.get(name, 0.0) + elapsed - inner
+
+
+def time_calls(owner, name, stage_name):
+    """Accumulate the time of every call of owner.name to the named stage.
+    Does nothing when owner has no such attribute, or when the calls are
+    already timed.
+
+    :param owner: a module or class
+    :param name: str name of a function or method of owner
+    :param stage_name: str name of the stage
+    """
+    current = getattr(owner, name, None)
+    if current is None or hasattr(current, '_timed_stage'):
+        return
+
+    @wraps(current)
+    def _timed(*args, **kwargs):
+        with stage(stage_name):
+            return current(*args, **kwargs)
+
+    _timed._timed_stage = stage_name
+    setattr(owner, name, _timed)
+
+
+def finish_entry():
+    """Write the record for the current entry, if there is one. Time not
+    accounted to a named stage is recorded as the 'other' stage."""
+    global _record
+    if _record is None:
+        return
+    record = _record
+    _record = None
+    total = time.perf_counter() - record.pop('_start')
+    directory = record.pop('_directory')
+    record.pop('_nested')
+    before = record.pop('_counters')
+    if len(before) > 0:
+        record[COUNTERS] = {
+            name: {key: value - before[name].get(key, 0)
+                   for key, value in counts.items()}
+            for name, counts in _get_counters().items() if name in before}
+    record['total'] = total
+    record['stages'][OTHER_STAGE] = max(
+        0.0, total - sum(record['stages'].values()))
+    try:
+        mc.create_dir(directory)
+        fqn = os.path.join(
+            directory, f'{FILE_PREFIX}_{_run_id()}_{record["pid"]}.jsonl')
+        with open(fqn, 'a') as f:
+            f.write(json.dumps(record))
+            f.write('\n')
+    except OSError as e:
+        # timing must never stop the work
+        logging.warning(f'Could not write timing for {record["entry"]}: {e}')
+
+
+def summarize(run_id=None):
+    """
+    Writes, and logs, the count, total and percentiles of each stage, over
+    all the records of all the processes of a run.
+
+    :param run_id: str, the current run if None
+    :return: dict of stage name => statistics, or None, when there are no
+        records
+    """
+    finish_entry()
+    directory = _observable_directory()
+    if directory is None:
+        return None
+    if run_id is None:
+        run_id = _run_id()
+    durations = {}
+    counters = {}
+    for fqn in glob.glob(
+            os.path.join(directory, f'{FILE_PREFIX}_{run_id}_*.jsonl')):
+        with open(fqn) as f:
+            for line in f:
+                record = json.loads(line)
+                durations.setdefault('total', []).append(record['total'])
+                for name, duration in record['stages'].items():
+                    durations.setdefault(name, []).append(duration)
+                for name, counts in record.get(COUNTERS, {}).items():
+                    totals = counters.setdefault(name, {})
+                    for key, value in counts.items():
+                        totals[key] = totals.get(key, 0) + value
+    if len(durations) == 0:
+        return None
+    result = {}
+    for name, values in durations.items():
+        values = np.array(values)
+        stats = {'count': int(values.size),
+                 'total': float(values.sum()),
+                 'max': float(values.max())}
+        for percentile, value in zip(
+                PERCENTILES, np.percentile(values, PERCENTILES)):
+            stats[f'p{percentile}'] = float(value)
+        result[name] = stats
+        logging.info(
+            f'Stage {name:12} count {stats["count"]:6d} total '
+            f'{stats["total"]:10.3f}s p50 {stats["p50"]:.4f}s p90 '
+            f'{stats["p90"]:.4f}s p99 {stats["p99"]:.4f}s')
+    if len(counters) > 0:
+        result[COUNTERS] = counters
+        for name, counts in counters.items():
+            logging.info(f'Counters {name:9} ' + ' '.join(
+                f'{key} {value}' for key, value in counts.items()))
+    mc.write_as_yaml(
+        result,
+        os.path.join(directory, f'{FILE_PREFIX}_{run_id}_summary.yml'))
+    return result
+
+
+class TimedNameBuilder(nbc.StorageNameBuilder):
+    """The caom2pipe runners build the StorageName for an entry before doing
+    any of the work for that entry, so this is where timing for an entry
+    starts, and timing for the previous entry finishes."""
+
+    def __init__(self, name_builder):
+        super(TimedNameBuilder, self).__init__()
+        self._name_builder = name_builder
+
+    def build(self, entry):
+        start_entry(entry)
+        with stage('name'):
+            return self._name_builder.build(entry)
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2021.                            (c) 2021.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Identification and organization of the work done by the PHANGS pipeline.
+
+PHANGS releases many files per Observation (cubes, moment maps, noise and
+mask products all share one obs_id), so the functions in this module find
+the entries to be processed, and keep the entries that contribute to the same
+Observation together.
+"""
+
+import logging
+import os
+
+from collections import OrderedDict
+
+from caom2pipe import manage_composable as mc
+from caom2pipe import name_builder_composable as nbc
+from phangs2caom2.main_app import PHANGSName, get_name_bits
+
+
+LOCAL_EXTENSIONS = ('.fits', '.fits.gz')
+
+
+def _iter_local_names(directory):
+    """
+    :param directory: str where to look
+    :return: generator of (obs_id, file name) for the PHANGS files in the
+        directory, in the order os.scandir finds them. Names that do not
+        follow the PHANGS naming rules are left out. caom2pipe finds local
+        files in the working directory only, so there is no walk of
+        sub-directories.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.name.endswith(LOCAL_EXTENSIONS):
+                continue
+            try:
+                obs_id = get_name_bits(entry.name).obs_id
+            except (mc.CadcException, IndexError) as e:
+                logging.warning(f'Ignoring {entry.name}: {e}')
+                continue
+            if entry.is_file():
+                yield obs_id, entry.name
+
+
+def iter_local_files(directory):
+    """
+    Finds the PHANGS files in a directory with a single os.scandir pass,
+    handing out each one as it is found, so the work for the first file
+    starts before the scan is done, and nothing accumulates while scanning.
+
+    :param directory: str where to look
+    :return: generator of file names, in directory order
+    """
+    for ignore, file_name in _iter_local_names(directory):
+        yield file_name
+
+
+def iter_local_groups(directory):
+    """
+    Finds the PHANGS files in a directory with a single os.scandir pass,
+    grouped by obs_id. os.scandir finds names in no particular order, so no
+    group is known to be complete until the scan is done, and all the names
+    - only the names - are held before the first group is handed out. The
+    StorageName instances and work for an obs_id are still created only
+    when its group is reached. Use iter_local_files when the work is not
+    grouped.
+
+    :param directory: str where to look
+    :return: generator of (obs_id, list of file names), ordered by obs_id
+    """
+    groups = {}
+    for obs_id, file_name in _iter_local_names(directory):
+        groups.setdefault(obs_id, []).append(file_name)
+    for obs_id in sorted(groups):
+        yield obs_id, sorted(groups.pop(obs_id))
+
+
+def _iter_todo(config):
+    with open(config.work_fqn) as f:
+        for line in f:
+            entry = line.strip()
+            if len(entry) > 0:
+                yield entry
+
+
+def iter_entries(config):
+    """
+    :param config: mc.Config
+    :return: generator of entries, either the file names found in the
+        working directory, in directory order, or the content of the todo
+        file, in file order, found as they are needed
+    """
+    if config.use_local_files:
+        return iter_local_files(config.working_directory)
+    return _iter_todo(config)
+
+
+def iter_groups(config):
+    """
+    :param config: mc.Config
+    :return: generator of (obs_id, list of entries), either the file names
+        found in the working directory, or the content of the todo file
+    """
+    if config.use_local_files:
+        yield from iter_local_groups(config.working_directory)
+    else:
+        yield from group_by_obs_id(_iter_todo(config)).items()
+
+
+def get_entries(config):
+    """
+    :param config: mc.Config
+    :return: list of entries to process, either the file names found in
+        the working directory, or the content of the todo file, with the
+        entries for an obs_id next to each other
+    """
+    result = [entry for ignore, entries in iter_groups(config)
+              for entry in entries]
+    logging.debug(f'Found {len(result)} entries.')
+    return result
+
+
+def get_obs_id(entry):
+    """
+    :param entry: str file name, fully-qualified or not
+    :return: the obs_id the entry contributes to. Entries that do not
+        follow the PHANGS naming rules are their own group, so they fail,
+        and are reported, the same way as they would when executed serially.
+    """
+    try:
+        return get_name_bits(entry).obs_id
+    except (mc.CadcException, IndexError):
+        return entry
+
+
+def group_by_obs_id(entries):
+    """
+    :param entries: iterable of str file names
+    :return: OrderedDict of obs_id => list of entries, in the order in which
+        each obs_id is first encountered
+    """
+    result = OrderedDict()
+    for entry in entries:
+        result.setdefault(get_obs_id(entry), []).append(entry)
+    return result
+
+
+class ObservationNameBuilder(nbc.StorageNameBuilder):
+    """Builds one PHANGSName for all the entries that contribute to the same
+    obs_id, so that all of the files are ingested with a single blueprint
+    build, a single gen_proc call, and a single Observation write.
+
+    The work handed to the caom2pipe runners is the first entry of each
+    group - see group_leaders.
+    """
+
+    def __init__(self, groups):
+        """
+        :param groups: dict of obs_id => list of entries, as returned by
+            group_by_obs_id
+        """
+        super(ObservationNameBuilder, self).__init__()
+        self._members = {}
+        for entries in groups.values():
+            self.add(entries)
+
+    def add(self, entries):
+        """
+        :param entries: list of entries for one obs_id
+        :return: the entry that stands for the group
+        """
+        self._members[entries[0]] = [os.path.basename(ii) for ii in entries]
+        return entries[0]
+
+    def build(self, entry):
+        return PHANGSName(file_name=os.path.basename(entry),
+                          entry=entry,
+                          members=self._members.get(entry))
+
+
+def group_leaders(groups):
+    """
+    :param groups: dict of obs_id => list of entries
+    :return: list with the first entry of each group
+    """
+    return [entries[0] for entries in groups.values()]
+
+
+def stream_leaders(groups, name_builder):
+    """
+    :param groups: iterable of (obs_id, list of entries), as from
+        iter_groups
+    :param name_builder: ObservationNameBuilder that learns about each group
+        as it is reached
+    :return: generator of the first entry of each group
+    """
+    for ignore, entries in groups:
+        yield name_builder.add(entries)
+
+
+def get_pending(config, prev_exec_time, exec_time):
+    """
+    :param config: mc.Config
+    :param prev_exec_time: datetime start of the time span, exclusive
+    :param exec_time: datetime end of the time span, inclusive
+    :return: list of (float modification time, str file name) of the files
+        in the working directory that were modified within the time span,
+        ordered by modification time
+    """
+    if not config.use_local_files:
+        raise mc.CadcException(
+            'Time-boxed PHANGS execution requires use_local_files.')
+    start = prev_exec_time.timestamp()
+    end = exec_time.timestamp()
+    result = []
+    with os.scandir(config.working_directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(LOCAL_EXTENSIONS):
+                mtime = entry.stat().st_mtime
+                if start < mtime <= end:
+                    result.append((mtime, entry.name))
+    result.sort()
+    return result
+
+
+def get_time_box_entries(config, prev_exec_time, exec_time):
+    """
+    :param config: mc.Config
+    :param prev_exec_time: datetime start of the time-box, exclusive
+    :param exec_time: datetime end of the time-box, inclusive
+    :return: list of the file names in the working directory that were
+        modified within the time-box, ordered by modification time
+    """
+    return [ii[1] for ii in get_pending(config, prev_exec_time, exec_time)]